@@ -0,0 +1,14 @@
+"""
+Name        bench
+Author      David Edmondson
+
+Benchmarks for the rename pipeline, run against synthetic directory trees.
+Results are appended as JSON lines so runs can be compared between commits:
+
+    python -m bench.bench_model --sizes 1000,10000 --output bench_output.txt
+
+Flickr lookups are measured against a local stand-in server with injected
+latency and faults (bench.flickr_stub), so they need no network access:
+
+    python -m bench.bench_flickr --lookups 500 --truncate-rate 0.05
+"""
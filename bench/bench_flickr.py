@@ -0,0 +1,149 @@
+"""
+Name        bench_flickr.py
+Author      David Edmondson
+
+Measures Flickr lookup throughput and tail latency through
+Model._getNameFlickr (and so _getRedirect), against the local stand-in
+server in bench.flickr_stub. Latency, server errors, rate limiting and
+truncated pages are all injected by the stub, so runs are offline and
+repeatable. The memo is emptied first, so every lookup goes to the server.
+
+Appends one JSON line per run to the output file:
+    {"lookups": 500, "seconds": 2.1, "perSecond": 238.1, "p50": 0.051,
+     "p95": 0.068, "p99": 0.07, "max": 0.081, "failed": 3, "converted": 12,
+     "served": {...}, ...}
+
+Usage:
+    python -m bench.bench_flickr [--lookups 500] [--threads 1]
+                                 [--latency 0.05] [--jitter 0.02]
+                                 [--error-rate 0] [--rate-limit-rate 0]
+                                 [--truncate-rate 0] [--missing-rate 0.05]
+                                 [--output bench_output.txt]
+"""
+
+import sys, json, time, shutil, tempfile, argparse, threading
+from timeit import default_timer
+
+from bench.flickr_stub import FlickrStub
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def runLookups(model, ids, threads=1):
+    """Looks up every (fn, flickrId) with threads workers. Returns
+    (seconds, latencies, failed): per-lookup wall times and the number of
+    lookups that raised."""
+    latencies = []
+    failed = [0]
+    lock = threading.Lock()
+    pending = list(reversed(ids))
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                fn, flickrId = pending.pop()
+            start = default_timer()
+            try:
+                model._getNameFlickr(fn, flickrId)
+            except EnvironmentError:
+                with lock:
+                    failed[0] += 1
+            elapsed = default_timer() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = default_timer()
+    workers = [threading.Thread(target=worker) for _ in xrange(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return default_timer() - start, sorted(latencies), failed[0]
+
+def benchLookups(args, dataRoot):
+    from rename_model import Model
+
+    ids = []
+    titles = {}
+    for i in xrange(args.lookups):
+        flickrId = str(6000000000 + i)
+        ids.append(("{}_a7d7351d30_o.jpg".format(flickrId), flickrId))
+        # A share of IDs are unknown, so lookups fall back to the file name
+        if i % 1000 >= args.missing_rate * 1000:
+            titles[flickrId] = "Stub photo number {}".format(i)
+
+    stub = FlickrStub(titles, latency=args.latency, jitter=args.jitter,
+                      errorRate=args.error_rate,
+                      rateLimitRate=args.rate_limit_rate,
+                      truncateRate=args.truncate_rate, seed=args.seed)
+    model = Model(dataRoot=dataRoot)
+    model.changeSettings({"delimiter": " ", "flickr": True, "capital": False})
+    model.stats.enabled = True
+    model.memoFlickr = {}
+    model.FLICKR_SITE = model.FLICKR_PAGE_SITE = stub.start()
+    try:
+        seconds, latencies, failed = runLookups(model, ids, args.threads)
+    finally:
+        stub.stop()
+        model.close()
+
+    return {"lookups": len(ids),
+            "threads": args.threads,
+            "seconds": seconds,
+            "perSecond": len(ids) / seconds if seconds else None,
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "p99": _percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+            "failed": failed,
+            "converted": len(ids) - failed - len(model.memoFlickr),
+            "httpRequests": model.stats.counters["httpRequests"],
+            "retries": model.stats.counters["retries"],
+            "served": stub.served,
+            "stub": {"latency": args.latency,
+                     "jitter": args.jitter,
+                     "errorRate": args.error_rate,
+                     "rateLimitRate": args.rate_limit_rate,
+                     "truncateRate": args.truncate_rate,
+                     "missingRate": args.missing_rate,
+                     "seed": args.seed}}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--missing-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.txt")
+    args = parser.parse_args(argv)
+
+    workDir = tempfile.mkdtemp()
+    try:
+        # Settings and memo files go here, never the user's own
+        result = benchLookups(args, workDir)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    result["stage"] = "_getNameFlickr"
+    result["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    out = open(args.output, "a")
+    try:
+        out.write(json.dumps(result, sort_keys=True) + "\n")
+    finally:
+        out.close()
+    sys.stdout.write("{lookups} lookups in {seconds:.2f}s ({perSecond:.1f}/s)"
+                     " p50 {p50:.4f}s p95 {p95:.4f}s p99 {p99:.4f}s"
+                     " failed {failed}\n".format(**result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Name        bench_memory.py
+Author      David Edmondson
+
+Measures peak memory per file for the stages which hold a whole tree in
+memory - createRenameList, the Presenter's _updateRenameList, and the view
+feed (progressive renames appended to the view) - against synthetic trees,
+and checks each against a budget in bytes per file.
+
+Peak memory is measured with tracemalloc where available, reporting the
+biggest allocation sites. Without it (Python 2), each stage runs in a forked
+child, and the peak is the rise in resident set size; the biggest sites are
+then approximated by the object types the stage left behind.
+
+Each size appends one JSON line per stage to the output file:
+    {"commit": ..., "stage": "createRenameList", "files": 100000,
+     "peak": 23456789, "perFile": 234.5, "budget": 400, "method": "rss",
+     "sites": [["str", 1234567], ...], ...}
+
+Usage:
+    python -m bench.bench_memory [--sizes 10000,100000,1000000]
+                                 [--output bench_output.txt]
+"""
+
+import os, sys, gc, json, time, shutil, tempfile, argparse, platform
+from collections import defaultdict
+
+from bench.synthetic import SyntheticTree
+from bench.bench_model import _commit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+# Peak bytes per file in the tree. Exceeding one fails the memory tests.
+BUDGETS = {"createRenameList": 300,
+           "_updateRenameList": 700,
+           "viewFeed": 350}
+# Allocation sites (or object types) reported per stage
+TOP_SITES = 10
+
+def canMeasure():
+    return tracemalloc is not None or (hasattr(os, "fork") and
+                                       resource is not None and
+                                       os.path.isfile("/proc/self/statm"))
+
+def measurePeak(func, top=TOP_SITES):
+    """Runs func, and returns {"peak": bytes, "method": ..., "sites":
+    [(site, bytes), ...]}, biggest sites first."""
+    if tracemalloc is not None:
+        return _measureTracemalloc(func, top)
+    return _measureForked(func, top)
+
+def _measureTracemalloc(func, top):
+    gc.collect()
+    tracemalloc.start(1)
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().statistics("lineno")[:top]
+    finally:
+        tracemalloc.stop()
+    del result
+    return {"peak": peak,
+            "method": "tracemalloc",
+            "sites": [(str(stat.traceback), stat.size) for stat in stats]}
+
+def _currentRss():
+    f = open("/proc/self/statm")
+    try:
+        return int(f.read().split()[1]) * resource.getpagesize()
+    finally:
+        f.close()
+
+def _peakRss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on Mac OS X, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _census():
+    """Bytes held by each type of object, counting strings once through the
+    containers which hold them."""
+    sizes = defaultdict(int)
+    seen = set()
+    for obj in gc.get_objects():
+        sizes[type(obj).__name__] += sys.getsizeof(obj)
+        for ref in gc.get_referents(obj):
+            if isinstance(ref, basestring) and id(ref) not in seen:
+                seen.add(id(ref))
+                sizes[type(ref).__name__] += sys.getsizeof(ref)
+    return sizes
+
+def _measureForked(func, top):
+    """Runs func in a forked child, so its peak is its own and its side
+    effects are discarded."""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read)
+            gc.collect()
+            before = _census()
+            baseline = _currentRss()
+            func()
+            peak = max(0, _peakRss() - baseline)
+            after = _census()
+            grown = sorted(((name, size - before.get(name, 0))
+                            for name, size in after.iteritems()),
+                           key=lambda site: -site[1])[:top]
+            out = os.fdopen(write, "w")
+            out.write(json.dumps({"peak": peak,
+                                  "method": "rss",
+                                  "sites": [site for site in grown
+                                            if site[1] > 0]}))
+            out.close()
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write)
+    data = os.fdopen(read).read()
+    _, status = os.waitpid(pid, 0)
+    if status or not data:
+        raise RuntimeError("memory measurement failed")
+    return json.loads(data)
+
+def checkBudget(stage, files, measured, budgets=BUDGETS):
+    """Returns a report of the biggest sites if stage went over its budget,
+    or None."""
+    perFile = float(measured["peak"]) / files
+    budget = budgets[stage]
+    if perFile <= budget:
+        return None
+    lines = ["{} used {:.0f} bytes per file over {} files, budget {} "
+             "({}):".format(stage, perFile, files, budget,
+                            measured["method"])]
+    for site, size in measured["sites"]:
+        lines.append("  {:>12} bytes  {}".format(size, site))
+    return "\n".join(lines)
+
+def measureStages(model, presenter, root):
+    """Measures each stage for the tree at root. Returns a list of
+    (stage, measurement) in order."""
+    results = [("createRenameList",
+                measurePeak(lambda: model.createRenameList(root)))]
+
+    # Later stages need the rename list, and renames published to feed
+    model.publishRenames = True
+    model.createRenameList(root)
+    model.publishRenames = False
+    renameList = model.getRenameList()
+    results.append(("_updateRenameList",
+                    measurePeak(lambda: presenter._updateRenameList(
+                        renameList))))
+    results.append(("viewFeed",
+                    measurePeak(lambda: presenter._appendRenames(root))))
+    return results
+
+def makeModel(dataRoot, tree, transport=None):
+    """Returns a Model with the tree's Flickr titles memoized, and a
+    Presenter with mock Interactor and View."""
+    from rename_model import Model
+    from rename_presenter import Presenter
+    from test.rename_tests_objects import Interactor, View
+
+    model = Model(dataRoot=dataRoot, transport=transport)
+    model.changeSettings({"delimiter": " ", "flickr": True, "capital": True})
+    model.memoFlickr = dict(tree.flickrTitles)
+    return model, Presenter(model, Interactor(), View(), prefetch=False)
+
+def benchSize(tree, workDir):
+    root = os.path.join(workDir, "tree")
+    os.makedirs(root)
+    tree.build(root)
+    model, presenter = makeModel(os.path.join(workDir, "data"), tree)
+
+    output = []
+    for stage, measured in measureStages(model, presenter, root):
+        output.append({
+            "stage": stage,
+            "files": tree.files,
+            "peak": measured["peak"],
+            "perFile": float(measured["peak"]) / tree.files,
+            "budget": BUDGETS[stage],
+            "method": measured["method"],
+            "sites": measured["sites"],
+            "report": checkBudget(stage, tree.files, measured)})
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--output", default="bench_output.txt")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if not canMeasure():
+        parser.error("needs tracemalloc, or fork and /proc")
+
+    common = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    overBudget = False
+    out = open(args.output, "a")
+    try:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            tree = SyntheticTree(size, depth=args.depth, fanout=args.fanout,
+                                 seed=args.seed)
+            workDir = tempfile.mkdtemp()
+            try:
+                for result in benchSize(tree, workDir):
+                    result.update(common)
+                    result["tree"] = tree.describe()
+                    out.write(json.dumps(result, sort_keys=True) + "\n")
+                    out.flush()
+                    sys.stdout.write("{files:>8} {stage:<20} {perFile:>8.1f} "
+                                     "bytes/file (budget {budget})\n"
+                                     .format(**result))
+                    if result["report"]:
+                        overBudget = True
+                        sys.stdout.write(result["report"] + "\n")
+            finally:
+                shutil.rmtree(workDir)
+    finally:
+        out.close()
+    return 1 if overBudget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Name        bench_model.py
+Author      David Edmondson
+
+Times the Model pipeline and the Presenter's list update against synthetic
+trees of increasing size. Flickr-style names are resolved from a pre-seeded
+memo, so no network access is needed. Settings and memo files are written to a
+temporary data root, never the user's own.
+
+Each size appends one JSON line per stage to the output file:
+    {"commit": ..., "stage": "createRenameList", "files": 10000,
+     "seconds": 1.23, "perFile": 0.000123, ...}
+
+Usage:
+    python -m bench.bench_model [--sizes 1000,10000,100000,1000000]
+                                [--output bench_output.txt] [--repeat 1]
+"""
+
+import os, sys, json, time, shutil, tempfile, argparse, platform, subprocess
+import itertools
+from timeit import default_timer
+
+from bench.synthetic import SyntheticTree
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+# _checkDuplicates is timed on a sample of calls against a full rename list
+DUPLICATE_SAMPLE = 1000
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _time(func, repeat):
+    """Returns the best wall time of repeat calls."""
+    best = None
+    for _ in xrange(repeat):
+        start = default_timer()
+        func()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchSize(tree, workDir, repeat=1):
+    """Builds one tree and times each stage. Returns a list of result dicts."""
+    from rename_model import Model
+    from rename_presenter import Presenter
+    from test.rename_tests_objects import Interactor, View
+
+    root = os.path.join(workDir, "tree")
+    os.makedirs(root)
+    tree.build(root)
+
+    model = Model(dataRoot=os.path.join(workDir, "data"))
+    model.changeSettings({"delimiter": " ", "flickr": True, "capital": True})
+    model.memoFlickr = dict(tree.flickrTitles)
+
+    results = {}
+    results["createRenameList"] = _time(
+        lambda: model.createRenameList(root), repeat)
+    renameList = model.getRenameList()
+
+    names = [fn for _, _, files in os.walk(root) for fn in files
+             if model._isImage(fn)]
+    results["_convertName"] = _time(
+        lambda: [model._convertName(fn) for fn in names], repeat)
+
+    sample = list(itertools.islice(renameList.itervalues(), DUPLICATE_SAMPLE))
+    results["_checkDuplicates"] = _time(
+        lambda: [model._checkDuplicates(fn) for fn in sample], repeat)
+
+    presenter = Presenter(model, Interactor(), View(), prefetch=False)
+    results["_updateRenameList"] = _time(
+        lambda: presenter._updateRenameList(renameList), repeat)
+
+    # Renaming changes the tree, so this always runs once and last
+    results["renameFiles"] = _time(model.renameFiles, 1)
+    model.close()
+
+    output = []
+    for stage, seconds in sorted(results.items()):
+        calls = tree.files
+        if stage == "_convertName":
+            calls = len(names)
+        elif stage == "_checkDuplicates":
+            calls = len(sample)
+        elif stage == "renameFiles":
+            calls = len(renameList)
+        output.append({
+            "stage": stage,
+            "files": tree.files,
+            "calls": calls,
+            "renamed": len(renameList),
+            "seconds": seconds,
+            "perCall": seconds / calls if calls else None})
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--output", default="bench_output.txt")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--flickr-ratio", type=float, default=0.2)
+    parser.add_argument("--collision-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    workDir = tempfile.mkdtemp()
+
+    common = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    out = open(args.output, "a")
+    try:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            tree = SyntheticTree(size, depth=args.depth, fanout=args.fanout,
+                                 flickrRatio=args.flickr_ratio,
+                                 collisionRate=args.collision_rate,
+                                 seed=args.seed)
+            sizeDir = tempfile.mkdtemp(dir=workDir)
+            try:
+                for result in benchSize(tree, sizeDir, args.repeat):
+                    result.update(common)
+                    result["tree"] = tree.describe()
+                    out.write(json.dumps(result, sort_keys=True) + "\n")
+                    out.flush()
+                    sys.stdout.write("{files:>8} {stage:<20} {seconds:.4f}s\n"
+                                     .format(**result))
+            finally:
+                shutil.rmtree(sizeDir)
+    finally:
+        out.close()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Name        flickr_stub.py
+Author      David Edmondson
+
+A local stand-in for the two Flickr pages the Model reads, so Flickr lookups
+can be tested and benchmarked offline:
+
+    HEAD /photo.gne?id=[ID]     302 to /photos/[owner]/[ID], 302 to a signin
+                                page for private IDs, or 404 for unknown IDs
+    GET /photos/[owner]/[ID]    200 with "<title>[title] | Flickr</title>"
+
+Faults are injected at configurable rates, each independently per request:
+latency (a fixed delay plus random jitter), server errors (500), rate
+limiting (429 with Retry-After) and truncated bodies cut off before the end
+of the title. Faults are drawn from a seeded generator, so a run is
+repeatable given the same request order.
+
+Usage:
+    stub = FlickrStub({"6795654383": "Apartment Roof"}, latency=0.05)
+    model.FLICKR_SITE = model.FLICKR_PAGE_SITE = stub.start()
+    ...
+    stub.stop()
+"""
+
+import re, sys, time, socket, random, threading, BaseHTTPServer, SocketServer
+
+OWNER = "10000000@N00"
+PAGE_HEAD = ('<!DOCTYPE html>\n<html lang="en-us">\n<head>\n'
+             '<meta charset="utf-8">\n')
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, clientAddress):
+        # Clients stop reading once they have the title, like the Model does
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, clientAddress)
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.server.stub._handle(self, head=True)
+
+    def do_GET(self):
+        self.server.stub._handle(self, head=False)
+
+class FlickrStub(object):
+    def __init__(self, titles, private=(), latency=0.0, jitter=0.0,
+                 errorRate=0.0, rateLimitRate=0.0, truncateRate=0.0, seed=0):
+        self.titles = titles
+        self.private = set(private)
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.rateLimitRate = rateLimitRate
+        self.truncateRate = truncateRate
+
+        # Counts of responses by kind, for checking what a run ran into
+        self.served = {"redirect": 0, "page": 0, "notFound": 0, "error": 0,
+                       "rateLimited": 0, "truncated": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Serves on a free localhost port in a background thread. Returns
+        "host:port", usable as a Model Flickr site."""
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return "{}:{}".format(*self._server.server_address)
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def _roll(self):
+        """Draws the delay and fault for one request."""
+        with self._lock:
+            delay = self.latency + self._random.random() * self.jitter
+            roll = self._random.random()
+        if roll < self.errorRate:
+            return delay, "error"
+        roll -= self.errorRate
+        if roll < self.rateLimitRate:
+            return delay, "rateLimited"
+        roll -= self.rateLimitRate
+        if roll < self.truncateRate:
+            return delay, "truncated"
+        return delay, None
+
+    def _count(self, kind):
+        with self._lock:
+            self.served[kind] += 1
+
+    def _handle(self, request, head):
+        delay, fault = self._roll()
+        if delay:
+            time.sleep(delay)
+        if fault == "error":
+            self._count(fault)
+            return self._send(request, 500, body="Internal Server Error")
+        if fault == "rateLimited":
+            self._count(fault)
+            return self._send(request, 429, {"Retry-After": "1"},
+                              "Too Many Requests")
+
+        if head:
+            match = re.match(r"/photo\.gne\?id=(\d+)$", request.path)
+            flickrId = match and match.group(1)
+            if flickrId in self.private:
+                self._count("redirect")
+                return self._send(request, 302, {
+                    "Location": "https://www.flickr.com/signin/?redir="
+                                "/photos/{}/{}/".format(OWNER, flickrId)})
+            if flickrId in self.titles:
+                self._count("redirect")
+                return self._send(request, 302, {
+                    "Location": "/photos/{}/{}/".format(OWNER, flickrId)})
+        else:
+            match = re.match(r"/photos/[^/]+/(\d+)/?$", request.path)
+            flickrId = match and match.group(1)
+            if flickrId in self.titles:
+                body = "{}<title>{} | Flickr - Photo Sharing!</title>\n".format(
+                    PAGE_HEAD, self.titles[flickrId])
+                if fault == "truncated":
+                    self._count(fault)
+                    body = body[:body.index("<title>") + 10]
+                else:
+                    self._count("page")
+                return self._send(request, 200, body=body)
+
+        self._count("notFound")
+        self._send(request, 404, body="Not Found")
+
+    def _send(self, request, status, headers=None, body=""):
+        request.send_response(status)
+        for key, value in (headers or {}).iteritems():
+            request.send_header(key, value)
+        request.send_header("Content-Type", "text/html; charset=utf-8")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        if request.command != "HEAD":
+            request.wfile.write(body)
@@ -0,0 +1,96 @@
+"""
+Name        synthetic.py
+Author      David Edmondson
+
+Generates reproducible synthetic image trees for benchmarks. Files are empty;
+only names and directory shape matter to the Model.
+"""
+
+import os, random
+
+WORDS = ("sketch", "ref", "pose", "hand", "study", "tree", "light", "armor",
+         "face", "castle", "robot", "fabric", "cloud", "city", "FINAL", "wip",
+         "Color", "lineart", "old", "new")
+EXTENSIONS = (".jpg", ".JPG", ".png", ".PNG", ".tif", ".jpeg", ".gif", ".bmp")
+OTHER_EXTENSIONS = (".txt", ".psd", ".ini", ".db")
+
+class SyntheticTree(object):
+    """Description of a generated tree. Call build() to write it to disk."""
+    def __init__(self, files, depth=3, fanout=8, flickrRatio=0.2,
+                 collisionRate=0.05, otherRatio=0.05, seed=0):
+        self.files = files
+        self.depth = depth
+        self.fanout = fanout
+        self.flickrRatio = flickrRatio
+        self.collisionRate = collisionRate
+        self.otherRatio = otherRatio
+        self.seed = seed
+
+        # Flickr ID -> title, for seeding the memo without network access
+        self.flickrTitles = {}
+
+    def describe(self):
+        return {"files": self.files,
+                "depth": self.depth,
+                "fanout": self.fanout,
+                "flickrRatio": self.flickrRatio,
+                "collisionRate": self.collisionRate,
+                "otherRatio": self.otherRatio,
+                "seed": self.seed}
+
+    def _dirs(self):
+        """Relative directory paths, breadth-first, up to depth levels."""
+        dirs = [""]
+        level = [""]
+        for d in xrange(self.depth):
+            nextLevel = []
+            for parent in level:
+                for i in xrange(self.fanout):
+                    nextLevel.append(os.path.join(parent, "dir{}_{}".format(d, i)))
+            dirs.extend(nextLevel)
+            level = nextLevel
+        return dirs
+
+    def _name(self, rand, used):
+        """Picks one file name, avoiding exact name reuse within a directory."""
+        roll = rand.random()
+        if used and roll < self.collisionRate:
+            # Same words, different delimiters - converts to the same name
+            base, ext = rand.choice(used).rsplit(".", 1)
+            name = base.replace(" ", "_").replace("-", "_") + "_." + ext
+        elif roll < self.collisionRate + self.flickrRatio:
+            flickrId = str(rand.randint(10 ** 7, 10 ** 10 - 1))
+            name = "{}_{:010x}_{}.jpg".format(
+                flickrId, rand.getrandbits(40), rand.choice("ozmb"))
+            self.flickrTitles[flickrId] = "{} {}.jpg".format(
+                rand.choice(WORDS), rand.choice(WORDS))
+        elif roll < self.collisionRate + self.flickrRatio + self.otherRatio:
+            name = "{}{}".format(rand.choice(WORDS), rand.choice(OTHER_EXTENSIONS))
+        else:
+            words = [rand.choice(WORDS) for _ in xrange(rand.randint(1, 4))]
+            words.append(str(rand.randint(0, 999)))
+            name = rand.choice((" ", "_", "-", "__", ".")).join(words)
+            name += rand.choice(EXTENSIONS)
+        return name
+
+    def build(self, root):
+        """Creates the tree under root. Returns the number of files created."""
+        rand = random.Random(self.seed)
+        dirs = self._dirs()
+        for d in dirs:
+            if d:
+                os.makedirs(os.path.join(root, d))
+
+        used = dict((d, []) for d in dirs)
+        names = dict((d, set()) for d in dirs)
+        created = 0
+        while created < self.files:
+            d = rand.choice(dirs)
+            name = self._name(rand, used[d])
+            if name in names[d]:
+                continue
+            names[d].add(name)
+            used[d].append(name)
+            open(os.path.join(root, d, name), "wb").close()
+            created += 1
+        return created
@@ -0,0 +1,219 @@
+"""
+Name        collage_layout.py
+Author      David Edmondson
+
+Packs a list of images into a collage using justified rows: images keep their
+aspect ratio, every row is scaled to exactly fill the collage width, and rows
+are kept close to a target height. Layout is a single linear pass over the
+images, so 10k references lay out in a few milliseconds.
+
+Adding or removing images only re-flows rows from the first changed row, and
+stops as soon as the new row breaks line up with the old ones again.
+
+Image dimensions are read from file headers by getImageSize, which only reads
+the first few bytes of each file and needs no imaging library.
+"""
+
+import struct
+
+class Layout(object):
+    def __init__(self, width, rowHeight=200, spacing=4):
+        if width <= 0 or rowHeight <= 0:
+            raise ValueError("collage width and row height must be positive")
+        self.width = width
+        self.rowHeight = rowHeight
+        self.spacing = spacing
+
+        # Parallel lists, in collage order
+        self._keys = []
+        self._aspects = []
+        self._index = {}
+
+        # Each row is [start index, height]. Row y positions are cumulative.
+        self._rows = []
+        self._rowY = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def add(self, images):
+        """Appends images, given as (key, width, height). Only the last,
+        unfinished row is re-flowed. If any image is invalid, none are
+        added."""
+        images = list(images)
+        batch = set()
+        for key, width, height in images:
+            if key in self._index or key in batch:
+                raise KeyError("image already in layout: {}".format(key))
+            if width <= 0 or height <= 0:
+                raise ValueError("invalid size for {}".format(key))
+            batch.add(key)
+        for key, width, height in images:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._aspects.append(float(width) / height)
+        self._reflow(max(len(self._rows) - 1, 0))
+
+    def remove(self, keys):
+        """Removes images by key. Rows before the first removed image are
+        kept as-is. If any key is not in the layout, nothing is removed."""
+        keys = set(keys)
+        positions = sorted(self._index[key] for key in keys)
+        if not positions:
+            return
+        for key in keys:
+            del self._index[key]
+        first = positions[0]
+        for pos in reversed(positions):
+            del self._keys[pos]
+            del self._aspects[pos]
+        for i in xrange(first, len(self._keys)):
+            self._index[self._keys[i]] = i
+        self._reflow(self._findRow(first), len(positions), positions[-1])
+
+    def getSize(self):
+        """Returns the (width, height) of the finished collage."""
+        if not self._rows:
+            return self.width, 0
+        return self.width, int(round(self._rowY[-1] + self._rows[-1][1]))
+
+    def getPositions(self):
+        """Returns a list of (key, x, y, width, height), in collage order."""
+        positions = []
+        rows = self._rows
+        for rowNum, (start, height) in enumerate(rows):
+            if rowNum + 1 < len(rows):
+                end = rows[rowNum + 1][0]
+            else:
+                end = len(self._keys)
+            y = int(round(self._rowY[rowNum]))
+            h = int(round(height))
+            x = 0.0
+            for i in xrange(start, end):
+                w = self._aspects[i] * height
+                left = int(round(x))
+                positions.append(
+                    (self._keys[i], left, y, int(round(x + w)) - left, h))
+                x += w + self.spacing
+        return positions
+
+    def _findRow(self, pos):
+        """Binary search for the row containing image index pos."""
+        lo, hi = 0, len(self._rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._rows[mid][0] <= pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return max(lo - 1, 0)
+
+    def _reflow(self, rowNum, removed=0, lastRemoved=-1):
+        """Rebuilds rows from rowNum onwards. Old rows starting after the last
+        removed image are shifted back by the number of removed images; once a
+        new row starts at a shifted old position, the remaining rows are
+        unchanged."""
+        oldRows = self._rows[rowNum:]
+        del self._rows[rowNum:]
+        del self._rowY[rowNum:]
+        oldStarts = {}
+        for i, (start, height) in enumerate(oldRows):
+            if i and start > lastRemoved:
+                oldStarts[start - removed] = i
+
+        n = len(self._keys)
+        start = oldRows[0][0] if oldRows else 0
+        start = min(start, n)
+        if rowNum:
+            y = self._rowY[-1] + self._rows[-1][1] + self.spacing
+        else:
+            y = 0.0
+
+        while start < n:
+            if start in oldStarts:
+                for oldStart, height in oldRows[oldStarts[start]:]:
+                    self._rows.append([oldStart - removed, height])
+                    self._rowY.append(y)
+                    y += height + self.spacing
+                return
+
+            aspect = 0.0
+            end = start
+            height = self.rowHeight
+            while end < n:
+                aspect += self._aspects[end]
+                end += 1
+                gaps = self.spacing * (end - start - 1)
+                if aspect * self.rowHeight + gaps >= self.width:
+                    height = (self.width - gaps) / aspect
+                    break
+
+            self._rows.append([start, height])
+            self._rowY.append(y)
+            y += height + self.spacing
+            start = end
+
+def getImageSize(fn):
+    """Reads the (width, height) of an image from its header. Returns None if
+    the format is not recognized."""
+    f = open(fn, "rb")
+    try:
+        head = f.read(32)
+        if head.startswith("\x89PNG\r\n\x1a\n") and len(head) >= 24:
+            return struct.unpack(">II", head[16:24])
+        if head[:6] in ("GIF87a", "GIF89a"):
+            return struct.unpack("<HH", head[6:10])
+        if head.startswith("BM") and len(head) >= 26:
+            width, height = struct.unpack("<ii", head[18:26])
+            return width, abs(height)
+        if head[:4] in ("II*\x00", "MM\x00*"):
+            return _getSizeTiff(f, head[:2])
+        if head.startswith("\xff\xd8"):
+            return _getSizeJpeg(f)
+        if fn.lower().endswith(".tga") and len(head) >= 16:
+            return struct.unpack("<HH", head[12:16])
+    finally:
+        f.close()
+    return None
+
+def _getSizeJpeg(f):
+    """Walks JPEG markers up to the first start-of-frame segment."""
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != "\xff":
+            return None
+        code = ord(marker[1])
+        # Standalone markers have no length
+        if code == 0xff:
+            f.seek(-1, 1)
+            continue
+        if code == 0x01 or 0xd0 <= code <= 0xd9:
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(length - 2, 1)
+
+def _getSizeTiff(f, order):
+    """Reads ImageWidth and ImageLength from the first TIFF directory."""
+    endian = "<" if order == "II" else ">"
+    f.seek(4)
+    offset = struct.unpack(endian + "I", f.read(4))[0]
+    f.seek(offset)
+    count = struct.unpack(endian + "H", f.read(2))[0]
+    size = {}
+    for _ in xrange(count):
+        tag, kind, _, value = struct.unpack(endian + "HHI4s", f.read(12))
+        if tag in (256, 257):
+            if kind == 3:
+                size[tag] = struct.unpack(endian + "H", value[:2])[0]
+            else:
+                size[tag] = struct.unpack(endian + "I", value)[0]
+    if 256 in size and 257 in size:
+        return size[256], size[257]
+    return None
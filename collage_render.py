@@ -0,0 +1,124 @@
+"""
+Name        collage_render.py
+Author      David Edmondson
+
+Renders a collage Layout to disk one horizontal strip at a time, so peak memory
+depends on the strip size and the number of workers, never on the size of the
+whole collage.
+
+Strips are made of whole layout rows, so every source image is decoded exactly
+once. JPEG sources are decoded at reduced scale (DCT scaling) straight to the
+size they are drawn at. Other formats can only be decoded at full size, so
+those decodes take turns across workers: at most one full-size image is held
+at a time, and it is scaled down before the next is decoded. Strips are
+rendered by a thread pool - decoding and resizing release the GIL - and written
+in order as a binary PPM, which can be streamed without holding the image in
+memory and converted by any tool. The PPM is written next to the output file
+and only renamed into place once complete, so a failed render leaves any
+earlier output as it was.
+
+Requires PIL (or Pillow) for decoding; everything else is standard library.
+"""
+
+import os, threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Held while a source is decoded at full size
+_fullDecodeLock = threading.Lock()
+
+def render(positions, sources, fn, size, stripHeight=1024, workers=4,
+           background=(255, 255, 255)):
+    """Renders (key, x, y, width, height) positions from Layout.getPositions
+    to a PPM file. sources maps each key to its image path. Returns the number
+    of strips written."""
+    if Image is None:
+        raise ImportError("PIL is required to render collages")
+
+    width, height = size
+    strips = _planStrips(positions, height, stripHeight)
+    pool = ThreadPool(workers)
+    pending = deque()
+    partFn = fn + ".part"
+    f = open(partFn, "wb")
+    done = False
+    try:
+        f.write("P6\n{} {}\n255\n".format(width, height))
+        for top, bottom, items in strips:
+            pending.append(pool.apply_async(
+                _renderStrip,
+                (items, sources, width, top, bottom, background)))
+            # Keep at most two strips per worker in flight
+            if len(pending) >= workers * 2:
+                f.write(pending.popleft().get())
+        while pending:
+            f.write(pending.popleft().get())
+        done = True
+    finally:
+        f.close()
+        pool.terminate()
+        if not done:
+            os.remove(partFn)
+    if os.name == "nt" and os.path.exists(fn):
+        # No atomic replace on Windows
+        os.remove(fn)
+    os.rename(partFn, fn)
+    return len(strips)
+
+def _planStrips(positions, height, stripHeight):
+    """Groups positions into (top, bottom, items) strips made of whole rows,
+    at most stripHeight tall unless a single row is taller. Strips cover the
+    full collage height, including the spacing between rows."""
+    rows = {}
+    for item in positions:
+        _, _, y, _, h = item
+        rows.setdefault(y, []).append(item)
+
+    strips = []
+    top = 0
+    items = []
+    for y in sorted(rows):
+        rowBottom = max(item[2] + item[4] for item in rows[y])
+        if items and rowBottom - top > stripHeight:
+            strips.append((top, y, items))
+            top, items = y, []
+        items.extend(rows[y])
+    if items or top < height:
+        strips.append((top, height, items))
+    return strips
+
+def _renderStrip(items, sources, width, top, bottom, background):
+    """Decodes, scales and pastes every image in a strip. Returns raw RGB
+    bytes for the strip."""
+    strip = Image.new("RGB", (width, bottom - top), background)
+    for key, x, y, w, h in items:
+        img = _loadScaled(sources[key], w, h)
+        strip.paste(img, (x, y - top))
+        del img
+    if hasattr(strip, "tobytes"):
+        return strip.tobytes()
+    return strip.tostring()
+
+def _loadScaled(fn, width, height):
+    """Opens an image and decodes it at the smallest scale that is still
+    larger than the target size, then resizes to fit."""
+    img = Image.open(fn)
+    if img.format == "JPEG":
+        # Decode at 1/2, 1/4 or 1/8 scale instead of full size
+        img.draft("RGB", (width, height))
+        return _fit(img, width, height)
+    with _fullDecodeLock:
+        scaled = _fit(img, width, height)
+        # Free the full-size image before the next decode starts
+        del img
+    return scaled
+
+def _fit(img, width, height):
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img.resize((width, height), Image.BILINEAR)
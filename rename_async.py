@@ -0,0 +1,391 @@
+"""
+Name        rename_async.py
+Author      David Edmondson
+
+Streaming, event-driven versions of scan, resolve and rename, for embedding
+the Model in services without a thread per job.
+
+Python 2 has no asyncio, so this is built on asyncore: every Flickr lookup is
+a small state machine on a non-blocking socket, and all of them share one
+select loop in the calling thread - thousands can be in flight at once. The
+directory walk runs in a single background thread, feeding the loop through a
+queue. Results come out of generators as soon as they are ready:
+
+    stream = AsyncModel(model, concurrency=200)
+    for old, new, flags in stream.createRenameList(path):
+        ...
+    for old, new in stream.renameFiles():
+        ...
+
+Lookups run ahead of the results, but results are released in walk order, so
+the rename list and its duplicate numbering are identical to those from
+Model.createRenameList. Failed lookups are handled as in the Model: the name
+is converted locally and the ID queued for a later retry. Host names are
+resolved with a blocking DNS call, once per connection.
+"""
+
+import os, sys, socket, asyncore, threading
+from collections import deque
+from Queue import Queue, Empty, Full
+from timeit import default_timer
+
+from rename_plan import RenamePlan, FLAG_FLICKR, FLAG_DUPLICATE
+from rename_dirfd import DirFds
+
+# Returned by a stream source when no item is ready yet
+_WAIT = object()
+
+class _HttpRequest(asyncore.dispatcher):
+    """One HTTP/1.0 request on a non-blocking socket. Calls done(status,
+    headers, body) or failed(error) exactly once. Only the first limit bytes
+    of the body are read."""
+    def __init__(self, socketMap, site, method, path, limit, timeout, done,
+                 failed):
+        asyncore.dispatcher.__init__(self, map=socketMap)
+        host, _, port = site.partition(":")
+        self.method = method
+        self.deadline = default_timer() + timeout
+        self._out = ("{} {} HTTP/1.0\r\nHost: {}\r\nConnection: close\r\n\r\n"
+                     .format(method, path, host))
+        self._in = []
+        self._limit = limit
+        self._done = done
+        self._failed = failed
+        self._finished = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect((host, int(port or 80)))
+        except socket.error as e:
+            self.fail(e)
+
+    def writable(self):
+        return not self.connected or bool(self._out)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+
+    def handle_read(self):
+        self._in.append(self.recv(8192))
+        data = "".join(self._in)
+        head, sep, body = data.partition("\r\n\r\n")
+        if sep and (self.method == "HEAD" or len(body) >= self._limit):
+            self._finish(data)
+
+    def handle_close(self):
+        self._finish("".join(self._in))
+
+    def handle_error(self):
+        self.fail(sys.exc_info()[1])
+
+    def fail(self, error):
+        if not self._finished:
+            self._finished = True
+            self.close()
+            self._failed(error)
+
+    def cancel(self):
+        """Closes the request without calling back."""
+        self._finished = True
+        self.close()
+
+    def _finish(self, data):
+        if self._finished:
+            return
+        head, sep, body = data.partition("\r\n\r\n")
+        lines = head.split("\r\n")
+        try:
+            status = int(lines[0].split()[1])
+        except (IndexError, ValueError):
+            return self.fail(IOError("incomplete HTTP response"))
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        self._finished = True
+        self.close()
+        self._done(status, headers, body[:self._limit])
+
+class _Result(object):
+    """A name which needed no network access."""
+    finished = True
+
+    def __init__(self, key, fn, name, flags):
+        self.key = key
+        self.fn = fn
+        self.name = name
+        self.flags = flags
+
+class _FlickrLookup(object):
+    """Redirect, then page, then title - the same steps as
+    Model._getNameFlickr, driven by socket events."""
+    def __init__(self, stream, key, fn, flickrId):
+        self.key = key
+        self.fn = fn
+        self.name = None
+        self.flags = 0
+        self.finished = False
+        self._stream = stream
+        self._model = stream.model
+        self._flickrId = flickrId
+        self._location = None
+
+        self._model.stats.count("memoMisses")
+        self._request(self._model.FLICKR_SITE, "HEAD",
+                      "/photo.gne?id=" + flickrId, 0, self._redirected)
+
+    def _request(self, site, method, path, limit, done):
+        self._model.stats.count("httpRequests")
+        _HttpRequest(self._stream._map, site, method, path, limit,
+                     self._model.HTTP_TIMEOUT, done, self._failed)
+
+    def _redirected(self, status, headers, body):
+        if status == 429 or status >= 500:
+            return self._failed(IOError("{} returned {}".format(
+                self._model.FLICKR_SITE, status)))
+        location = headers.get("location")
+        if location:
+            location = location.rstrip("/")
+        if not self._model._isPublicPhoto(location):
+            self._model._flickrUnavailable.add(self._flickrId)
+            return self._succeeded(self._model._convertName(self.fn))
+        self._location = location
+        self._page(0)
+
+    def _page(self, retry):
+        if retry:
+            self._model.stats.count("retries")
+        self._request(self._model.FLICKR_PAGE_SITE, "GET", self._location,
+                      300 + (retry * 50),
+                      lambda status, headers, body:
+                          self._titled(retry, body))
+
+    def _titled(self, retry, page):
+        self._model.stats.count("bytesRead", len(page))
+        name = self._model._nameFromPage(self.fn, self._flickrId, page)
+        if name is not None:
+            return self._succeeded(name)
+        if retry < 3:
+            return self._page(retry + 1)
+        self._failed(IOError("could not retrieve name from Flickr.com"))
+
+    def _succeeded(self, name):
+        self._model._lookupSucceeded(self._flickrId)
+        # Missing and private photos are converted locally instead
+        if self._flickrId in self._model.memoFlickr:
+            self._finish(name, FLAG_FLICKR)
+        else:
+            self._finish(name, 0)
+
+    def _failed(self, error):
+        self._model._lookupFailed(self.fn, self._flickrId, error)
+        self._finish(self._model._convertName(self.fn), 0)
+
+    def _finish(self, name, flags):
+        self.name = name
+        self.flags = flags
+        self.finished = True
+        self._stream._active -= 1
+
+class AsyncModel(object):
+    def __init__(self, model, concurrency=64):
+        self.model = model
+        self.concurrency = concurrency
+        # Results may wait behind a slow lookup; this bounds how many
+        self.window = concurrency * 4
+        self._map = {}
+        self._active = 0
+
+    def resolve(self, fns):
+        """Yields (fn, new name, flags) for every file name, in order."""
+        source = iter((fn, fn) for fn in fns).next
+        for _, fn, name, flags in self._stream(source):
+            yield fn, name, flags
+
+    def createRenameList(self, path):
+        """Scans path, yielding (old path, new path, flags) for each rename
+        as it is decided. The model's rename list is complete once the
+        generator is exhausted; an interrupted scan leaves it empty."""
+        with self.model.busy():
+            for item in self._createRenameList(path):
+                yield item
+
+    def _createRenameList(self, path):
+        model = self.model
+        model._rememberPath(path)
+        model._saveSettings()
+        model._renameList = plan = RenamePlan()
+        model.stats.reset()
+        model.throughput.reset()
+        # Files are counted as the walk finds them, so progress is approximate
+        model.progress = 0.0
+        model._walkDone = 0.0
+        model._walkLen = 0
+        model._walkCounted = False
+
+        found = Queue(self.window)
+        stop = threading.Event()
+        walker = threading.Thread(target=self._walk, args=(path, found, stop))
+        walker.daemon = True
+        walker.start()
+
+        def source():
+            try:
+                item = found.get_nowait()
+            except Empty:
+                return _WAIT
+            if item[0] is None:
+                # End of the walk; a failed walk found only part of the tree
+                if item[1] is not None:
+                    raise item[1]
+                raise StopIteration
+            return item
+
+        completed = False
+        try:
+            for root, fn, newFn, flags in self._stream(source):
+                model._fileDone()
+                if model.interrupt:
+                    break
+                nameWithPath = os.path.join(root, newFn)
+                with model.stats.stage("duplicates"):
+                    dupeName = model._checkDuplicates(nameWithPath, plan)
+                if fn == newFn and not dupeName:
+                    continue
+                elif dupeName:
+                    newFn = os.path.basename(dupeName)
+                    flags |= FLAG_DUPLICATE
+                plan.add(root, fn, newFn, flags)
+                yield os.path.join(root, fn), os.path.join(root, newFn), flags
+            else:
+                completed = True
+        finally:
+            stop.set()
+            self._closeAll()
+            model._saveMemoFlickr()     # Keep Flickr progress!
+            if not completed:
+                model._renameList = RenamePlan() # No partial rename list
+                model.interrupt = False
+        if not completed:
+            return
+        if model.logStats:
+            model.stats.log("createRenameList")
+        model._openedPath = True
+        model.progress = 100
+
+    def renameFiles(self):
+        """Renames everything in the model's rename list, yielding
+        (old path, new path) after each rename."""
+        with self.model.busy():
+            for item in self._renameFiles():
+                yield item
+
+    def _renameFiles(self):
+        model = self.model
+        dirs = model._renameList.getDirs()
+        model.throughput.reset(renames=len(model._renameList))
+        with DirFds() as dirFds:
+            for dirIdx, oldName, newName, _ in model._renameList.entries():
+                root = dirs[dirIdx]
+                with model.stats.stage("rename"):
+                    dirFds.rename(root, oldName, newName)
+                model.stats.count("filesRenamed")
+                model.throughput.add("renames")
+                yield os.path.join(root, oldName), os.path.join(root, newName)
+
+    def _walk(self, path, found, stop):
+        """Background thread: queues (root, fn) for every image under
+        path, then (None, the exception if the walk failed, or None)."""
+        model = self.model
+        error = None
+        try:
+            for root, _, files in model._walk(path):
+                with model._progressLock:
+                    model._walkLen += len(files)
+                model.throughput.expect("files", len(files))
+                model.throughput.expect("lookups",
+                                        keys=model._lookupIds(files))
+                for fn in files:
+                    if stop.is_set():
+                        return
+                    model.stats.count("filesSeen")
+                    model.throughput.add("files")
+                    if model._isImage(fn):
+                        model.stats.count("imagesMatched")
+                        found.put((root, fn))
+                    else:
+                        # Only images come back as results
+                        model._fileDone()
+        except Exception as e:
+            model.logger.exception("walk failed for {}".format(path))
+            error = e
+        finally:
+            # Never block on a full queue once the consumer has gone
+            while not stop.is_set():
+                try:
+                    found.put((None, error), timeout=0.1)
+                    break
+                except Full:
+                    continue
+
+    def _start(self, key, fn):
+        """Starts resolving one name. Returns a result or a lookup, either
+        of which is finished once the name is known."""
+        model = self.model
+        flickrId = model._isFlickr(fn)
+        if flickrId:
+            name = model._memoName(fn, flickrId)
+            if name is not None:
+                return _Result(key, fn, name, FLAG_FLICKR)
+            model.throughput.add("lookups", key=flickrId)
+            if model._lookupAllowed(fn, flickrId):
+                self._active += 1
+                return _FlickrLookup(self, key, fn, flickrId)
+        with model.stats.stage("convert"):
+            return _Result(key, fn, model._convertName(fn), 0)
+
+    def _stream(self, source):
+        """Yields (key, fn, name, flags) for items from source() - a callable
+        returning (key, fn), _WAIT, or raising StopIteration - in source
+        order, keeping up to concurrency lookups in flight."""
+        pending = deque()
+        exhausted = False
+        while True:
+            waiting = False
+            while (not exhausted and len(pending) < self.window and
+                   self._active < self.concurrency):
+                try:
+                    item = source()
+                except StopIteration:
+                    exhausted = True
+                    break
+                if item is _WAIT:
+                    waiting = True
+                    break
+                pending.append(self._start(*item))
+            while pending and pending[0].finished:
+                slot = pending.popleft()
+                yield slot.key, slot.fn, slot.name, slot.flags
+            if exhausted and not pending:
+                return
+            if self._map:
+                self._poll()
+            elif waiting:
+                # Nothing in flight - wait briefly for the walk to catch up
+                threading.Event().wait(0.01)
+
+    def _poll(self):
+        asyncore.loop(timeout=0.05, map=self._map, count=1)
+        now = default_timer()
+        for request in self._map.values():
+            if now > request.deadline:
+                request.fail(socket.timeout("timed out"))
+
+    def _closeAll(self):
+        for request in self._map.values():
+            request.cancel()
+        self._map.clear()
+        self._active = 0
@@ -0,0 +1,175 @@
+"""
+Name        rename_dirfd.py
+Author      David Edmondson
+
+Directory-relative file operations. Passing a full path for every file makes
+the kernel resolve each component of that path again on every call, which
+dominates scans and renames of deep trees on network shares. Here each
+directory is opened once, and its files are checked and renamed relative to
+the open directory, so the cost per file no longer depends on its depth.
+
+Python 3 does this natively (scandir on a directory fd, dir_fd arguments). On
+Python 2 the C library's openat and renameat are called through ctypes, where
+the platform has them. Anywhere else (Windows) every function here falls back
+to full paths, with the same results.
+
+DirFds      Bounded cache of open directory fds for renames. Once more than
+            limit are open the least recently used is closed, so renames
+            spread over many directories never run out of file descriptors.
+            Use one DirFds per thread.
+"""
+
+import os, sys, stat, errno
+from collections import OrderedDict
+
+try:
+    import ctypes, ctypes.util
+except ImportError:
+    ctypes = None
+
+# Directories held open by one DirFds
+DIR_FD_LIMIT = 64
+
+_O_DIRECTORY = getattr(os, "O_DIRECTORY", 0)
+_NATIVE = (sys.version_info[0] >= 3 and
+           os.rename in getattr(os, "supports_dir_fd", ()))
+
+def _loadLibc():
+    if ctypes is None or os.name != "posix" or not _O_DIRECTORY:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        openat, renameat = libc.openat, libc.renameat
+    except (OSError, AttributeError):
+        return None
+    # openat is variadic, but the mode is only read with O_CREAT
+    openat.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    openat.restype = ctypes.c_int
+    renameat.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                         ctypes.c_int, ctypes.c_char_p]
+    renameat.restype = ctypes.c_int
+    return libc
+
+_libc = None if _NATIVE else _loadLibc()
+DIR_FD_SUPPORTED = _NATIVE or _libc is not None
+
+def _encode(name):
+    if isinstance(name, unicode):
+        return name.encode(sys.getfilesystemencoding() or "utf-8")
+    return name
+
+def _libcError(root, name):
+    err = ctypes.get_errno()
+    return OSError(err, os.strerror(err), os.path.join(root, name))
+
+def openDir(path):
+    """Returns an fd for the directory path, for the functions below, or None
+    if directory fds are unsupported or path cannot be opened."""
+    if not DIR_FD_SUPPORTED:
+        return None
+    try:
+        return os.open(path, os.O_RDONLY | _O_DIRECTORY)
+    except OSError:
+        return None
+
+def isDirAt(dirFd, root, name):
+    """Returns True if root/name is a directory or a symlink to one, like
+    os.path.isdir. dirFd is root from openDir, or None to use the full
+    path."""
+    if dirFd is None:
+        return os.path.isdir(os.path.join(root, name))
+    if _NATIVE:
+        try:
+            return stat.S_ISDIR(os.stat(name, dir_fd=dirFd).st_mode)
+        except OSError:
+            return False
+    fd = _libc.openat(dirFd, _encode(name), os.O_RDONLY | _O_DIRECTORY)
+    if fd >= 0:
+        os.close(fd)
+        return True
+    if ctypes.get_errno() in (errno.ENOTDIR, errno.ENOENT, errno.ELOOP):
+        return False
+    # Unreadable directories cannot be opened, but are still directories
+    return os.path.isdir(os.path.join(root, name))
+
+def statAt(dirFd, root, name):
+    """os.stat of root/name, relative to dirFd where that is native."""
+    if dirFd is not None and _NATIVE:
+        return os.stat(name, dir_fd=dirFd)
+    return os.stat(os.path.join(root, name))
+
+def renameAt(dirFd, root, oldName, newName):
+    """Renames root/oldName to root/newName, relative to dirFd if it is not
+    None. Raises OSError like os.rename."""
+    if dirFd is None:
+        os.rename(os.path.join(root, oldName), os.path.join(root, newName))
+    elif _NATIVE:
+        os.rename(oldName, newName, src_dir_fd=dirFd, dst_dir_fd=dirFd)
+    elif _libc.renameat(dirFd, _encode(oldName),
+                        dirFd, _encode(newName)) != 0:
+        raise _libcError(root, oldName)
+
+def listDirectory(root):
+    """Returns (dirs, files) for root, as os.walk splits them. Raises OSError
+    if root cannot be listed."""
+    dirFd = openDir(root)
+    try:
+        if dirFd is not None and _NATIVE and os.scandir in os.supports_fd:
+            # Entry types come from the listing itself, with no lookups
+            dirs, files = [], []
+            for entry in os.scandir(dirFd):
+                (dirs if entry.is_dir() else files).append(entry.name)
+            return dirs, files
+        names = os.listdir(root)
+        dirs, files = [], []
+        for name in names:
+            if isDirAt(dirFd, root, name):
+                dirs.append(name)
+            else:
+                files.append(name)
+        return dirs, files
+    finally:
+        if dirFd is not None:
+            os.close(dirFd)
+
+class DirFds(object):
+    def __init__(self, limit=DIR_FD_LIMIT):
+        self.limit = max(1, limit)
+        # Directory path -> fd, least recently used first
+        self._fds = OrderedDict()
+        # Directories opened, including any opened again after eviction
+        self.opened = 0
+
+    def __len__(self):
+        return len(self._fds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def get(self, path):
+        """Returns an open fd for the directory path, or None if directory
+        fds are unsupported or path cannot be opened."""
+        fd = self._fds.pop(path, None)
+        if fd is None:
+            fd = openDir(path)
+            if fd is None:
+                return None
+            self.opened += 1
+            while len(self._fds) >= self.limit:
+                os.close(self._fds.popitem(last=False)[1])
+        self._fds[path] = fd
+        return fd
+
+    def stat(self, root, name):
+        return statAt(self.get(root), root, name)
+
+    def rename(self, root, oldName, newName):
+        renameAt(self.get(root), root, oldName, newName)
+
+    def close(self):
+        while self._fds:
+            os.close(self._fds.popitem()[1])
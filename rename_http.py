@@ -0,0 +1,104 @@
+"""
+Name        rename_http.py
+Author      David Edmondson
+
+HTTP transports for the Model's Flickr lookups. The Model only ever makes
+single requests through transport.request, so a transport can be swapped
+for one which records or replays them:
+
+HttpTransport       Real requests, one connection each, through httplib.
+RecordingTransport  Passes requests on to another transport, and appends
+                    every exchange to a fixture file.
+ReplayTransport     Answers from a fixture file, with no network at all.
+                    Requests missing from the fixture fail with IOError, like
+                    an unreachable server.
+
+Fixture files are JSON lines, one exchange per line, with bodies as UTF-8:
+
+    {"method": "HEAD", "host": "flickr.com", "path": "/photo.gne?id=1",
+     "status": 302, "reason": "Found", "headers": {"location": "/photos/a/1/"},
+     "body": ""}
+"""
+
+import json, httplib, threading
+
+class Response(object):
+    def __init__(self, status, reason="", headers=None, body=""):
+        self.status = status
+        self.reason = reason
+        # Header names in lower case
+        self.headers = dict((k.lower(), v)
+                            for k, v in (headers or {}).iteritems())
+        self.body = body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+class HttpTransport(object):
+    def request(self, method, host, path, timeout=None, limit=None):
+        """Makes one request. Returns a Response with at most limit bytes of
+        the body. Raises EnvironmentError or httplib.HTTPException."""
+        conn = httplib.HTTPConnection(host, timeout=timeout)
+        try:
+            conn.request(method, path)
+            res = conn.getresponse()
+            body = res.read(limit) if method != "HEAD" else ""
+            return Response(res.status, res.reason, dict(res.getheaders()),
+                            body)
+        finally:
+            conn.close()
+
+class RecordingTransport(object):
+    def __init__(self, fn, transport=None):
+        self.fn = fn
+        self.transport = transport or HttpTransport()
+        self._lock = threading.Lock()
+
+    def request(self, method, host, path, timeout=None, limit=None):
+        response = self.transport.request(method, host, path, timeout, limit)
+        exchange = {"method": method,
+                    "host": host,
+                    "path": path,
+                    "status": response.status,
+                    "reason": response.reason,
+                    "headers": response.headers,
+                    "body": response.body.decode("utf-8", "replace")}
+        with self._lock:
+            f = open(self.fn, "a")
+            try:
+                f.write(json.dumps(exchange, sort_keys=True) + "\n")
+            finally:
+                f.close()
+        return response
+
+class ReplayTransport(object):
+    def __init__(self, fn):
+        self.fn = fn
+        # (method, host, path) -> Response; later exchanges win
+        self.responses = {}
+        # Requests made, in order, for tests to check
+        self.requests = []
+        f = open(fn, "r")
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                exchange = json.loads(line)
+                key = (exchange["method"], exchange["host"], exchange["path"])
+                # Back to byte strings, as httplib returns them
+                headers = dict((str(k), v.encode("utf-8")) for k, v in
+                               exchange.get("headers", {}).iteritems())
+                self.responses[key] = Response(
+                    exchange["status"], str(exchange.get("reason", "")),
+                    headers, exchange.get("body", "").encode("utf-8"))
+        finally:
+            f.close()
+
+    def request(self, method, host, path, timeout=None, limit=None):
+        self.requests.append((method, host, path))
+        response = self.responses.get((method, host, path))
+        if response is None:
+            raise IOError("no recorded response for {} {}{}".format(
+                method, host, path))
+        return Response(response.status, response.reason, response.headers,
+                        response.body[:limit] if limit else response.body)
@@ -0,0 +1,116 @@
+"""
+Name        rename_index.py
+Author      David Edmondson
+
+Search index over the rename preview, so the filter box can respond on every
+keystroke with hundreds of thousands of rows.
+
+Rows are held in display order as paths relative to the opened folder, with
+the plan flags of each row. All names are also lowercased into one text
+buffer, a row per line, with the start offset of each row kept in an array.
+A search is then a run of str.find calls over that buffer, done in C, with a
+binary search to turn each hit into its row - Python code only ever runs per
+matching row, never per row. Typing more of the same query only rechecks the
+rows the last search matched, when those are few enough.
+
+A trigram index was tried first, but took several seconds per 100k rows to
+build in Python, against milliseconds to search the buffer.
+"""
+
+import os, sys
+from array import array
+from bisect import bisect_right
+
+def prepareQuery(query, like):
+    """Lowercases query, and encodes it if the names it is matched against
+    (like) are byte strings in the file system encoding. Returns None if it
+    cannot match."""
+    query = query.lower()
+    if isinstance(like, str) and isinstance(query, unicode):
+        try:
+            query = query.encode(sys.getfilesystemencoding() or "utf-8")
+        except UnicodeError:
+            return None
+    return query
+
+class RenameIndex(object):
+    def __init__(self, plan, path):
+        # Paths relative to the opened folder, built once per directory
+        relDirs = []
+        for d in plan.getDirs():
+            relDir = os.path.relpath(d, path)
+            relDirs.append("" if relDir == os.curdir else relDir)
+
+        rows = [(os.path.join(relDirs[dirIdx], oldFn),
+                 os.path.join(relDirs[dirIdx], newFn), flags)
+                for dirIdx, oldFn, newFn, flags in plan.entries()]
+        rows.sort(key=lambda row: row[0].lower(), reverse=True)
+
+        self.old = [row[0] for row in rows]
+        self.new = [row[1] for row in rows]
+        self.flags = bytearray(row[2] for row in rows)
+        del rows
+
+        # One line per row: "old\tnew\n", so no match can span two rows
+        self._starts = array("I")
+        offset = 0
+        for oldFn, newFn in zip(self.old, self.new):
+            self._starts.append(offset)
+            offset += len(oldFn) + len(newFn) + 2
+        self._starts.append(offset)
+        self._text = "".join(("%s\t%s\n" % (oldFn, newFn)).lower()
+                             for oldFn, newFn in zip(self.old, self.new))
+        # (query, flags, matching rows) of the last search
+        self._last = None
+
+    def __len__(self):
+        return len(self.old)
+
+    def search(self, query="", flags=0):
+        """Returns the indices of rows, in display order, whose old or new
+        name contains query (ignoring case) and which have all of flags."""
+        query = self._prepareQuery(query)
+        if query is None:
+            return []
+
+        last = self._last
+        if (last and last[1] == flags and last[0] in query and
+                len(last[2]) * 2 < len(self.old)):
+            # Narrowing the last search: only its matches can still match.
+            # Rechecking each row costs more than a fresh search once more
+            # than about half of the rows are left.
+            text, starts = self._text, self._starts
+            result = [i for i in last[2]
+                      if text.find(query, starts[i], starts[i + 1]) != -1]
+        elif not query:
+            result = [i for i, rowFlags in enumerate(self.flags)
+                      if rowFlags & flags == flags]
+        else:
+            result = self._find(query, flags)
+        self._last = (query, flags, result)
+        return result
+
+    def _prepareQuery(self, query):
+        """Lowercases query to match the text buffer. Returns None if it
+        cannot match any row."""
+        if "\t" in query or "\n" in query:
+            return None
+        return prepareQuery(query, self._text)
+
+    def _find(self, query, flags):
+        text, starts, rowFlags = self._text, self._starts, self.flags
+        result = []
+        pos = text.find(query)
+        while pos != -1:
+            row = bisect_right(starts, pos) - 1
+            if rowFlags[row] & flags == flags:
+                result.append(row)
+            # Skip to the next row; this one has already matched
+            pos = text.find(query, starts[row + 1])
+        return result
+
+    def rows(self, indices=None):
+        """Returns (old, new) lists for the given rows, or all rows."""
+        if indices is None:
+            return list(self.old), list(self.new)
+        return [self.old[i] for i in indices], [self.new[i] for i in indices]
@@ -24,6 +24,10 @@ class Interactor(object):
             wx.EVT_CHECKBOX, self.onSettingChanged)
         self.view._checkboxCapital.Bind(
             wx.EVT_CHECKBOX, self.onSettingChanged)
+        self.view._textFilter.Bind(
+            wx.EVT_TEXT, self.onFilterChanged)
+        self.view._choiceFilter.Bind(
+            wx.EVT_CHOICE, self.onFilterChanged)
         self.view.buttonOpen.Bind(
             wx.EVT_BUTTON, self.onOpenDir)
         self.view.buttonRename.Bind(
@@ -45,6 +49,10 @@ class Interactor(object):
         """Update model whenever settings are changed"""
         self.presenter.settingsChanged()
 
+    def onFilterChanged(self, e):
+        """Filter the rename preview as the filter is typed or changed"""
+        self.presenter.filterChanged()
+
     def onOpenAbout(self, e):
         """Opens the About box."""
         self.presenter.openAbout()
@@ -0,0 +1,158 @@
+"""
+Name        rename_mirror.py
+Author      David Edmondson
+
+Mirror output: instead of renaming in place, builds a normalized copy of a
+scanned tree under a separate target root, leaving the source untouched -
+for read-only masters. Every file is mirrored, under its planned new name if
+it has one.
+
+Files are placed with the cheapest method the filesystems allow:
+reflink     Copy-on-write clone (Linux FICLONE: Btrfs, XFS, ...). Shares data
+            blocks, but the copy can be edited without touching the master.
+hardlink    A second name for the same file, on the same volume.
+copy        Chunked copy with large buffers, keeping timestamps.
+
+Mode "auto" tries them in that order. A method the filesystems do not
+support at all is dropped for that source and target device pair, so it is
+only tried once; a failure for one file only moves that file on to the next
+method.
+
+The source is walked with the Model's walk where given, so pruned
+directories (see rename_prune.py) are not mirrored.
+"""
+
+import os, errno, shutil, logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MIRROR_MODES = ("auto", "reflink", "hardlink", "copy")
+# From <linux/fs.h>: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+COPY_BUFFER = 1024 * 1024
+# Errors meaning a method cannot work between two filesystems at all
+UNSUPPORTED_ERRORS = frozenset(getattr(errno, name) for name in
+                               ("EXDEV", "EOPNOTSUPP", "ENOTSUP", "ENOTTY")
+                               if hasattr(errno, name))
+
+def reflinkFile(src, dst):
+    """Clones src to dst. Raises OSError or IOError if unsupported."""
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported here")
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except (IOError, OSError):
+            fdst.close()
+            os.remove(dst)
+            raise
+        fdst.close()
+    finally:
+        fsrc.close()
+    shutil.copystat(src, dst)
+
+def hardlinkFile(src, dst):
+    if not hasattr(os, "link"):
+        raise OSError(errno.ENOTSUP, "hard links are not supported here")
+    os.link(src, dst)
+
+def copyFile(src, dst):
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+    shutil.copystat(src, dst)
+
+_METHODS = (("reflink", reflinkFile), ("hardlink", hardlinkFile),
+            ("copy", copyFile))
+
+class Mirror(object):
+    def __init__(self, source, target, mode="auto", logger=None, walk=None):
+        if mode not in MIRROR_MODES:
+            raise ValueError("mirror mode must be one of: " +
+                             ", ".join(MIRROR_MODES))
+        self.source = os.path.normpath(source)
+        self.target = os.path.normpath(target)
+        self.mode = mode
+        self.logger = logger or logging
+        self.walk = walk or os.walk
+        # Files placed by each method, and files skipped
+        self.counts = dict((name, 0) for name, _ in _METHODS)
+        self.counts["skipped"] = 0
+        # Files placed under a new name
+        self.renamed = 0
+        # (source device, target device) -> methods still worth trying
+        self._methods = {}
+
+    def run(self, plan):
+        """Mirrors the source tree, renamed according to plan. Returns
+        counts of files per method, and skipped files."""
+        renames = {}
+        dirs = plan.getDirs()
+        for dirIdx, oldName, newName, _ in plan.entries():
+            renames.setdefault(dirs[dirIdx], {})[oldName] = newName
+
+        for root, _, files in self._walk(self.source):
+            targetDir = os.path.join(self.target,
+                                     os.path.relpath(root, self.source))
+            if not os.path.isdir(targetDir):
+                os.makedirs(targetDir)
+            dirRenames = renames.get(root, {})
+            devices = (os.stat(root).st_dev, os.stat(targetDir).st_dev)
+            for fn in files:
+                newFn = dirRenames.get(fn, fn)
+                if (self.place(os.path.join(root, fn),
+                               os.path.join(targetDir, newFn), devices)
+                        and newFn != fn):
+                    self.renamed += 1
+        return self.counts
+
+    def _walk(self, path):
+        # Never descend into the target, if it lives inside the source
+        for root, dirs, files in self.walk(path):
+            dirs[:] = [d for d in dirs
+                       if os.path.join(root, d) != self.target]
+            yield os.path.normpath(root), dirs, files
+
+    def place(self, src, dst, devices=None):
+        """Places one file at dst. Existing targets are left alone. devices
+        is (source device, target device), if already known. Returns True if
+        the file was placed."""
+        if os.path.lexists(dst):
+            self.logger.warning("mirror target exists, skipped: " + dst)
+            self.counts["skipped"] += 1
+            return False
+        if devices is None:
+            devices = (os.stat(src).st_dev,
+                       os.stat(os.path.dirname(dst)).st_dev)
+        for name, method in self._candidates(devices):
+            try:
+                method(src, dst)
+            except (IOError, OSError) as e:
+                if name == "copy" or self.mode != "auto":
+                    raise
+                self.logger.info("{} failed for {}: {}".format(name, dst, e))
+                if e.errno in UNSUPPORTED_ERRORS:
+                    self._methods[devices].remove(name)
+                continue
+            self.counts[name] += 1
+            return True
+
+    def _candidates(self, devices):
+        if self.mode != "auto":
+            return [(name, method) for name, method in _METHODS
+                    if name == self.mode]
+        methods = self._methods.setdefault(devices,
+                                           [name for name, _ in _METHODS])
+        return [(name, method) for name, method in _METHODS
+                if name in methods]
@@ -12,46 +12,213 @@ Title       Capitalize the first letter of each word.
 Flickr      If a Flickr image filename is detected, this will attempt to replace
             the filename with the image title. Check done via:
             http://flickr.com/photo.gne?id=[ID]
+Rules       Optional list of extra rules (prefix stripping, regex replacement,
+            case, clipping), applied after the settings above. See
+            rename_rules.py.
+Prune       Optional scan pruning: ignored file globs, excluded directory globs,
+            a depth limit, skipping hidden names and reading .refignore files.
+            Pruned directories are never listed. See rename_prune.py.
 
+Data:
+Settings, the Flickr memo and retry queue, logs, traces and profiles are kept
+under the data root, APPDATA_ROOT unless the Model is given its own. Flickr
+requests go through an injectable transport (see rename_http.py), so lookups
+can be recorded once and replayed offline.
+
+Flickr memo:
+Titles found on Flickr are cached in memoFlickr.cfg. importMemoFlickr seeds
+the cache from CSV or JSON-lines exports (photo ID and title columns are
+configurable), and exportMemoFlickr writes it back out in either format, so a
+new workstation can start with a warm cache.
+
+A failed lookup (timeout, rate limiting, server error, unreadable page) no
+longer stops the scan: that file's name is converted locally and its ID goes
+into retryFlickr.cfg, to be tried again after a growing, jittered delay -
+either by a later scan or by retryFlickrLookups. After several consecutive
+failures a circuit breaker pauses all lookups for a cooldown, so a scan of any
+size finishes in bounded time when Flickr is unreachable.
+
+Stats:
+Per-stage timers and counters are collected when stats.enabled is set, and
+returned by getStats(). With logStats set, they are also written to the error
+log after each createRenameList and renameFiles.
+
+Throughput is always measured: getThroughput() returns rolling files, lookups
+and renames per second for the running scan or rename, and the time left
+estimated from them and the lookups still to come. See rename_rate.py.
+
+Tracing:
+With trace set, createRenameList records spans to trace.json in Chrome trace
+event format: listing each directory ("list"), scanning its files
+("directory") and each HTTP request ("http"). With profile set, it runs
+under cProfile and saves createRenameList.prof. Both files are written next to
+error.log.
+
+Scanning:
+With scanThreads above 1, a single tree is scanned by a pool of threads
+sharing a queue of directories, which keeps several listings and Flickr lookups
+in flight on high-latency filesystems. The rename list is identical to a serial
+scan.
+
+Deep trees:
+Directories are listed, and files renamed, relative to open directory fds
+where the platform allows, so the cost per file does not grow with the depth
+of the tree. See rename_dirfd.py.
+
+Prefetch:
+Recently opened folders are kept in settings (recentPaths). startPrefetch
+looks up Flickr titles missing from the memo under them in the background,
+at low priority, so reopening one needs no lookups. See rename_prefetch.py.
+
+Preview:
+With publishRenames set, renames are also published while a scan runs, at
+least every RENAME_BATCH renames and at the end of each directory, for
+takeRenames to collect. The preview can then fill in as resolution continues.
+Published renames are in scan order; the finished rename list replaces them.
 """
 
 import httplib
-import os, re, logging, json
+import os, re, logging, json, cProfile, threading, csv, time
+from Queue import Queue
+from contextlib import contextmanager
+from rename_stats import Stats
+from rename_trace import Tracer, NULL_TRACER
+from rename_plan import RenamePlan, FLAG_FLICKR, FLAG_DUPLICATE
+from rename_plan import exportPlan, applyPlan, planSize
+from rename_retry import RetryQueue, CircuitBreaker, backoff
+from rename_rules import validateRules, compileRules
+from rename_mirror import Mirror
+from rename_prune import PRUNE_DEFAULT, validatePrune, Pruner
+from rename_index import RenameIndex
+from rename_http import HttpTransport
+from rename_dirfd import DirFds, listDirectory
+from rename_prefetch import Prefetcher
+from rename_rate import Throughput
 
 class Model(object):
-    # File locations
-    APPDATA_ROOT = os.path.join(os.environ["APPDATA"], "ThreeHams", "RefCollage")
-    FILE_SETTINGS = os.path.join(APPDATA_ROOT, "settings.cfg")
-    FILE_MEMO_FLICKR = os.path.join(APPDATA_ROOT, "memoFlickr.cfg")
-    FILE_LOG_ERROR = os.path.join(APPDATA_ROOT, "error.log")
+    # Default data root; each Model can be given its own
+    APPDATA_ROOT = os.path.join(
+        os.environ.get("APPDATA", os.path.expanduser("~")),
+        "ThreeHams", "RefCollage")
+    # File names within the data root
+    DATA_FILES = {"FILE_SETTINGS": "settings.cfg",
+                  "FILE_MEMO_FLICKR": "memoFlickr.cfg",
+                  "FILE_LOG_ERROR": "error.log",
+                  "FILE_TRACE": "trace.json",
+                  "FILE_PROFILE": "createRenameList.prof",
+                  "FILE_RETRY_FLICKR": "retryFlickr.cfg",
+                  "FILE_SERVICE_TOKEN": "serviceToken.cfg"}
     FLICKR_REGEX = re.compile(r"([0-9]{6,10})_[0-9a-f]{6,10}[._]")
+    # Hosts ("host" or "host:port") for the photo.gne redirect and the photo
+    # page. Override on an instance to use a local stand-in server.
+    FLICKR_SITE = "flickr.com"
+    FLICKR_PAGE_SITE = "www.flickr.com"
+    # Seconds before a Flickr request is abandoned
+    HTTP_TIMEOUT = 10
+    # Backoff between retries of one page fetch, in seconds
+    FLICKR_RETRY_DELAY = 0.25
+    FLICKR_RETRY_MAX_DELAY = 2.0
+    # Consecutive failed lookups before pausing lookups for the cooldown
+    FLICKR_FAILURE_THRESHOLD = 3
+    FLICKR_COOLDOWN = 60.0
 
     SETTING_DEFAULT = {
         "delimiter":" ",
         "flickr":False,
         "capital":False,
-        "lastPath":""}
+        "lastPath":"",
+        "recentPaths":[],
+        "rules":[],
+        "prune":PRUNE_DEFAULT}
+    # Recently opened folders kept in settings, most recent first
+    RECENT_PATHS = 5
 
     IMAGE_EXTENSIONS = (".jpg",".jpeg",".png",".bmp",".tif",".tiff",".tga",
                         ".gif")
     DELIMITERS = (" ","_","-",".")
+    # Preview filters: name, and plan flags a row must have
+    FILTERS = (("All", 0),
+               ("Flickr", FLAG_FLICKR),
+               ("Collisions", FLAG_DUPLICATE))
 
-    # Local memos
-    memoFlickr = {}
+    # Renames found before a scan publishes them, within one directory
+    RENAME_BATCH = 200
 
-    def __init__(self):
-        self._loadSettings()
+    # Guards memo and retry files
+    _memoLock = threading.Lock()
+
+    def __init__(self, dataRoot=None, transport=None):
+        """dataRoot holds settings, memos and logs (default APPDATA_ROOT).
+        transport makes Flickr requests (default HttpTransport; see
+        rename_http.py)."""
+        self.dataRoot = dataRoot or Model.APPDATA_ROOT
+        for name, fn in Model.DATA_FILES.iteritems():
+            setattr(self, name, os.path.join(self.dataRoot, fn))
+        self.transport = transport or HttpTransport()
+        self.memoFlickr = {}
+
+        # Each Model logs to its own error.log, until close(). Not registered
+        # with logging, so one Model's handler never sees another's records.
+        self.logger = logging.Logger("refcollage.model", logging.WARNING)
+        self._logHandler = logging.FileHandler(self.FILE_LOG_ERROR,
+                                               delay=True)
+        self._logHandler.setFormatter(
+            logging.Formatter("%(levelname)s:%(message)s"))
+        self.logger.addHandler(self._logHandler)
+
+        self._stats = Stats(logger=self.logger)
+        self._throughput = Throughput()
+        # Counters of background work on its own thread, in place of the
+        # ones above; see backgroundCounters
+        self._background = threading.local()
+        self.logStats = False
+        self.trace = False
+        self.profile = False
+        self._tracer = NULL_TRACER
+        # Threads used to scan a single tree; 1 scans serially
+        self.scanThreads = 1
+        # Publish renames during scans, for takeRenames
+        self.publishRenames = False
+        self.scanning = False
+        # Foreground work running, for background work to wait on
+        self._busy = 0
+        self._busyLock = threading.Lock()
+        self._published = []
+        self._publishLock = threading.Lock()
 
-        self._renameList = {}
         self._checkDirs()
+        self._loadSettings()
+
+        self._renameList = RenamePlan()
+        self._renameIndex = None
         self._loadMemoFlickr()
+        self._retryFlickr = RetryQueue(self.FILE_RETRY_FLICKR,
+                                       logger=self.logger)
+        self._flickrBreaker = CircuitBreaker(Model.FLICKR_FAILURE_THRESHOLD,
+                                             Model.FLICKR_COOLDOWN,
+                                             logger=self.logger)
         self._openedPath = False
+        self._prefetcher = None
+        # Flickr IDs found missing or private this session
+        self._flickrUnavailable = set()
 
         self.interrupt = False
         self.progress = 0.0
+        # Files done and expected, updated from several threads by sharded
+        # and multi-root scans. _walkCounted is False where the expected
+        # total is only found as the scan goes.
+        self._walkDone = 0.0
+        self._walkLen = 0
+        self._walkCounted = True
+        self._progressLock = threading.Lock()
         self.version = "0.53"
 
-        logging.basicConfig(filename=Model.FILE_LOG_ERROR,level=logging.WARNING)
+    def close(self, timeout=None):
+        """Stops background work, waiting up to timeout seconds for it, and
+        closes the error log so the data root can be removed."""
+        self.stopPrefetch(timeout)
+        self.logger.removeHandler(self._logHandler)
+        self._logHandler.close()
 
     def changeSettings(self, settings):
         """Validate settings from the presenter and save.
@@ -62,9 +229,14 @@ class Model(object):
         if settings["delimiter"] not in Model.DELIMITERS:
             raise ValueError("invalid delimiter: {}".format(settings["delimiter"]))
 
+        rules = validateRules(settings.get("rules", self._rules))
+        prune = validatePrune(settings.get("prune", self._prune))
+
         self._flickr = settings["flickr"]
         self._capital = settings["capital"]
         self._delimiter = settings["delimiter"]
+        self._setRules(rules)
+        self._prune = prune
         self._saveSettings()
 
         if self._openedPath:
@@ -75,7 +247,10 @@ class Model(object):
             "flickr":self._flickr,
             "capital":self._capital,
             "delimiter":self._delimiter,
-            "lastPath":self._lastPath}
+            "lastPath":self._lastPath,
+            "recentPaths":list(self._recentPaths),
+            "rules":list(self._rules),
+            "prune":dict(self._prune)}
         return settings
 
     def _validateSetting(self, name, settings, arrayCheck = None,
@@ -90,7 +265,7 @@ class Model(object):
         except KeyError:
             pass
 
-        logging.warning(
+        self.logger.warning(
             "invalid setting found for {}, setting to default".format(name))
         if default is not None:
             return default
@@ -99,11 +274,12 @@ class Model(object):
 
     def _loadSettings(self):
         try:
-            f = open(Model.FILE_SETTINGS, "r")
+            f = open(self.FILE_SETTINGS, "r")
             settings = json.load(f)
             f.close()
         except (IOError, ValueError):
-            logging.warning("no settings data found, starting from scratch")
+            self.logger.warning(
+                "no settings data found, starting from scratch")
             settings = Model.SETTING_DEFAULT
 
         # Validate settings before blindly accepting!
@@ -116,93 +292,517 @@ class Model(object):
             "delimiter", settings, arrayCheck=Model.DELIMITERS)
         self._lastPath = self._validateSetting(
             "lastPath", settings, instance=basestring, default="")
+        recentPaths = settings.get("recentPaths", [])
+        if (not isinstance(recentPaths, list) or
+                not all(isinstance(p, basestring) for p in recentPaths)):
+            self.logger.warning("invalid setting found for recentPaths, "
+                                "setting to default")
+            recentPaths = []
+        self._recentPaths = recentPaths[:self.RECENT_PATHS]
+        try:
+            rules = validateRules(settings.get("rules", []))
+        except ValueError as e:
+            self.logger.warning("invalid rules found ({}), setting to "
+                                "default".format(e))
+            rules = []
+        self._setRules(rules)
+        try:
+            self._prune = validatePrune(settings.get("prune", PRUNE_DEFAULT))
+        except ValueError as e:
+            self.logger.warning("invalid prune settings found ({}), "
+                                "setting to default".format(e))
+            self._prune = validatePrune(PRUNE_DEFAULT)
         self._saveSettings()
 
+    def _setRules(self, rules):
+        """Stores the rule list, and the transform compiled from it for the
+        current delimiter."""
+        self._rules = rules
+        self._transform = compileRules(rules, self._delimiter)
+
     def _saveSettings(self):
         settings = {
             "flickr":self._flickr,
             "capital":self._capital,
             "delimiter":self._delimiter,
-            "lastPath":self._lastPath}
-        f = open(Model.FILE_SETTINGS, "w+")
+            "lastPath":self._lastPath,
+            "recentPaths":self._recentPaths,
+            "rules":self._rules,
+            "prune":self._prune}
+        f = open(self.FILE_SETTINGS, "w+")
         json.dump(settings, f)
         f.close()
 
     def createRenameList(self, path):
-        """Gets a list of image files, and constructs a dictionary-based rename
-        queue based on current settings."""
-        self._lastPath = path
+        """Gets a list of image files, and constructs a rename queue (see
+        RenamePlan) based on current settings. Returns False if interrupted,
+        leaving the queue empty."""
+        if self.trace:
+            self._tracer = Tracer(self.FILE_TRACE)
+        with self._publishLock:
+            self._published = []
+        self.scanning = True
+        try:
+            with self.busy():
+                if self.profile:
+                    profiler = cProfile.Profile()
+                    try:
+                        return profiler.runcall(self._createRenameList, path)
+                    finally:
+                        profiler.dump_stats(self.FILE_PROFILE)
+                return self._createRenameList(path)
+        finally:
+            self.scanning = False
+            self._tracer.close()
+            self._tracer = NULL_TRACER
+
+    def _createRenameList(self, path):
+        self._rememberPath(path)
         self._saveSettings()
-        self._renameList = {}
+        self._renameList = RenamePlan()
+        self.stats.reset()
 
         self.progress = 0.0
-        progress = 0.0
-
-        walkLen = 0
+        self._walkDone = 0.0
         # Find the total length of the walk, so we can get accurate progress.
-        for _, _, files in os.walk(path):
-            walkLen += len(files)
-
-        for root, _, files in os.walk(path):
-            for fn in files:
-                # Max out at 99.9% progress until completely done.
-                progress += 1
-                self.progress = (progress / walkLen) * 100 - .01
-
-                # Stop on thread interrupt
-                if self.interrupt:
-                    self._saveMemoFlickr()  # Keep Flickr progress!
-                    self._renameList = {}   # Don't allow a partial rename list
-                    self.interrupt = False
-                    return
-
-                # Ignore any non-image files
-                if not self._isImage(fn):
-                    continue
-
-                flickrId = self._isFlickr(fn)
-                if flickrId:
-                    try:
-                        newFn = self._getNameFlickr(fn, flickrId)
-                    except:
-                        self._saveMemoFlickr()
-                        raise
-                else:
-                    newFn = self._convertName(fn)
-
-                # Ignore if the filename is the same - but still have to check
-                # for duplicates (edge cases).
-                nameWithPath = os.path.join(root, newFn)
-                dupeName = self._checkDuplicates(nameWithPath)
-                if fn == newFn and not dupeName:
-                    continue
-                elif dupeName:
-                    newFn = dupeName
-                else:
-                    newFn = nameWithPath
+        # Sharded scans count as they go instead of walking twice, so their
+        # progress is only approximate.
+        self._walkCounted = self.scanThreads <= 1
+        if not self._walkCounted:
+            self._walkLen = 0
+            self.throughput.reset()
+        else:
+            self._walkLen, lookupIds = self._countFiles(path)
+            self.throughput.reset(files=self._walkLen)
+            self.throughput.expect("lookups", keys=lookupIds)
 
-                self._renameList[os.path.join(root, fn)] = newFn
+        if not self._scanRoot(path, self._renameList):
+            self._saveMemoFlickr()  # Keep Flickr progress!
+            self._renameList = RenamePlan() # No partial rename list
+            self.interrupt = False
+            return False
         self._saveMemoFlickr()
+        if self.logStats:
+            self.stats.log("createRenameList")
         # Enable automatic updating of names on setting changes
         self._openedPath = True
         self.progress = 100
+        return True
+
+    def _rememberPath(self, path):
+        """Makes path the last opened folder, and the most recent one."""
+        self._lastPath = path
+        recentPaths = [path] + [p for p in self._recentPaths if p != path]
+        self._recentPaths = recentPaths[:self.RECENT_PATHS]
+
+    def startPrefetch(self):
+        """Starts looking up Flickr titles for the recently opened folders in
+        the background (see rename_prefetch.py). Returns the Prefetcher, or
+        None if Flickr lookups are off or no recent folder exists."""
+        self.stopPrefetch()
+        roots = []
+        for path in [self._lastPath] + self._recentPaths:
+            if path and path not in roots and os.path.isdir(path):
+                roots.append(path)
+        if not self._flickr or not roots:
+            return None
+        self._prefetcher = Prefetcher(self, roots).start()
+        return self._prefetcher
+
+    def stopPrefetch(self, timeout=None):
+        """Stops background prefetch, waiting up to timeout seconds for the
+        current lookup."""
+        if self._prefetcher is not None:
+            self._prefetcher.stop(timeout)
+            self._prefetcher = None
+
+    @property
+    def stats(self):
+        return getattr(self._background, "stats", self._stats)
+
+    @property
+    def throughput(self):
+        return getattr(self._background, "throughput", self._throughput)
+
+    @contextmanager
+    def backgroundCounters(self, stats, throughput):
+        """Counts work on the calling thread in stats and throughput, apart
+        from foreground work, for as long as it runs."""
+        self._background.stats = stats
+        self._background.throughput = throughput
+        try:
+            yield
+        finally:
+            del self._background.stats
+            del self._background.throughput
+
+    @contextmanager
+    def busy(self):
+        """Marks foreground work - scans, renames, mirrors - for as long as
+        it runs, so background prefetch waits for it."""
+        with self._busyLock:
+            self._busy += 1
+        try:
+            yield
+        finally:
+            with self._busyLock:
+                self._busy -= 1
+
+    def isBusy(self):
+        return self._busy > 0
+
+    def _countFiles(self, path):
+        """Returns (files, set of Flickr IDs to look up) under path."""
+        count = 0
+        lookupIds = set()
+        for _, _, files in self._walk(path):
+            count += len(files)
+            lookupIds.update(self._lookupIds(files))
+        return count, lookupIds
+
+    def _lookupIds(self, files):
+        """Returns the set of Flickr IDs among files missing from the memo.
+        Sizes of one photo share an ID, and a lookup."""
+        if not self._flickr:
+            return set()
+        lookupIds = set()
+        for fn in files:
+            flickrId = self._isFlickr(fn)
+            if flickrId and flickrId not in self.memoFlickr:
+                lookupIds.add(flickrId)
+        return lookupIds
+
+    def _scanRoot(self, path, plan):
+        """Adds renames for every directory under path to plan. Returns False
+        if interrupted. Safe to run for several roots at once, each with its
+        own plan."""
+        if self.scanThreads > 1:
+            return self._scanRootSharded(path, plan)
+        pruner = Pruner(self._prune, path, self.logger)
+        for root, _, files in self._walk(path, pruner=pruner):
+            with self._tracer.span(root, "directory", files=len(files)):
+                if not self._scanDirectory(root, files, plan):
+                    return False
+        self.stats.count("dirsPruned", pruner.pruned)
+        return True
+
+    def _scanRootSharded(self, path, plan):
+        """Scans path with scanThreads workers sharing one queue of
+        directories, so idle workers always pick up whatever subtree is left.
+        Each directory is listed and scanned into its own plan, and the plans
+        are merged in the same order as a serial walk - duplicate numbering
+        only depends on the order of files within a directory, so the result
+        is identical to _scanRoot with one thread."""
+        pending = Queue()
+        pruner = Pruner(self._prune, path, self.logger)
+        children = {}
+        plans = {}
+        errors = []
+
+        def worker():
+            while True:
+                root = pending.get()
+                try:
+                    if root is None:
+                        return
+                    if errors or self.interrupt:
+                        continue
+                    listing = self._listDirectory(root, pruner)
+                    if listing is None:
+                        continue
+                    dirs, files = listing
+                    children[root] = dirs
+                    for d in dirs:
+                        if not os.path.islink(os.path.join(root, d)):
+                            pending.put(os.path.join(root, d))
+                    if not self._walkCounted:
+                        with self._progressLock:
+                            self._walkLen += len(files)
+                        self.throughput.expect("files", len(files))
+                    self.throughput.expect("lookups",
+                                           keys=self._lookupIds(files))
+                    dirPlan = RenamePlan()
+                    with self._tracer.span(root, "directory", files=len(files)):
+                        if self._scanDirectory(root, files, dirPlan):
+                            plans[root] = dirPlan
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    pending.task_done()
+
+        pending.put(path)
+        workers = [threading.Thread(target=worker)
+                   for _ in xrange(self.scanThreads)]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        pending.join()
+        for thread in workers:
+            pending.put(None)
+        for thread in workers:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        if self.interrupt:
+            return False
+        self.stats.count("dirsPruned", pruner.pruned)
+
+        # Merge in os.walk order: depth-first, children in listing order
+        stack = [path]
+        while stack:
+            root = stack.pop()
+            if root in plans:
+                plan.extend(plans[root])
+            for d in reversed(children.get(root, ())):
+                stack.append(os.path.join(root, d))
+        return True
+
+    def _scanDirectory(self, root, files, plan):
+        """Adds renames for the files of one directory to plan. Returns False
+        if interrupted."""
+        batch = []
+        try:
+            return self._scanFiles(root, files, plan, batch)
+        finally:
+            self._publish(batch)
+
+    def _scanFiles(self, root, files, plan, batch):
+        for fn in files:
+            self.stats.count("filesSeen")
+            self._fileDone()
+            self.throughput.add("files")
+
+            # Stop on thread interrupt
+            if self.interrupt:
+                return False
+
+            # Ignore any non-image files
+            if not self._isImage(fn):
+                continue
+            self.stats.count("imagesMatched")
+
+            newFn, flags = self._resolveName(fn)
+
+            # Ignore if the filename is the same - but still have to check
+            # for duplicates (edge cases).
+            nameWithPath = os.path.join(root, newFn)
+            with self.stats.stage("duplicates"):
+                dupeName = self._checkDuplicates(nameWithPath, plan)
+            if fn == newFn and not dupeName:
+                continue
+            elif dupeName:
+                newFn = os.path.basename(dupeName)
+                flags |= FLAG_DUPLICATE
+
+            plan.add(root, fn, newFn, flags)
+            if self.publishRenames:
+                batch.append((root, fn, newFn, flags))
+                if len(batch) >= Model.RENAME_BATCH:
+                    self._publish(batch)
+                    del batch[:]
+        return True
+
+    def _fileDone(self):
+        """Counts one file scanned towards progress."""
+        with self._progressLock:
+            # Max out at 99.9% progress until completely done. Totals found
+            # as the scan goes may grow; never go backwards.
+            self._walkDone += 1
+            self.progress = max(self.progress,
+                (self._walkDone / self._walkLen) * 100 - .01)
+
+    def _publish(self, batch):
+        if batch:
+            with self._publishLock:
+                self._published.extend(batch)
+
+    def takeRenames(self):
+        """Returns renames published by the running scan since the last call,
+        as a list of (directory, old name, new name, flags)."""
+        with self._publishLock:
+            published, self._published = self._published, []
+        return published
+
+    def _resolveName(self, fn):
+        """Returns (new name, flags) for one image file name, from Flickr if it
+        is a Flickr name, otherwise by conversion."""
+        flickrId = self._isFlickr(fn)
+        if flickrId:
+            name = self._lookupFlickr(fn, flickrId)
+            if name is not None:
+                # Missing and private photos are converted locally instead
+                if flickrId in self.memoFlickr:
+                    return name, FLAG_FLICKR
+                return name, 0
+        with self.stats.stage("convert"):
+            return self._convertName(fn), 0
+
+    def _lookupFlickr(self, fn, flickrId):
+        """Returns the Flickr name for fn, or None if the lookup failed or was
+        skipped. Failures never propagate: the ID is queued for a later retry,
+        and the caller converts the name locally instead."""
+        if flickrId not in self.memoFlickr:
+            self.throughput.add("lookups", key=flickrId)
+            if not self._lookupAllowed(fn, flickrId):
+                return None
+        try:
+            with self.stats.stage("flickr"):
+                name = self._getNameFlickr(fn, flickrId)
+        except (EnvironmentError, httplib.HTTPException) as e:
+            self._lookupFailed(fn, flickrId, e)
+            return None
+        self._lookupSucceeded(flickrId)
+        return name
+
+    def _lookupAllowed(self, fn, flickrId):
+        """False if flickrId is waiting for a retry, or lookups are paused."""
+        if self._retryFlickr.isWaiting(flickrId):
+            return False
+        if not self._flickrBreaker.allow():
+            if flickrId not in self._retryFlickr:
+                self._retryFlickr.add(flickrId, fn, "lookups paused")
+            return False
+        return True
+
+    def _lookupFailed(self, fn, flickrId, error):
+        self.stats.count("lookupFailures")
+        self._flickrBreaker.failure()
+        self._retryFlickr.add(flickrId, fn, error)
+        self.logger.warning(
+            "Flickr lookup failed for {}: {}".format(fn, error))
+
+    def _lookupSucceeded(self, flickrId):
+        self._flickrBreaker.success()
+        self._retryFlickr.discard(flickrId)
+
+    def retryFlickrLookups(self):
+        """Retries every queued Flickr lookup that is due, filling the memo
+        so the next scan finds the names. Returns (resolved, failed)."""
+        resolved = failed = 0
+        with self.busy():
+            for flickrId, fn in self._retryFlickr.due():
+                if self._lookupFlickr(fn, flickrId) is None:
+                    failed += 1
+                else:
+                    resolved += 1
+            self._saveMemoFlickr()
+        return resolved, failed
 
     def getRenameList(self):
+        """Returns the rename queue as a RenamePlan, which also works as a
+        read-only dict of absolute old path -> absolute new path."""
         return self._renameList
 
+    def getRenameIndex(self):
+        """Returns a RenameIndex over the rename queue, relative to the last
+        opened folder. Rebuilt only when the queue has changed."""
+        plan = self._renameList
+        cached = self._renameIndex
+        if (cached is None or cached[0] is not plan or
+                cached[1] != (len(plan), self._lastPath)):
+            cached = self._renameIndex = (
+                plan, (len(plan), self._lastPath),
+                RenameIndex(plan, self._lastPath))
+        return cached[2]
+
+    def getStats(self):
+        """Returns stage times and counters since the last createRenameList."""
+        return self.stats.snapshot()
+
+    def getThroughput(self):
+        """Returns rolling rates per stage (files, lookups, renames per
+        second), counts done and expected, and the estimated seconds left
+        (eta, None until known) for the running scan or rename."""
+        return self.throughput.snapshot()
+
     def renameFiles(self):
         """Validates the rename list and processes. Returns the number of files
         renamed."""
-        for oldFn, newFn in self._renameList.items():
-            os.rename(oldFn, newFn)
+        dirs = self._renameList.getDirs()
+        with self.busy(), self.stats.stage("rename"), DirFds() as dirFds:
+            self.throughput.reset(renames=len(self._renameList))
+            for dirIdx, oldName, newName, _ in self._renameList.entries():
+                dirFds.rename(dirs[dirIdx], oldName, newName)
+                self.stats.count("filesRenamed")
+                self.throughput.add("renames")
+        if self.logStats:
+            self.stats.log("renameFiles")
         return len(self._renameList)
 
-    def _checkDuplicates(self, fn):
-        """Check for duplicate path+name. Returns a new name if found,
-        None if not."""
+    def exportRenameList(self, fn):
+        """Saves the current rename list as a plan file, to be applied later
+        with applyRenameFile. Returns the number of renames saved."""
+        return exportPlan(self._renameList, fn, self._lastPath)
+
+    def applyRenameFile(self, fn, root=None):
+        """Applies a saved plan file without loading it into memory. Files
+        changed since planning are skipped. root replaces the scanned folder
+        if the tree is mounted elsewhere. Returns (renamed, skipped)."""
+        with self.busy(), self.stats.stage("rename"):
+            self.throughput.reset(renames=planSize(fn))
+            renamed, skipped = applyPlan(fn, root, self.logger,
+                                         self.throughput)
+        self.stats.count("filesRenamed", renamed)
+        if self.logStats:
+            self.stats.log("applyRenameFile")
+        return renamed, skipped
+
+    def mirrorFiles(self, target, mode="auto"):
+        """Builds a renamed mirror of the last scanned folder under target,
+        using reflinks, hard links or copies (see rename_mirror.py), without
+        touching the source. Returns counts of files per method."""
+        with self.busy(), self.stats.stage("rename"):
+            mirror = Mirror(self._lastPath, target, mode, self.logger,
+                            self._walk)
+            counts = mirror.run(self._renameList)
+        self.stats.count("filesRenamed", mirror.renamed)
+        if self.logStats:
+            self.stats.log("mirrorFiles")
+        return counts
+
+    def _walk(self, path, top=None, pruner=None):
+        """Top-down walk yielding (root, dirs, files), in the same order as
+        os.walk, with the prune settings applied. Removing names from dirs
+        stops the walk descending into them. Symlinked directories are listed
+        but not followed. top is the scanned folder that prune depths and
+        paths are relative to, if path lies below it."""
+        if pruner is None:
+            pruner = Pruner(self._prune, top or path, self.logger)
+        stack = [path]
+        while stack:
+            root = stack.pop()
+            listing = self._listDirectory(root, pruner)
+            if listing is None:
+                continue
+            dirs, files = listing
+            yield root, dirs, files
+            for d in reversed(dirs):
+                if not os.path.islink(os.path.join(root, d)):
+                    stack.append(os.path.join(root, d))
+
+    def _listDirectory(self, root, pruner=None):
+        """Returns (dirs, files) for one directory, or None if it cannot be
+        listed, pruned by pruner if given. Time spent here counts as the walk
+        stage, and is traced as a "list" span, apart from the "directory"
+        span for scanning the files found."""
+        with self.stats.stage("walk"), self._tracer.span(root, "list"):
+            try:
+                dirs, files = listDirectory(root)
+            except OSError:
+                return None
+            if pruner is not None:
+                pruner.prune(root, dirs, files)
+        return dirs, files
+
+    def _checkDuplicates(self, fn, plan=None):
+        """Check for duplicate path+name in plan, or the current rename list.
+        Returns a new name if found, None if not."""
+        if plan is None:
+            plan = self._renameList
         i = 0
         newFn = fn
-        while newFn in self._renameList.values():
+        while newFn in plan.values():
             i += 1
             strSplit = fn.rsplit(".", 1)
             strSplit[0] += " ({})".format(i)
@@ -213,30 +813,36 @@ class Model(object):
 
     def _checkDirs(self):
         """Check if directories and files exist - create if necessary."""
-        if not os.path.isdir(Model.APPDATA_ROOT):
-            os.makedirs(Model.APPDATA_ROOT)
+        if not os.path.isdir(self.dataRoot):
+            os.makedirs(self.dataRoot)
         for fn in (
-            Model.FILE_SETTINGS,
-            Model.FILE_LOG_ERROR,
-            Model.FILE_MEMO_FLICKR):
+            self.FILE_SETTINGS,
+            self.FILE_LOG_ERROR,
+            self.FILE_MEMO_FLICKR):
             if not os.path.isfile(fn):
                 open(fn, "w+b").close()
 
     def _loadMemoFlickr(self):
         """Loads the cached Flickr name list from disk."""
-        f = open(Model.FILE_MEMO_FLICKR, "r")
-        try:
-            memoFlickr = json.load(f)
-            Model.memoFlickr = memoFlickr
-        except ValueError:
-            logging.warning("no valid Flickr memo data found, starting from scratch")
-        f.close()
+        with self.stats.stage("memo"):
+            f = open(self.FILE_MEMO_FLICKR, "r")
+            try:
+                self.memoFlickr = json.load(f)
+            except ValueError:
+                self.logger.warning(
+                    "no valid Flickr memo data found, starting from scratch")
+            f.close()
 
     def _saveMemoFlickr(self):
-        """Saves the cached Flickr name list to disk."""
-        f = open(Model.FILE_MEMO_FLICKR, "w+")
-        json.dump(Model.memoFlickr, f)
-        f.close()
+        """Saves the cached Flickr name list, and the queue of failed
+        lookups, to disk."""
+        # Copy first - other scans may be adding to the memo
+        memoFlickr = dict(self.memoFlickr)
+        with self.stats.stage("memo"), Model._memoLock:
+            f = open(self.FILE_MEMO_FLICKR, "w+")
+            json.dump(memoFlickr, f)
+            f.close()
+            self._retryFlickr.save()
 
     def _isImage(self, fn):
         if fn.lower().endswith(Model.IMAGE_EXTENSIONS):
@@ -265,13 +871,17 @@ class Model(object):
 
     def _getRedirect(self, site, page):
         """Gets the 'location' header to avoid redirection."""
-        conn = httplib.HTTPConnection(site)
-        conn.request("HEAD", page)
-        response = conn.getresponse()
+        with self._tracer.span("HEAD " + page, "http", site=site):
+            self.stats.count("httpRequests")
+            response = self.transport.request("HEAD", site, page,
+                                              timeout=self.HTTP_TIMEOUT)
+            # Rate limited or server trouble - worth retrying later, unlike 404
+            if response.status == 429 or response.status >= 500:
+                raise IOError("{} returned {} {}".format(
+                    site, response.status, response.reason))
 
-        # Strip off trailing slash, or httplib won't retrieve data!
-        location = response.getheader("location")
-        conn.close()
+            # Strip off trailing slash, or httplib won't retrieve data!
+            location = response.getheader("location")
 
         if location:
             return location.rstrip("/")
@@ -285,48 +895,149 @@ class Model(object):
         valid filename with extension.
 
         Example: http://flickr.com/photo.gne?id=6795654383"""
-        if flickrId in Model.memoFlickr:
-            return self._convertName(Model.memoFlickr[flickrId])
+        name = self._memoName(fn, flickrId)
+        if name is not None:
+            return name
+        if retry:
+            self.stats.count("retries")
+        else:
+            self.stats.count("memoMisses")
 
         # Grab the redirect from the header. 404? Return converted filename
-        location = self._getRedirect("flickr.com", "/photo.gne?id=" + flickrId)
+        location = self._getRedirect(self.FLICKR_SITE,
+                                     "/photo.gne?id=" + flickrId)
         # If 404 or private page - return converted original name
-        if (not location) or ("signin" in location):
+        if not self._isPublicPhoto(location):
+            self._flickrUnavailable.add(flickrId)
             return self._convertName(fn)
 
         # Grab only the first part of the site find the title
-        conn = httplib.HTTPConnection("www.flickr.com")
-        conn.request("GET", location)
-        res = conn.getresponse()
-        numChars = 300 + (retry * 50)
-        title = res.read(numChars)
-        conn.close()
-
-        if "no longer active" in title or "Please wait" in title:
-            return self._convertName(fn)
+        with self._tracer.span("GET " + location, "http", retry=retry):
+            self.stats.count("httpRequests")
+            numChars = 300 + (retry * 50)
+            title = self.transport.request("GET", self.FLICKR_PAGE_SITE,
+                                           location,
+                                           timeout=self.HTTP_TIMEOUT,
+                                           limit=numChars).body
+            self.stats.count("bytesRead", len(title))
+
         if retry > 0:
-            logging.warning("Failed title: {}".format(title))
-        # Split the title from the page
-        title = re.search(r"<title>(.*) \| Flickr.*</title>", title)
-        if title is None:
+            self.logger.warning("Failed title: {}".format(title))
+        name = self._nameFromPage(fn, flickrId, title)
+        if name is None:
             if retry < 3:
-                logging.warning("Flickr name retrieval failed, retrying.")
+                self.logger.warning("Flickr name retrieval failed, retrying.")
+                time.sleep(backoff(retry, self.FLICKR_RETRY_DELAY,
+                                   self.FLICKR_RETRY_MAX_DELAY))
                 return self._getNameFlickr(fn, flickrId, retry + 1)
             else:
                 raise IOError("could not retrieve name from Flickr.com")
+        return name
 
-        else:
-            title = title.group(1)
-        # Strip off everything except [0-9a-Z_-]
-        title = re.sub("[^\w _-]", "", title)
+    def _memoName(self, fn, flickrId):
+        """Returns the memoized Flickr name for fn, or None."""
+        title = self.memoFlickr.get(flickrId)
+        if title is None:
+            return None
+        self.stats.count("memoHits")
+        # Memo titles may come from an import, so use this file's extension
+        title = title.rsplit(".", 1)[0]
+        return self._convertName(title + self._getExtension(fn))
+
+    def _isPublicPhoto(self, location):
+        """False for a missing (404) or private (signin) photo redirect."""
+        return bool(location) and "signin" not in location
+
+    def _nameFromPage(self, fn, flickrId, page):
+        """Returns the new name from the start of a photo page, memoizing the
+        title, or None if the title is not in the page."""
+        if "no longer active" in page or "Please wait" in page:
+            self._flickrUnavailable.add(flickrId)
+            return self._convertName(fn)
+        # Split the title from the page
+        title = re.search(r"<title>(.*) \| Flickr.*</title>", page)
+        if title is None:
+            return None
+        title = self._cleanTitle(title.group(1))
 
         # Get extension from original name
-        ext = "." + fn.rsplit(".", 1)[1].lower()
+        ext = self._getExtension(fn)
 
         # Memoize the name BEFORE conversion to allow conversion later.
-        Model.memoFlickr[flickrId] = title + ext
+        self.memoFlickr[flickrId] = title + ext
         return self._convertName(title + ext)
 
+    def _cleanTitle(self, title):
+        """Strip off everything except [0-9a-Z_-]"""
+        return re.sub("[^\w _-]", "", title)
+
+    def _getExtension(self, fn):
+        return "." + fn.rsplit(".", 1)[1].lower()
+
+    def importMemoFlickr(self, fn, fileFormat="csv", idField="id",
+                         titleField="title", batchSize=50000):
+        """Streams Flickr photo ID -> title pairs from a CSV file (with a
+        header row) or a JSON-lines file into the memo, batchSize rows at a
+        time, then saves the memo once. Rows without a valid ID or title are
+        skipped. Returns (imported, skipped)."""
+        if fileFormat not in ("csv", "jsonl"):
+            raise ValueError("unknown memo format: {}".format(fileFormat))
+        imported = skipped = 0
+        batch = {}
+        f = open(fn, "rb")
+        try:
+            if fileFormat == "csv":
+                rows = csv.DictReader(f)
+            else:
+                rows = (json.loads(line) for line in f if line.strip())
+            for row in rows:
+                flickrId = unicode(row.get(idField) or "").strip()
+                title = row.get(titleField) or ""
+                if isinstance(title, str):
+                    title = title.decode("utf-8", "replace")
+                title = self._cleanTitle(title)
+                if (not flickrId.isdigit() or not 6 <= len(flickrId) <= 10 or
+                        not title.strip()):
+                    skipped += 1
+                    continue
+                # Extension is a placeholder - lookups use the file's own
+                batch[flickrId] = title + ".jpg"
+                if len(batch) >= batchSize:
+                    self.memoFlickr.update(batch)
+                    imported += len(batch)
+                    batch = {}
+        finally:
+            f.close()
+        self.memoFlickr.update(batch)
+        imported += len(batch)
+        self._saveMemoFlickr()
+        return imported, skipped
+
+    def exportMemoFlickr(self, fn, fileFormat="csv", idField="id",
+                         titleField="title"):
+        """Writes the memo as CSV or JSON lines, sorted by photo ID, in the
+        format read by importMemoFlickr. Returns the number of rows."""
+        if fileFormat not in ("csv", "jsonl"):
+            raise ValueError("unknown memo format: {}".format(fileFormat))
+        memoFlickr = dict(self.memoFlickr)
+        f = open(fn, "wb")
+        try:
+            if fileFormat == "csv":
+                writer = csv.writer(f)
+                writer.writerow([idField, titleField])
+            for flickrId in sorted(memoFlickr, key=lambda k: (len(k), k)):
+                title = memoFlickr[flickrId].rsplit(".", 1)[0]
+                if fileFormat == "csv":
+                    if isinstance(title, unicode):
+                        title = title.encode("utf-8")
+                    writer.writerow([flickrId, title])
+                else:
+                    f.write(json.dumps({idField: flickrId,
+                                        titleField: title}) + "\n")
+        finally:
+            f.close()
+        return len(memoFlickr)
+
     def _convertName(self, fn):
         """Returns a new name by removing and replacing common punctuation,
         then applying other modifications based on settings. Extensions
@@ -342,4 +1053,7 @@ class Model(object):
         baseName = re.sub("[. _-]+", self._delimiter, baseName.strip("_- ."))
         if self._capital:
             baseName = baseName.title()
+        if self._transform:
+            # Keep the built-in name if the rules would leave nothing
+            baseName = self._transform(baseName) or baseName
         return baseName + ext
\ No newline at end of file
@@ -0,0 +1,331 @@
+"""
+Name        rename_plan.py
+Author      David Edmondson
+
+Compact storage for the rename queue. Each directory path is stored once in a
+directory table; each rename is a row across parallel arrays of directory
+index, names and flags. Compared to a dict of absolute old path -> absolute new
+path, no path prefix is ever repeated.
+
+The old and new base names of a row are packed into one "old\0new" string,
+which saves an object header and a list slot per row. NUL cannot appear in a
+file name on any supported platform.
+
+RenamePlan is also a read-only Mapping of absolute old path -> absolute new
+path, so existing callers of getRenameList() keep working. Full paths are
+built on demand and never stored.
+
+Plan files:
+exportPlan writes a plan as JSON lines, so it can be reviewed and applied
+later, on another machine. The header names a root holding every directory
+in the plan - the scanned folder, or the folder above all scanned roots.
+Directories are stored in full; applyPlan can be pointed at the same tree
+mounted elsewhere, and then moves each directory from the old root to the new
+one. Plans with directories outside their root are rejected. Each rename
+records the source size and mtime, and applyPlan skips any file which changed
+since planning. Both sides stream one line at a time.
+
+    {"format": "refcollage-plan", "version": 1, "root": "D:\\refs"}
+    {"dir": "D:\\refs\\characters"}
+    {"old": "a_b.jpg", "new": "a b.jpg", "flags": 0, "size": 1024,
+     "mtime": 1350000000.0}
+"""
+
+import os, json, logging
+from array import array
+from collections import Mapping
+from rename_dirfd import DirFds
+
+FLAG_FLICKR = 1         # New name came from a Flickr title
+FLAG_DUPLICATE = 2      # New name was given a " (n)" suffix to avoid a collision
+
+class RenamePlan(Mapping):
+    def __init__(self):
+        self._dirs = []
+        self._dirIndex = {}
+        self._dirOf = array("I")
+        self._names = []
+        self._flags = bytearray()
+
+        # Row range of each directory. Scans add a directory's rows together;
+        # directories added to again later are marked as scattered.
+        self._dirStart = array("I")
+        self._dirEnd = array("I")
+        self._scattered = set()
+
+        # New names in the directory currently being added, for fast
+        # duplicate checks while scanning.
+        self._currentDir = None
+        self._currentNames = set()
+        # Built on first lookup by old path
+        self._lookup = None
+
+    def add(self, root, oldName, newName, flags=0):
+        """Adds one rename of root/oldName to root/newName."""
+        dirIdx = self._findDir(root)
+        if dirIdx is None:
+            norm = os.path.normpath(root)
+            dirIdx = self._dirIndex[root] = self._dirIndex[norm] = len(self._dirs)
+            self._dirs.append(norm)
+            self._dirStart.append(len(self._names))
+            self._dirEnd.append(len(self._names))
+            self._currentDir = dirIdx
+            self._currentNames = set()
+        elif dirIdx != self._currentDir:
+            # Returning to an earlier directory - rare outside of watch mode
+            self._currentDir = dirIdx
+            self._currentNames = set(self._newNames(dirIdx))
+        self._currentNames.add(newName)
+        if self._dirEnd[dirIdx] == len(self._names):
+            self._dirEnd[dirIdx] += 1
+        else:
+            self._scattered.add(dirIdx)
+
+        if self._lookup is not None:
+            self._lookup[(dirIdx, oldName)] = len(self._names)
+        self._dirOf.append(dirIdx)
+        self._names.append(oldName + "\0" + newName)
+        self._flags.append(flags)
+
+    def extend(self, other):
+        """Appends every row of another plan, in order."""
+        for dirIdx, oldName, newName, flags in other.entries():
+            self.add(other._dirs[dirIdx], oldName, newName, flags)
+
+    def hasNewName(self, root, newName):
+        """Returns True if any rename in root already targets newName."""
+        dirIdx = self._findDir(root)
+        if dirIdx is None:
+            return False
+        if dirIdx == self._currentDir:
+            return newName in self._currentNames
+        return newName in self._newNames(dirIdx)
+
+    def getDirs(self):
+        """Returns the directory table, indexed by the first item of
+        entries()."""
+        return self._dirs
+
+    def entries(self):
+        """Yields (directory index, old name, new name, flags) in the order
+        they were added."""
+        dirOf, names, flags = self._dirOf, self._names, self._flags
+        for i in xrange(len(names)):
+            oldName, _, newName = names[i].partition("\0")
+            yield dirOf[i], oldName, newName, flags[i]
+
+    def _findDir(self, root):
+        """Returns the index of a directory, matching either the path as given
+        or its normalized form."""
+        dirIdx = self._dirIndex.get(root)
+        if dirIdx is None:
+            dirIdx = self._dirIndex.get(os.path.normpath(root))
+            if dirIdx is not None:
+                self._dirIndex[root] = dirIdx
+        return dirIdx
+
+    def _newNames(self, dirIdx):
+        """Returns the new names of every row in a directory."""
+        if dirIdx in self._scattered:
+            rows = [self._names[i] for i, d in enumerate(self._dirOf)
+                    if d == dirIdx]
+        else:
+            rows = self._names[self._dirStart[dirIdx]:self._dirEnd[dirIdx]]
+        return [row.partition("\0")[2] for row in rows]
+
+    # Mapping interface: absolute old path -> absolute new path
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        dirs = self._dirs
+        for dirIdx, oldName, _, _ in self.entries():
+            yield os.path.join(dirs[dirIdx], oldName)
+
+    def __getitem__(self, oldPath):
+        if self._lookup is None:
+            self._lookup = dict(((d, oldName), i) for i, (d, oldName, _, _) in
+                                enumerate(self.entries()))
+        root, oldName = os.path.split(oldPath)
+        i = self._lookup.get((self._findDir(root), oldName))
+        if i is None:
+            raise KeyError(oldPath)
+        newName = self._names[i].partition("\0")[2]
+        return os.path.join(self._dirs[self._dirOf[i]], newName)
+
+    def iteritems(self):
+        dirs = self._dirs
+        for dirIdx, oldName, newName, _ in self.entries():
+            root = dirs[dirIdx]
+            yield os.path.join(root, oldName), os.path.join(root, newName)
+
+    def itervalues(self):
+        for _, newPath in self.iteritems():
+            yield newPath
+
+    def values(self):
+        return _NewPathsView(self)
+
+class _NewPathsView(object):
+    """values() of a RenamePlan. Membership checks only look at the target
+    directory instead of building every new path."""
+    def __init__(self, plan):
+        self._plan = plan
+
+    def __contains__(self, newPath):
+        root, newName = os.path.split(newPath)
+        return self._plan.hasNewName(root, newName)
+
+    def __iter__(self):
+        return self._plan.itervalues()
+
+    def __len__(self):
+        return len(self._plan)
+
+PLAN_FORMAT = "refcollage-plan"
+PLAN_VERSION = 1
+
+def _commonDir(paths):
+    """Returns the deepest directory holding all of paths, or None if there
+    is none, such as for paths on different drives."""
+    parts = os.path.commonprefix([os.path.abspath(path).split(os.sep)
+                                  for path in paths])
+    if not parts:
+        return None
+    if len(parts) == 1:
+        # Only the filesystem root, "" on POSIX or the drive on Windows
+        return parts[0] + os.sep
+    return os.sep.join(parts)
+
+def exportPlan(plan, fn, root):
+    """Writes plan to fn as JSON lines. The header records root, or the
+    folder above root and every directory in the plan if some lie outside
+    it, as after a multi-root scan. Returns the number of renames written."""
+    dirs = plan.getDirs()
+    planRoot = root
+    if dirs:
+        planRoot = _commonDir(([root] if root else []) + list(dirs))
+        if planRoot is None:
+            raise ValueError("plan directories have no common root")
+    count = 0
+    f = open(fn, "w")
+    try:
+        f.write(json.dumps({"format": PLAN_FORMAT, "version": PLAN_VERSION,
+                            "root": planRoot}) + "\n")
+        currentDir = None
+        for dirIdx, oldName, newName, flags in plan.entries():
+            if dirIdx != currentDir:
+                currentDir = dirIdx
+                f.write(json.dumps({"dir": os.path.abspath(dirs[dirIdx])}) +
+                        "\n")
+            st = os.stat(os.path.join(dirs[dirIdx], oldName))
+            f.write(json.dumps({"old": oldName, "new": newName, "flags": flags,
+                                "size": st.st_size,
+                                "mtime": st.st_mtime}) + "\n")
+            count += 1
+    finally:
+        f.close()
+    return count
+
+def _targetExists(dirFds, root, oldName, newName, sourceStat):
+    """True if newName exists in root as a file other than oldName. On a
+    case-insensitive filesystem, a case-only rename finds its own source."""
+    try:
+        st = dirFds.stat(root, newName)
+    except OSError:
+        return False
+    if oldName.lower() != newName.lower():
+        return True
+    if os.name == "nt" or not st.st_ino:
+        # No inode numbers; the names can only refer to the same file
+        return False
+    return (st.st_ino, st.st_dev) != (sourceStat.st_ino, sourceStat.st_dev)
+
+def _skipReason(dirFds, root, entry):
+    """Returns (why, file name) if a plan entry must be skipped, or None to
+    rename it."""
+    oldName, newName = entry["old"], entry["new"]
+    try:
+        st = dirFds.stat(root, oldName)
+    except OSError:
+        return "source missing", oldName
+    if st.st_size != entry["size"] or st.st_mtime != entry["mtime"]:
+        return "source changed", oldName
+    if _targetExists(dirFds, root, oldName, newName, st):
+        return "target exists", newName
+    return None
+
+def _planDir(planRoot, root, entry):
+    """Returns the directory of a plan's "dir" entry under root. Raises
+    ValueError if it lies outside the plan's root."""
+    if not planRoot:
+        raise ValueError("plan has no root")
+    path = os.path.normpath(os.path.join(planRoot, entry["dir"]))
+    try:
+        rel = os.path.relpath(path, planRoot)
+    except ValueError:
+        rel = None      # Another drive
+    if rel is None or rel == os.pardir or rel.startswith(os.pardir + os.sep):
+        raise ValueError("plan directory outside {}: {}".format(planRoot,
+                                                                path))
+    return os.path.normpath(os.path.join(root, rel))
+
+def planSize(fn):
+    """Returns the number of renames in a plan file, one line at a time."""
+    count = 0
+    f = open(fn, "r")
+    try:
+        f.readline()
+        for line in f:
+            if "dir" not in json.loads(line):
+                count += 1
+    finally:
+        f.close()
+    return count
+
+def applyPlan(fn, root=None, logger=None, throughput=None):
+    """Applies a plan file, one line at a time. Sources which are missing or
+    changed since planning, and targets which already exist, are skipped and
+    logged to logger (default the root logger). root overrides the root
+    stored in the file. If given, throughput (see rename_rate.py) counts each
+    rename, and no longer expects those skipped. Returns (renamed,
+    skipped)."""
+    logger = logger or logging
+    renamed = skipped = 0
+    dirFds = DirFds()
+    f = open(fn, "r")
+    try:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != PLAN_FORMAT:
+            raise ValueError("not a plan file: {}".format(fn))
+        if header.get("version") != PLAN_VERSION:
+            raise ValueError("unsupported plan version: {}".format(
+                header.get("version")))
+        planRoot = header.get("root")
+        if root is None:
+            root = planRoot
+
+        currentDir = root
+        for line in f:
+            entry = json.loads(line)
+            if "dir" in entry:
+                currentDir = _planDir(planRoot, root, entry)
+                continue
+            oldName, newName = entry["old"], entry["new"]
+            skip = _skipReason(dirFds, currentDir, entry)
+            if skip:
+                reason, name = skip
+                logger.warning("plan {}, skipped: {}".format(
+                    reason, os.path.join(currentDir, name)))
+                skipped += 1
+                if throughput is not None:
+                    throughput.expect("renames", -1)
+                continue
+            dirFds.rename(currentDir, oldName, newName)
+            renamed += 1
+            if throughput is not None:
+                throughput.add("renames")
+    finally:
+        dirFds.close()
+        f.close()
+    return renamed, skipped
@@ -0,0 +1,121 @@
+"""
+Name        rename_prefetch.py
+Author      David Edmondson
+
+Idle-time prefetch of Flickr titles. Once the window is up, the folders the
+user is likely to open next - lastPath, then the other recently opened
+folders - are walked for Flickr names missing from the memo, and those are
+looked up one at a time on a background thread. Opening one of those folders
+then finds every title memoized, so its rename list is ready at once.
+
+The prefetcher stays out of the way of foreground work: it pauses between
+lookups, waits for as long as the Model is busy scanning, renaming or
+mirroring, and gives up when Flickr lookups are paused by the circuit breaker.
+Failures go through the Model's usual retry queue. Photos found missing or
+private are not looked up again in the same session. Its walks and lookups
+are counted in its own stats and throughput, never in the Model's.
+"""
+
+import threading
+from rename_retry import CircuitBreaker
+from rename_stats import Stats
+from rename_rate import Throughput
+
+class Prefetcher(object):
+    # Seconds to wait before starting, so the window opens without contention
+    START_DELAY = 2.0
+    # Seconds between lookups, and between checks while the Model is busy
+    INTERVAL = 0.2
+    # Lookups between saves of the memo
+    SAVE_EVERY = 50
+
+    def __init__(self, model, roots):
+        self.model = model
+        self.roots = list(roots)
+        # Flickr names found missing from the memo, and lookups made for them
+        self.found = 0
+        self.lookedUp = 0
+        self.failed = 0
+        self.stats = Stats(model.stats.enabled, model.logger)
+        self.throughput = Throughput()
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops after the current lookup, waiting up to timeout seconds."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _idle(self, delay):
+        """Waits delay seconds, then for as long as the Model is busy.
+        Returns False if stopped meanwhile."""
+        if self._stop.wait(delay):
+            return False
+        while self.model.isBusy():
+            if self._stop.wait(self.INTERVAL):
+                return False
+        return True
+
+    def _run(self):
+        try:
+            if self._idle(self.START_DELAY):
+                with self.model.backgroundCounters(self.stats,
+                                                   self.throughput):
+                    self._prefetch()
+        except Exception as e:
+            self.model.logger.warning(
+                "Flickr prefetch stopped: {}".format(e))
+        finally:
+            self.done.set()
+
+    def _prefetch(self):
+        model = self.model
+        unsaved = 0
+        try:
+            for fn, flickrId in self._missing():
+                if not self._idle(self.INTERVAL):
+                    break
+                if model._flickrBreaker.state != CircuitBreaker.CLOSED:
+                    model.logger.warning(
+                        "Flickr lookups paused, prefetch stopped")
+                    break
+                if (flickrId in model.memoFlickr or
+                        flickrId in model._flickrUnavailable):
+                    # Looked up by a scan meanwhile
+                    continue
+                if model._lookupFlickr(fn, flickrId) is None:
+                    self.failed += 1
+                self.lookedUp += 1
+                unsaved += 1
+                if unsaved >= self.SAVE_EVERY:
+                    model._saveMemoFlickr()
+                    unsaved = 0
+        finally:
+            if unsaved:
+                model._saveMemoFlickr()
+
+    def _missing(self):
+        """Yields (file name, Flickr ID) for each Flickr ID under the roots
+        which is not memoized or known to be unavailable, once."""
+        model = self.model
+        seen = set()
+        for root in self.roots:
+            for _, _, files in model._walk(root):
+                if not self._idle(0):
+                    return
+                for fn in files:
+                    flickrId = model._isFlickr(fn)
+                    if (flickrId and flickrId not in seen and
+                            flickrId not in model.memoFlickr and
+                            flickrId not in model._flickrUnavailable):
+                        seen.add(flickrId)
+                        self.found += 1
+                        yield fn, flickrId
@@ -16,6 +16,18 @@ know nothing about the UI itself.
 
 import socket, time, os
 from threading import Thread
+from rename_index import prepareQuery
+
+def _formatDuration(seconds):
+    """Returns seconds as "45s", "3m 05s" or "2h 10m"."""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return u"{}s".format(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return u"{}m {:02d}s".format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return u"{}h {:02d}m".format(hours, minutes)
 
 class threadModelInterrupt(Thread):
     def stop(self, model):
@@ -23,10 +35,14 @@ class threadModelInterrupt(Thread):
         model.interrupt = True
 
 class Presenter(object):
-    def __init__(self, model, interactor, view):
+    def __init__(self, model, interactor, view, prefetch=True):
         self.model = model
+        self.prefetch = prefetch
         interactor.install(self, view)
         self.view = view
+        # The progress loop keeps the view live, so opening a folder or
+        # changing settings must not start a second scan inside it
+        self._scanning = False
         self._initView()
 
     def _initView(self):
@@ -36,8 +52,13 @@ class Presenter(object):
         self.view.flickr = settings["flickr"]
         self.view.capital = settings["capital"]
         self.view.delimiter = settings["delimiter"]
+        self.view.filterOptions = [name for name, _ in self.model.FILTERS]
+        self.view.filter = self.model.FILTERS[0][0]
         self.view.enableButtonRename(False)
         self.view.resizeColumns(370)
+        # Warm the Flickr memo for the likely next folders while idle
+        if self.prefetch:
+            self.model.startPrefetch()
         self.view.start()
 
     def resizeCols(self, width):
@@ -50,6 +71,8 @@ class Presenter(object):
 
         # Checking to allow automatic updates of rename list on setting.
         # Auto updates are quick because of Flickr name caching.
+        if self._scanning:
+            return None
         lastPath = self.model.getSettings()["lastPath"]
         path = self.view.openDir(lastPath)
         if not path:
@@ -57,22 +80,37 @@ class Presenter(object):
         self._getRenameList(path)
 
     def _getRenameList(self, path):
+        self._scanning = True
+        try:
+            self._runScan(path)
+        finally:
+            self._scanning = False
+
+    def _runScan(self, path):
+        # Renames are shown as they are found, then replaced by the sorted,
+        # filtered list once the scan is done
+        self.view.rename = ([], [])
+        # The list changes until the scan is done, so it cannot be renamed
+        self.view.enableButtonRename(False)
+        self.model.publishRenames = True
         worker = threadModelInterrupt(target=self.model.createRenameList,
                                     args=(path,))
         worker.start()
         # Main progress loop
         try:
             self.view.showProgress(0, title=u"Please Wait...",
-                                   message=u"Generating rename list...",
+                                   message=self._progressMessage(),
                                    abort=True)
             while True:
+                self._appendRenames(path)
                 # Continue progress-update loop until 100% done, or interrupted
                 if self.model.progress == 100:
                     self.model.progress = 0.0
                     self.view.stopProgress()
                     renameList = self.model.getRenameList()
                     break
-                if not self.view.showProgress(self.model.progress):
+                if not self.view.showProgress(
+                        self.model.progress, message=self._progressMessage()):
                     self.model.progress = 0.0
                     self.view.stopProgress()
                     worker.stop(self.model)
@@ -85,8 +123,44 @@ to continue without Flickr name lookup, or try again later."
             self.view.showError(u"Error", error)
             renameList = None
 
+        self.model.publishRenames = False
         self._updateRenameList(renameList)
 
+    def _progressMessage(self):
+        """Describes the scan's throughput, and the time it has left."""
+        throughput = self.model.getThroughput()
+        rates = throughput["rates"]
+        message = u"Generating rename list...\n{:.0f} files/s".format(
+            rates["files"])
+        if throughput["expected"]["lookups"]:
+            message += u", {:.1f} Flickr lookups/s".format(rates["lookups"])
+        if throughput["eta"] is None:
+            return message + u"\nEstimating time left..."
+        return message + u"\nAbout {} left".format(
+            _formatDuration(throughput["eta"]))
+
+    def _appendRenames(self, path):
+        """Appends renames published since the last call to the view, if they
+        match the filter."""
+        renames = self.model.takeRenames()
+        if not renames:
+            return
+        query = prepareQuery(self.view.filterText, renames[0][1])
+        flags = dict(self.model.FILTERS).get(self.view.filter, 0)
+        old, new = [], []
+        for root, oldFn, newFn, renameFlags in renames:
+            if query is None or renameFlags & flags != flags:
+                continue
+            relDir = os.path.relpath(root, path)
+            if relDir != os.curdir:
+                oldFn = os.path.join(relDir, oldFn)
+                newFn = os.path.join(relDir, newFn)
+            if query in oldFn.lower() or query in newFn.lower():
+                old.append(oldFn)
+                new.append(newFn)
+        if old:
+            self.view.appendRename((old, new))
+
     def _updateRenameList(self, renameList):
         path = self.model.getSettings()["lastPath"]
         if not renameList:
@@ -97,29 +171,41 @@ to continue without Flickr name lookup, or try again later."
             return None
 
         self.view.enableButtonRename(True)
+        self._filterRenameList()
+        self.view.path = path
 
-        old, new = [], []
-        renameKeys = sorted(renameList.keys(),
-                            key=lambda k: (k.rsplit(os.sep)[0], k.lower()),
-                            reverse=True)
+    def filterChanged(self):
+        """Shows only the previewed renames matching the filter text and
+        filter kind."""
+        # While scanning, the filter applies to new renames, and to the whole
+        # list once it is done
+        if not self.model.scanning and self.model.getRenameList():
+            self._filterRenameList()
 
-        pathLen = len(path) + 1
-        for key in renameKeys:
-            old.append(key[pathLen:])
-            new.append(renameList[key][pathLen:])
-
-        self.view.rename = (old, new)
-        self.view.path = path
+    def _filterRenameList(self):
+        index = self.model.getRenameIndex()
+        flags = dict(self.model.FILTERS).get(self.view.filter, 0)
+        self.view.rename = index.rows(index.search(self.view.filterText,
+                                                   flags))
 
     def quit(self):
         """Opens a confirmation window. Exits the application if Yes."""
         confirm = self.view.showConfirm(
             u"Confirm Quit", u"Are you sure you want to quit?")
         if confirm:
+            # Never hold up the exit for a prefetch lookup in flight
+            self.model.close(timeout=1.0)
             self.view.Destroy()
 
     def settingsChanged(self):
         """Passes preferences onto the Model for validation and saving."""
+        if self._scanning:
+            # Too late for the running scan; show the settings it uses
+            settings = self.model.getSettings()
+            self.view.flickr = settings["flickr"]
+            self.view.capital = settings["capital"]
+            self.view.delimiter = settings["delimiter"]
+            return None
         result = {
             "flickr":    self.view.flickr,
             "capital":   self.view.capital,
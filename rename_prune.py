@@ -0,0 +1,183 @@
+"""
+Name        rename_prune.py
+Author      David Edmondson
+
+Prune rules for scans, stored in settings under "prune" and applied while a
+tree is walked, so excluded directories are never listed at all:
+
+    {"ignore": ["*_thumb.*", "renders/*"],      files to leave alone
+     "excludeDirs": [".git", "cache*", "out/renders"],
+     "maxDepth": 3,                             levels below the scanned folder
+     "skipHidden": true,                        names starting with "."
+     "refignore": true}                         read .refignore files
+
+Patterns are shell globs. A pattern containing "/" is matched against the
+path relative to the scanned folder, otherwise against the name alone.
+
+A .refignore file holds one pattern per line ("#" starts a comment). Patterns
+ending in "/" exclude directories, others ignore files. They apply to the
+directory holding the file and everything below it.
+"""
+
+import os, re, fnmatch, logging, threading
+
+PRUNE_DEFAULT = {"ignore": [],
+                 "excludeDirs": [],
+                 "maxDepth": None,
+                 "skipHidden": False,
+                 "refignore": False}
+REFIGNORE = ".refignore"
+
+def validatePrune(prune):
+    """Raises ValueError for invalid prune settings. Returns a normalized
+    copy, with defaults for anything missing."""
+    if not isinstance(prune, dict):
+        raise ValueError("prune must be an object")
+    unknown = set(prune) - set(PRUNE_DEFAULT)
+    if unknown:
+        raise ValueError("unknown prune settings: " + ", ".join(sorted(unknown)))
+    normalized = dict(PRUNE_DEFAULT)
+    normalized.update(prune)
+    for key in ("ignore", "excludeDirs"):
+        patterns = normalized[key]
+        if (not isinstance(patterns, list) or
+                not all(isinstance(p, basestring) and p for p in patterns)):
+            raise ValueError(key + " must be a list of patterns")
+        normalized[key] = list(patterns)
+    maxDepth = normalized["maxDepth"]
+    if maxDepth is not None and (not isinstance(maxDepth, int) or
+                                 isinstance(maxDepth, bool) or maxDepth < 0):
+        raise ValueError("maxDepth must be a non-negative integer or null")
+    for key in ("skipHidden", "refignore"):
+        if normalized[key] not in (False, True):
+            raise ValueError(key + " must be true or false")
+    return normalized
+
+class _Patterns(object):
+    """A list of globs compiled into two regexes: one for bare names, one for
+    relative paths."""
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        names = [p for p in patterns if "/" not in p]
+        paths = [p.strip("/") for p in patterns if "/" in p]
+        self._names = self._compile(names)
+        self._paths = self._compile(paths)
+
+    def _compile(self, patterns):
+        if not patterns:
+            return None
+        return re.compile("|".join("(?:{})".format(
+            fnmatch.translate(os.path.normcase(p))) for p in patterns))
+
+    def __nonzero__(self):
+        return bool(self.patterns)
+
+    def match(self, name, relPath):
+        if self._names and self._names.match(os.path.normcase(name)):
+            return True
+        return bool(self._paths and
+                    self._paths.match(os.path.normcase(relPath)))
+
+    def extend(self, patterns):
+        if not patterns:
+            return self
+        return _Patterns(self.patterns + tuple(patterns))
+
+class Pruner(object):
+    """Prunes the listings of one walk from root. Safe to share between the
+    threads of a sharded scan; pruned counts directories pruned so far.
+
+    A walk lists each directory once, so patterns are forgotten as soon as
+    they are used. With keep, they are kept for every directory listed, so
+    names added there later can be pruned with pruneAdded."""
+    def __init__(self, prune, root, logger=None, keep=False):
+        self.root = os.path.normpath(root)
+        self.keep = keep
+        self.logger = logger or logging
+        self.maxDepth = prune["maxDepth"]
+        self.skipHidden = prune["skipHidden"]
+        self.refignore = prune["refignore"]
+        self.pruned = 0
+        self._lock = threading.Lock()
+        base = (_Patterns(prune["ignore"]), _Patterns(prune["excludeDirs"]))
+        # Directory -> (file patterns, directory patterns), including those
+        # inherited from .refignore files above it
+        self._patterns = {self.root: base}
+        self._base = base
+        # With keep: directory -> patterns in force there, once listed
+        self._listed = {}
+
+    def prune(self, root, dirs, files):
+        """Filters a directory listing in place."""
+        root = os.path.normpath(root)
+        rel = self._relative(root)
+        if self.keep:
+            filePatterns, dirPatterns = self._patterns.get(root, self._base)
+        else:
+            filePatterns, dirPatterns = self._patterns.pop(root, self._base)
+        if self.refignore and REFIGNORE in files:
+            fileExtra, dirExtra = self._readRefignore(
+                os.path.join(root, REFIGNORE), rel)
+            filePatterns = filePatterns.extend(fileExtra)
+            dirPatterns = dirPatterns.extend(dirExtra)
+        if self.keep and (filePatterns, dirPatterns) != self._base:
+            self._listed[root] = (filePatterns, dirPatterns)
+        self._filter(root, rel, dirs, files, filePatterns, dirPatterns)
+
+    def pruneAdded(self, root, dirs, files):
+        """Filters names added to root since it was listed in place, by the
+        patterns in force there, including .refignore files above it. Only
+        for a Pruner made with keep."""
+        root = os.path.normpath(root)
+        filePatterns, dirPatterns = self._listed.get(root, self._base)
+        self._filter(root, self._relative(root), dirs, files,
+                     filePatterns, dirPatterns)
+
+    def _relative(self, root):
+        """root relative to the scanned folder, as a prefix for patterns."""
+        rel = os.path.relpath(root, self.root)
+        return "" if rel == os.curdir else rel.replace(os.sep, "/") + "/"
+
+    def _filter(self, root, rel, dirs, files, filePatterns, dirPatterns):
+        keptDirs = []
+        if self.maxDepth is None or rel.count("/") < self.maxDepth:
+            for d in dirs:
+                if ((self.skipHidden and d.startswith(".")) or
+                        (dirPatterns and dirPatterns.match(d, rel + d))):
+                    continue
+                keptDirs.append(d)
+                if (filePatterns, dirPatterns) != self._base:
+                    self._patterns[os.path.join(root, d)] = (filePatterns,
+                                                             dirPatterns)
+        if len(keptDirs) < len(dirs):
+            with self._lock:
+                self.pruned += len(dirs) - len(keptDirs)
+        dirs[:] = keptDirs
+
+        if self.skipHidden or filePatterns:
+            files[:] = [fn for fn in files
+                        if not (self.skipHidden and fn.startswith(".")) and
+                        not (filePatterns and filePatterns.match(fn, rel + fn))]
+
+    def _readRefignore(self, fn, rel):
+        """Returns (file patterns, directory patterns), made relative to the
+        scanned folder where they contain a "/"."""
+        filePatterns, dirPatterns = [], []
+        try:
+            f = open(fn, "r")
+        except IOError as e:
+            self.logger.warning("could not read {}: {}".format(fn, e))
+            return filePatterns, dirPatterns
+        try:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                isDir = line.endswith("/")
+                line = line.rstrip("/")
+                if "/" in line:
+                    line = rel + line.lstrip("/")
+                (dirPatterns if isDir else filePatterns).append(line)
+        finally:
+            f.close()
+        return filePatterns, dirPatterns
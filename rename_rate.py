@@ -0,0 +1,112 @@
+"""
+Name        rename_rate.py
+Author      David Edmondson
+
+Rolling throughput for the Model's long-running work, and the time left
+estimated from it. A percentage of files done says little about the time left
+when most files convert instantly and a few wait seconds each on Flickr, so
+each stage is measured separately, and the estimate takes the slowest.
+
+Stages      files (scanned), lookups (Flickr names not in the memo),
+            renames
+
+Recording is a dict update under a lock, and always on; sharded scans record
+from several threads. Rates are only worked out when read: each read samples
+the counts, and rates are taken across the samples from the last WINDOW
+seconds.
+
+Work may be keyed, so that it counts once however often it comes up: three
+sizes of one Flickr photo are one lookup.
+"""
+
+import threading
+from collections import deque
+from timeit import default_timer
+
+RATE_STAGES = ("files", "lookups", "renames")
+
+class Throughput(object):
+    # Seconds of samples rates are taken over
+    WINDOW = 5.0
+
+    def __init__(self, clock=default_timer):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, **expected):
+        """Starts over, expecting the given totals per stage (for example
+        files=100), or none where unknown."""
+        with self._lock:
+            self.counts = dict((name, 0) for name in RATE_STAGES)
+            self.expected = dict((name, expected.get(name, 0))
+                                 for name in RATE_STAGES)
+            self._keysAdded = set()
+            self._keysExpected = set()
+            self._started = self._clock()
+            self._samples = deque([(self._started, dict(self.counts))])
+
+    def add(self, stage, n=1, key=None):
+        """Adds n done to stage. Keyed work counts only the first time
+        since the reset."""
+        with self._lock:
+            if key is not None:
+                if (stage, key) in self._keysAdded:
+                    return
+                self._keysAdded.add((stage, key))
+            self.counts[stage] += n
+
+    def expect(self, stage, n=0, keys=()):
+        """Adds n, and one for each of keys not expected since the reset, to
+        the expected total for stage, for work found as it goes. n may be
+        negative, for work found not to be needed after all."""
+        with self._lock:
+            for key in keys:
+                if (stage, key) not in self._keysExpected:
+                    self._keysExpected.add((stage, key))
+                    n += 1
+            self.expected[stage] += n
+
+    def rates(self):
+        """Returns {stage: items per second} over the last WINDOW seconds."""
+        with self._lock:
+            return self._rates(self._clock(), dict(self.counts))
+
+    def _rates(self, now, counts):
+        samples = self._samples
+        samples.append((now, counts))
+        # Keep the newest sample at least WINDOW old, to measure from
+        while len(samples) > 2 and now - samples[1][0] >= self.WINDOW:
+            samples.popleft()
+        then, before = samples[0]
+        if now <= then:
+            return dict((name, 0.0) for name in RATE_STAGES)
+        return dict((name, (counts[name] - before[name]) / (now - then))
+                    for name in RATE_STAGES)
+
+    def snapshot(self):
+        """Returns {"rates": ..., "counts": ..., "expected": ..., "eta": ...}.
+        eta is the estimated seconds left, or None until every stage with
+        work left has made some progress."""
+        with self._lock:
+            now = self._clock()
+            counts = dict(self.counts)
+            rates = self._rates(now, counts)
+            eta = 0.0
+            for name in RATE_STAGES:
+                left = self.expected[name] - counts[name]
+                if left <= 0:
+                    continue
+                # A stage may be idle for now, as with lookups during a run
+                # of local names; fall back to its rate since the start
+                rate = rates[name]
+                if rate <= 0 and now > self._started:
+                    rate = counts[name] / (now - self._started)
+                if rate <= 0:
+                    eta = None
+                    break
+                eta = max(eta, left / rate)
+            return {"rates": rates,
+                    "counts": counts,
+                    "expected": dict(self.expected),
+                    "eta": eta}
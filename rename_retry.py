@@ -0,0 +1,139 @@
+"""
+Name        rename_retry.py
+Author      David Edmondson
+
+Failure handling for remote lookups, so one bad Flickr fetch no longer
+throws away a whole scan.
+
+RetryQueue      Flickr IDs whose lookup failed, saved to disk. Each entry is
+                due for another try after an exponential backoff with jitter,
+                growing with every failed attempt. Until then, scans convert
+                the name locally without touching the network.
+CircuitBreaker  Stops all lookups to a host after several consecutive
+                failures, for a cooldown period. One trial lookup is then let
+                through; success closes the breaker, failure reopens it. A
+                scan against a dead host costs a few failures, not one per
+                file.
+"""
+
+import json, time, random, logging, threading
+from timeit import default_timer
+
+def backoff(attempt, base, cap):
+    """Delay in seconds before retry number attempt (from 0): exponential,
+    capped, with full jitter so clients do not retry in lockstep."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class RetryQueue(object):
+    # Backoff between retries of one ID, in seconds
+    BASE_DELAY = 60.0
+    MAX_DELAY = 24 * 60 * 60.0
+
+    def __init__(self, fn, clock=time.time, logger=None):
+        self.fn = fn
+        self._clock = clock
+        self.logger = logger or logging
+        self._lock = threading.Lock()
+        # Flickr ID -> {"fn", "attempts", "due", "error"}
+        self._entries = {}
+        self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, flickrId):
+        return flickrId in self._entries
+
+    def load(self):
+        try:
+            f = open(self.fn, "r")
+        except IOError:
+            return
+        try:
+            entries = json.load(f)
+            if not isinstance(entries, dict):
+                raise ValueError
+            self._entries = entries
+        except ValueError:
+            self.logger.warning(
+                "no valid Flickr retry data found, starting from scratch")
+        finally:
+            f.close()
+
+    def save(self):
+        with self._lock:
+            entries = dict(self._entries)
+        f = open(self.fn, "w+")
+        json.dump(entries, f)
+        f.close()
+
+    def add(self, flickrId, fn, error):
+        """Records a failed lookup and schedules the next attempt."""
+        with self._lock:
+            entry = self._entries.get(flickrId, {"attempts": 0})
+            delay = backoff(entry["attempts"], self.BASE_DELAY, self.MAX_DELAY)
+            self._entries[flickrId] = {"fn": fn,
+                                       "attempts": entry["attempts"] + 1,
+                                       "due": self._clock() + delay,
+                                       "error": str(error)}
+
+    def discard(self, flickrId):
+        with self._lock:
+            self._entries.pop(flickrId, None)
+
+    def isWaiting(self, flickrId):
+        """True if flickrId failed recently and is not yet due a retry."""
+        entry = self._entries.get(flickrId)
+        return entry is not None and entry["due"] > self._clock()
+
+    def due(self):
+        """Returns [(flickrId, fn)] for every entry due a retry, oldest
+        first."""
+        now = self._clock()
+        with self._lock:
+            entries = sorted(self._entries.items(),
+                             key=lambda item: item[1]["due"])
+        return [(flickrId, entry["fn"]) for flickrId, entry in entries
+                if entry["due"] <= now]
+
+class CircuitBreaker(object):
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, threshold=3, cooldown=60.0, clock=default_timer,
+                 logger=None):
+        self.logger = logger or logging
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._openedAt = 0.0
+
+    def allow(self):
+        """Returns True if a request may be made now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                    self._clock() - self._openedAt >= self.cooldown):
+                # Let exactly one trial request through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if (self.state == self.HALF_OPEN or
+                    self._failures >= self.threshold):
+                if self.state != self.OPEN:
+                    self.logger.warning("Flickr lookups failing, pausing for "
+                                    "{:.0f}s".format(self.cooldown))
+                self.state = self.OPEN
+                self._openedAt = self._clock()
@@ -0,0 +1,178 @@
+"""
+Name        rename_rules.py
+Author      David Edmondson
+
+User-defined rename rules, stored in settings as a list of JSON objects and
+applied in order to each base name (without extension) after the built-in
+delimiter and capitalization settings:
+
+    {"rule": "stripPrefix", "prefix": "IMG ", "ignoreCase": true}
+    {"rule": "replace", "pattern": "(?i)\\bref\\b", "with": "reference"}
+    {"rule": "lower"}       also "upper" and "title"
+    {"rule": "clip", "length": 40, "words": 5}      either limit is optional
+
+Rules are validated, then compiled once per distinct rule list into a single
+function, so a batch of names is still transformed in one pass with no
+per-name parsing. While compiling, adjacent rules are fused where the result
+is provably the same: runs of case rules collapse to the last one (each
+replaces the whole case), runs of clips collapse to the tightest limits, and
+runs of prefixes become one anchored regex. Regex replacements always run in
+order, since each may depend on the output of the last.
+
+Rules transform base names only: path separators in the result are replaced
+by the delimiter, so a rule can never move a file to another directory.
+"""
+
+import os, re, sre_parse, json, threading
+
+RULE_TYPES = ("stripPrefix", "replace", "lower", "upper", "title", "clip")
+_CASES = {"lower": lambda s: s.lower(),
+          "upper": lambda s: s.upper(),
+          "title": lambda s: s.title()}
+
+_compiled = {}
+_compiledLock = threading.Lock()
+_SEPARATORS = set(sep for sep in ("/", os.sep, os.altsep) if sep)
+
+def validateRules(rules):
+    """Raises ValueError describing the first invalid rule. Returns a
+    normalized copy of the rule list."""
+    if not isinstance(rules, list):
+        raise ValueError("rules must be a list")
+    normalized = []
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict) or rule.get("rule") not in RULE_TYPES:
+            raise ValueError("rule {}: rule must be one of: {}".format(
+                i, ", ".join(RULE_TYPES)))
+        kind = rule["rule"]
+        if kind == "stripPrefix":
+            if not isinstance(rule.get("prefix"), basestring) or \
+                    not rule["prefix"]:
+                raise ValueError("rule {}: prefix must be a string".format(i))
+            rule = {"rule": kind, "prefix": rule["prefix"],
+                    "ignoreCase": bool(rule.get("ignoreCase", False))}
+        elif kind == "replace":
+            pattern = rule.get("pattern")
+            if not isinstance(pattern, basestring) or not pattern:
+                raise ValueError("rule {}: pattern must be a string".format(i))
+            replacement = rule.get("with", "")
+            if not isinstance(replacement, basestring):
+                raise ValueError("rule {}: with must be a string".format(i))
+            if any(sep in replacement for sep in _SEPARATORS):
+                raise ValueError("rule {}: with must not contain path "
+                                 "separators".format(i))
+            try:
+                regex = re.compile(pattern)
+            except re.error as e:
+                raise ValueError("rule {}: bad pattern: {}".format(i, e))
+            _checkTemplate(i, regex, replacement)
+            rule = {"rule": kind, "pattern": pattern,
+                    "with": rule.get("with", "")}
+        elif kind == "clip":
+            for limit in ("length", "words"):
+                value = rule.get(limit)
+                if value is not None and (not isinstance(value, int) or
+                                          isinstance(value, bool) or
+                                          value < 1):
+                    raise ValueError("rule {}: {} must be a positive "
+                                     "integer".format(i, limit))
+            if rule.get("length") is None and rule.get("words") is None:
+                raise ValueError("rule {}: clip needs length or words"
+                                 .format(i))
+            rule = {"rule": kind, "length": rule.get("length"),
+                    "words": rule.get("words")}
+        else:
+            rule = {"rule": kind}
+        normalized.append(rule)
+    return normalized
+
+def _checkTemplate(i, regex, replacement):
+    """Raises ValueError if replacement refers to a group regex does not
+    have, or is not a valid template."""
+    try:
+        groups, _ = sre_parse.parse_template(replacement, regex)
+    except (re.error, IndexError) as e:
+        raise ValueError("rule {}: bad with: {}".format(i, e))
+    for _, group in groups:
+        if group > regex.groups:
+            raise ValueError("rule {}: bad with: invalid group reference "
+                             "{}".format(i, group))
+
+def compileRules(rules, delimiter=" "):
+    """Returns a function mapping a base name to its transformed base name.
+    Compiled functions are cached by rule list and delimiter."""
+    key = (json.dumps(rules, sort_keys=True), delimiter)
+    with _compiledLock:
+        transform = _compiled.get(key)
+        if transform is None:
+            transform = _compiled[key] = _compile(validateRules(rules),
+                                                   delimiter)
+    return transform
+
+def _fuse(rules, fuse=True):
+    """Groups adjacent rules which can run as one step. Returns a list of
+    (kind, [rules]); without fuse, one rule per step."""
+    groups = []
+    for rule in rules:
+        kind = rule["rule"]
+        if kind in _CASES:
+            kind = "case"
+        if (fuse and groups and groups[-1][0] == kind and
+                kind != "replace"):
+            groups[-1][1].append(rule)
+        else:
+            groups.append((kind, [rule]))
+    return groups
+
+def _compileStep(kind, rules, delimiter):
+    if kind == "case":
+        return _CASES[rules[-1]["rule"]]
+
+    if kind == "clip":
+        lengths = [r["length"] for r in rules if r["length"] is not None]
+        words = [r["words"] for r in rules if r["words"] is not None]
+        length = min(lengths) if lengths else None
+        wordLimit = min(words) if words else None
+
+        def clip(s):
+            if wordLimit is not None:
+                s = delimiter.join(s.split(delimiter)[:wordLimit])
+            if length is not None:
+                s = s[:length]
+            return s
+        return clip
+
+    if kind == "stripPrefix":
+        # Each prefix optional, in order - the same as stripping each prefix
+        # in turn, in one match
+        regex = re.compile("^" + "".join(
+            "(?:{})?".format(_prefixPattern(r)) for r in rules))
+        return lambda s: regex.sub("", s, count=1)
+
+    rule = rules[0]
+    regex = re.compile(rule["pattern"])
+    replacement = rule["with"]
+    return lambda s: regex.sub(replacement, s)
+
+def _prefixPattern(rule):
+    prefix = re.escape(rule["prefix"])
+    if not rule["ignoreCase"]:
+        return prefix
+    # Python 2 has no scoped (?i:...) flags, so spell out each letter's cases
+    return "".join("[{}{}]".format(c.lower(), c.upper()) if c.isalpha() else c
+                   for c in prefix)
+
+def _compile(rules, delimiter, fuse=True):
+    steps = [_compileStep(kind, group, delimiter)
+             for kind, group in _fuse(rules, fuse)]
+    if not steps:
+        return None
+
+    def transform(baseName):
+        for step in steps:
+            baseName = step(baseName)
+        for sep in _SEPARATORS:
+            if sep in baseName:
+                baseName = baseName.replace(sep, delimiter)
+        return baseName.strip(delimiter)
+    return transform
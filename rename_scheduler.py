@@ -0,0 +1,141 @@
+"""
+Name        rename_scheduler.py
+Author      David Edmondson
+
+Scans many library roots with one Model. Roots are grouped by device
+(st_dev), so scans on different disks or shares run in parallel while each
+device only ever sees a limited number of concurrent scans - a slow NAS no
+longer holds up a local SSD, and one disk is never thrashed by several walks
+at once.
+
+Progress and results are combined into the Model, exactly as though a single
+createRenameList had run: model.progress covers all roots, and the combined
+rename list is available from model.getRenameList() when done.
+"""
+
+import os, threading
+from Queue import Queue, Empty
+
+from rename_plan import RenamePlan
+
+class Scheduler(object):
+    def __init__(self, model, perDevice=1):
+        if perDevice < 1:
+            raise ValueError("perDevice must be at least 1")
+        self.model = model
+        self.perDevice = perDevice
+
+        self._lock = threading.Lock()
+        self._errors = []
+
+    def groupByDevice(self, roots):
+        """Returns {st_dev: [roots]}, keeping the given order within each
+        device."""
+        devices = {}
+        for root in self._uniqueRoots(roots):
+            devices.setdefault(os.stat(root).st_dev, []).append(root)
+        return devices
+
+    def _uniqueRoots(self, roots):
+        """Absolute roots in the given order, without repeats. Roots nested
+        inside another root are dropped, since they would be scanned twice."""
+        roots = [os.path.abspath(root) for root in roots]
+        unique = []
+        for root in roots:
+            nested = any(root.startswith(os.path.join(other, ""))
+                         for other in roots if other != root)
+            if not nested and root not in unique:
+                unique.append(root)
+        return unique
+
+    def createRenameList(self, roots):
+        """Scans every root and stores the combined rename list in the model.
+        Returns False if interrupted; re-raises the first error from any
+        scan."""
+        with self.model.busy():
+            return self._createRenameList(roots)
+
+    def _createRenameList(self, roots):
+        model = self.model
+        order = self._uniqueRoots(roots)
+        devices = self.groupByDevice(order)
+        plans = dict((root, RenamePlan()) for root in order)
+
+        model._renameList = RenamePlan()
+        model.stats.reset()
+        model.throughput.reset()
+        model.progress = 0.0
+        model._walkDone = 0.0
+        model._walkLen = 0
+        model._walkCounted = True
+        self._errors = []
+
+        # Each root is counted just before it is scanned, so a slow device
+        # still counting never holds up scans on the others. Progress may
+        # stall while totals grow, but never goes backwards.
+        self._runPerDevice(devices, lambda root: self._scan(root, plans[root]))
+
+        interrupted = model.interrupt
+        model._saveMemoFlickr()     # Keep Flickr progress!
+        if self._errors:
+            raise self._errors[0]
+        if interrupted:
+            model.interrupt = False
+            return False
+
+        for root in order:
+            model._renameList.extend(plans[root])
+        if order:
+            for root in reversed(order):
+                model._rememberPath(root)
+            model._saveSettings()
+        if model.logStats:
+            model.stats.log("createRenameList")
+        model._openedPath = True
+        model.progress = 100
+        return True
+
+    def _runPerDevice(self, devices, job):
+        """Runs job(root) for every root, with at most perDevice concurrent
+        jobs on each device. Blocks until all jobs are done."""
+        threads = []
+        for deviceRoots in devices.values():
+            queue = Queue()
+            for root in deviceRoots:
+                queue.put(root)
+            for _ in xrange(min(self.perDevice, len(deviceRoots))):
+                thread = threading.Thread(target=self._worker,
+                                          args=(queue, job))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def _worker(self, queue, job):
+        while not self.model.interrupt and not self._failed():
+            try:
+                root = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                job(root)
+            except Exception as e:
+                with self._lock:
+                    self._errors.append(e)
+
+    def _failed(self):
+        with self._lock:
+            return bool(self._errors)
+
+    def _count(self, root):
+        count, lookupIds = self.model._countFiles(root)
+        with self.model._progressLock:
+            self.model._walkLen += count
+        self.model.throughput.expect("files", count)
+        self.model.throughput.expect("lookups", keys=lookupIds)
+
+    def _scan(self, root, plan):
+        self._count(root)
+        if not self.model.interrupt:
+            self.model._scanRoot(root, plan)
@@ -0,0 +1,400 @@
+"""
+Name        rename_service.py
+Author      David Edmondson
+
+Service mode: runs one long-lived Model behind a local HTTP/JSON API, so every
+workstation's client shares the same warm Flickr memo, retry queue and rename
+list instead of each starting cold. Jobs are queued and run one at a time, so
+scans never compete for the same disks.
+
+API (all bodies JSON):
+    POST   /jobs        Submit a job, returns {"id": ...}
+                        {"type": "scan", "path": ..., "settings": {...}}
+                        {"type": "plan", "path": ..., "planFile": ...}
+                        {"type": "apply", "planFile": ..., "root": ...}
+                        "settings" is optional, and overrides only the given
+                        settings. Scans return the first "limit" renames
+                        (default 1000) with the total.
+    GET    /jobs        All jobs, oldest first
+    GET    /jobs/[ID]   One job: state (queued, running, done, failed or
+                        cancelled), progress and throughput (rates and
+                        estimated seconds left) while running, then result
+                        or error
+    DELETE /jobs/[ID]   Cancels a queued job, or interrupts a running scan
+                        or plan. A running apply always completes.
+    GET    /status      Queue length and cache sizes
+
+Settings given with a job only apply to that job; the previous settings are
+restored once it finishes.
+
+The service only listens on localhost. Since any local process - including
+web pages in a browser - can reach it, every request must carry the token
+from serviceToken.cfg in the data root (created on first start, readable only
+by its owner) in the X-RefCollage-Token header. POST bodies must be sent as
+application/json, and requests with an Origin header are refused.
+
+Usage:
+    python rename_service.py [--port 8765]
+
+    client = ServiceClient("127.0.0.1:8765", readToken(model))
+    job = client.wait(client.submit({"type": "scan", "path": path}))
+"""
+
+import os, json, time, hmac, httplib, argparse, threading
+import BaseHTTPServer, SocketServer
+from Queue import Queue
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = (
+    "queued", "running", "done", "failed", "cancelled")
+JOB_TYPES = ("scan", "plan", "apply")
+# Jobs which stop early when the model is interrupted
+INTERRUPTIBLE = ("scan", "plan")
+TOKEN_HEADER = "X-RefCollage-Token"
+
+def readToken(model):
+    """Returns the service token from the model's data root, creating it
+    (readable by its owner only) if there is none yet."""
+    fn = model.FILE_SERVICE_TOKEN
+    try:
+        fd = os.open(fn, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+    except OSError:
+        f = open(fn, "r")
+        try:
+            return f.read().strip()
+        finally:
+            f.close()
+    token = os.urandom(24).encode("hex")
+    f = os.fdopen(fd, "w")
+    try:
+        f.write(token)
+    finally:
+        f.close()
+    return token
+
+class Job(object):
+    def __init__(self, jobId, params):
+        self.id = jobId
+        self.type = params.get("type")
+        self.params = params
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def toDict(self, progress=None, throughput=None):
+        job = {"id": self.id,
+               "type": self.type,
+               "state": self.state,
+               "submitted": self.submitted,
+               "started": self.started,
+               "finished": self.finished}
+        if self.state == RUNNING:
+            job["progress"] = progress
+            job["throughput"] = throughput
+        elif self.state == DONE:
+            job["progress"] = 100
+            job["result"] = self.result
+        elif self.state == FAILED:
+            job["error"] = self.error
+        return job
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        # Browsers always send Origin on cross-site requests
+        if self.headers.getheader("origin") is not None:
+            return self._send(403, {"error": "cross-origin requests refused"})
+        token = self.headers.getheader(TOKEN_HEADER) or ""
+        if not hmac.compare_digest(token, service.token):
+            return self._send(401, {"error": "missing or wrong token"})
+        try:
+            if method == "POST" and parts == ["jobs"]:
+                contentType = self.headers.getheader("content-type") or ""
+                if contentType.split(";")[0].strip() != "application/json":
+                    return self._send(415, {"error": "expected JSON"})
+                length = int(self.headers.getheader("content-length") or 0)
+                params = json.loads(self.rfile.read(length) or "null")
+                return self._send(202, {"id": service.submit(params)})
+            if method == "GET" and parts == ["jobs"]:
+                return self._send(200, service.jobs())
+            if method == "GET" and parts == ["status"]:
+                return self._send(200, service.status())
+            if len(parts) == 2 and parts[0] == "jobs":
+                if method == "GET":
+                    return self._send(200, service.job(parts[1]))
+                if method == "DELETE":
+                    return self._send(200, service.cancel(parts[1]))
+            self._send(404, {"error": "not found"})
+        except KeyError:
+            self._send(404, {"error": "no such job"})
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+
+    def _send(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class Service(object):
+    # Finished jobs kept for polling; older ones are forgotten
+    MAX_FINISHED = 100
+
+    def __init__(self, model, host="127.0.0.1", port=0):
+        self.model = model
+        self.host = host
+        self.port = port
+        self.token = readToken(model)
+
+        self._jobs = {}
+        self._order = []
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._nextId = 1
+        self._current = None
+        self._server = None
+        self._threads = []
+
+    def start(self):
+        """Starts the worker and HTTP server threads. Returns "host:port"."""
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.service = self
+        for target in (self._server.serve_forever, self._work):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return "{}:{}".format(*self._server.server_address)
+
+    def stop(self):
+        """Stops serving, interrupting any running job."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._current:
+            self.model.interrupt = True
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, params):
+        """Validates and queues a job. Returns its ID."""
+        if not isinstance(params, dict) or params.get("type") not in JOB_TYPES:
+            raise ValueError("job type must be one of: " + ", ".join(JOB_TYPES))
+        required = {"scan": ("path",), "plan": ("path", "planFile"),
+                    "apply": ("planFile",)}[params["type"]]
+        for key in required:
+            if not params.get(key):
+                raise ValueError("{} job needs {}".format(params["type"], key))
+        settings = params.get("settings", {})
+        if not isinstance(settings, dict):
+            raise ValueError("settings must be an object")
+
+        with self._lock:
+            job = Job(str(self._nextId), params)
+            self._nextId += 1
+            self._jobs[job.id] = job
+            self._order.append(job.id)
+            self._forgetFinished()
+        self._queue.put(job)
+        return job.id
+
+    def job(self, jobId):
+        with self._lock:
+            return self._jobs[jobId].toDict(self.model.progress,
+                                            self.model.getThroughput())
+
+    def jobs(self):
+        throughput = self.model.getThroughput()
+        with self._lock:
+            return [self._jobs[jobId].toDict(self.model.progress, throughput)
+                    for jobId in self._order]
+
+    def cancel(self, jobId):
+        with self._lock:
+            job = self._jobs[jobId]
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished = time.time()
+            elif job.state == RUNNING and job.type in INTERRUPTIBLE:
+                # The worker marks the job cancelled once the model stops
+                job.cancelled = True
+                self.model.interrupt = True
+            return job.toDict(self.model.progress,
+                              self.model.getThroughput())
+
+    def status(self):
+        with self._lock:
+            queued = sum(1 for job in self._jobs.itervalues()
+                         if job.state == QUEUED)
+            running = self._current.id if self._current else None
+        return {"queued": queued,
+                "running": running,
+                "memoFlickr": len(self.model.memoFlickr),
+                "retryFlickr": len(self.model._retryFlickr),
+                "renameList": len(self.model.getRenameList()),
+                "version": self.model.version}
+
+    def _forgetFinished(self):
+        finished = [jobId for jobId in self._order
+                    if self._jobs[jobId].state in (DONE, FAILED, CANCELLED)]
+        for jobId in finished[:max(0, len(finished) - self.MAX_FINISHED)]:
+            self._order.remove(jobId)
+            del self._jobs[jobId]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.started = time.time()
+                self._current = job
+            try:
+                result = self._run(job)
+            except Exception as e:
+                self.model.logger.exception(
+                    "service job {} failed".format(job.id))
+                state, result, error = FAILED, None, str(e)
+            else:
+                state = CANCELLED if job.cancelled else DONE
+                error = None
+            with self._lock:
+                job.state = state
+                job.result = result
+                job.error = error
+                job.finished = time.time()
+                self._current = None
+            # Once the job is no longer running, no cancel can interrupt the
+            # model for it, so a late one must not stop the next job
+            self.model.interrupt = False
+
+    def _run(self, job):
+        model = self.model
+        params = job.params
+        if not params.get("settings"):
+            return self._runJob(job)
+        previous = model.getSettings()
+        settings = dict(previous)
+        settings.update(params["settings"])
+        model.changeSettings(settings)
+        try:
+            return self._runJob(job)
+        finally:
+            model.changeSettings(previous)
+
+    def _runJob(self, job):
+        model = self.model
+        params = job.params
+        if job.type == "apply":
+            renamed, skipped = model.applyRenameFile(params["planFile"],
+                                                     params.get("root"))
+            return {"renamed": renamed, "skipped": skipped}
+
+        if not model.createRenameList(params["path"]):
+            # Interrupted: the rename list is empty, and must not replace
+            # an existing plan file
+            job.cancelled = True
+            return None
+        renameList = model.getRenameList()
+        if job.type == "plan":
+            return {"renames": model.exportRenameList(params["planFile"]),
+                    "planFile": params["planFile"]}
+        limit = params.get("limit", 1000)
+        renames = []
+        for old, new in renameList.iteritems():
+            if len(renames) >= limit:
+                break
+            renames.append([old, new])
+        return {"total": len(renameList), "renames": renames}
+
+class ServiceClient(object):
+    """Minimal client for the service API."""
+    def __init__(self, address, token, timeout=10):
+        self.address = address
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, method, path, data=None):
+        conn = httplib.HTTPConnection(self.address, timeout=self.timeout)
+        try:
+            body = json.dumps(data) if data is not None else None
+            conn.request(method, path, body,
+                         {"Content-Type": "application/json",
+                          TOKEN_HEADER: self.token})
+            response = conn.getresponse()
+            result = json.loads(response.read())
+        finally:
+            conn.close()
+        if response.status >= 400:
+            raise ValueError(result.get("error", response.reason))
+        return result
+
+    def submit(self, params):
+        return self._request("POST", "/jobs", params)["id"]
+
+    def job(self, jobId):
+        return self._request("GET", "/jobs/" + jobId)
+
+    def jobs(self):
+        return self._request("GET", "/jobs")
+
+    def cancel(self, jobId):
+        return self._request("DELETE", "/jobs/" + jobId)
+
+    def status(self):
+        return self._request("GET", "/status")
+
+    def wait(self, jobId, interval=0.1):
+        """Polls until the job finishes. Returns the final job."""
+        while True:
+            job = self.job(jobId)
+            if job["state"] in (DONE, FAILED, CANCELLED):
+                return job
+            time.sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    from rename_model import Model
+    model = Model()
+    service = Service(model, port=args.port)
+    print "Serving on " + service.start()
+    print "Token in " + model.FILE_SERVICE_TOKEN
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        service.stop()
+
+if __name__ == "__main__":
+    main()
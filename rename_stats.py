@@ -0,0 +1,85 @@
+"""
+Name        rename_stats.py
+Author      David Edmondson
+
+Per-stage timers and counters for the Model. Disabled by default: every call
+then returns immediately, and stage() hands back a shared no-op timer, so the
+cost when off is a single attribute check. When on, updates take a lock, as
+sharded and multi-root scans record from several threads. Stage times are
+then summed across threads, so may add up to more than the time taken.
+
+Stages      walk, convert, flickr, duplicates, memo, rename
+Counters    filesSeen, imagesMatched, memoHits, memoMisses, httpRequests,
+            bytesRead, retries, lookupFailures, filesRenamed, dirsPruned
+"""
+
+import logging, threading
+from timeit import default_timer
+
+STAGES = ("walk", "convert", "flickr", "duplicates", "memo", "rename")
+COUNTERS = ("filesSeen", "imagesMatched", "memoHits", "memoMisses",
+            "httpRequests", "bytesRead", "retries", "lookupFailures",
+            "filesRenamed", "dirsPruned")
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _StageTimer(object):
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = default_timer() - self.start
+        with self.stats._lock:
+            self.stats.stages[self.name] += elapsed
+        return False
+
+class Stats(object):
+    def __init__(self, enabled=False, logger=None):
+        self.enabled = enabled
+        self.logger = logger or logging
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = dict((name, 0.0) for name in STAGES)
+        self.counters = dict((name, 0) for name in COUNTERS)
+
+    def stage(self, name):
+        """Returns a context manager which adds its elapsed time to a stage."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def snapshot(self):
+        """Returns a copy of all stage times (seconds) and counters."""
+        return {"enabled": self.enabled,
+                "stages": dict(self.stages),
+                "counters": dict(self.counters)}
+
+    def log(self, action):
+        """Writes current stats to the error log."""
+        if not self.enabled:
+            return
+        stages = ", ".join("{} {:.3f}s".format(name, self.stages[name])
+                           for name in STAGES)
+        counters = ", ".join("{} {}".format(name, self.counters[name])
+                             for name in COUNTERS)
+        self.logger.warning(
+            "{} stats: {}; {}".format(action, stages, counters))
@@ -1,13 +1,60 @@
 import unittest
-from test.rename_tests_model import TestRequiringTemporaryFiles, TestNotRequiringTemporaryFiles
+from test.rename_tests_model import TestRequiringTemporaryFiles, TestNotRequiringTemporaryFiles, TestMemoFlickr
 from test.rename_tests_presenter import TestPresenterRequiringTemporaryFiles, TestPresenterNotRequiringTemporaryFiles
+from test.rename_tests_flickr import TestFlickrStub, TestFlickrStubTruncated, TestFlickrStubRateLimited, TestFlickrStubDown, TestRetry
+from test.rename_tests_async import TestAsyncModel, TestAsyncModelDown
+from test.rename_tests_service import TestService
+from test.rename_tests_rules import TestRules
+from test.rename_tests_mirror import TestMirror
+from test.rename_tests_prune import TestPrune
+from test.rename_tests_index import TestRenameIndex
+from test.rename_tests_http import TestTransports
+from test.rename_tests_plan import TestRenamePlan, TestPlanFile
+from test.rename_tests_scheduler import TestScheduler, TestShardedScan
+from test.rename_tests_watch import TestWatchPolling, TestWatchInotify, TestWatchOverflow, TestWatchTree
+from test.rename_tests_layout import TestLayout, TestRenderStrips, TestImageSize, TestRender
+from test.rename_tests_memory import TestMemoryBudgets
+from test.rename_tests_dirfd import TestDirFds
+from test.rename_tests_prefetch import TestPrefetch
+from test.rename_tests_rate import TestThroughput, TestModelThroughput
 
 if __name__ == "__main__":
     suite = [
         unittest.makeSuite(TestRequiringTemporaryFiles),
         unittest.makeSuite(TestNotRequiringTemporaryFiles),
+        unittest.makeSuite(TestMemoFlickr),
         unittest.makeSuite(TestPresenterRequiringTemporaryFiles),
-        unittest.makeSuite(TestPresenterNotRequiringTemporaryFiles)]
+        unittest.makeSuite(TestPresenterNotRequiringTemporaryFiles),
+        unittest.makeSuite(TestFlickrStub),
+        unittest.makeSuite(TestFlickrStubTruncated),
+        unittest.makeSuite(TestFlickrStubRateLimited),
+        unittest.makeSuite(TestFlickrStubDown),
+        unittest.makeSuite(TestRetry),
+        unittest.makeSuite(TestAsyncModel),
+        unittest.makeSuite(TestAsyncModelDown),
+        unittest.makeSuite(TestService),
+        unittest.makeSuite(TestRules),
+        unittest.makeSuite(TestMirror),
+        unittest.makeSuite(TestPrune),
+        unittest.makeSuite(TestRenameIndex),
+        unittest.makeSuite(TestTransports),
+        unittest.makeSuite(TestRenamePlan),
+        unittest.makeSuite(TestPlanFile),
+        unittest.makeSuite(TestScheduler),
+        unittest.makeSuite(TestShardedScan),
+        unittest.makeSuite(TestWatchPolling),
+        unittest.makeSuite(TestWatchInotify),
+        unittest.makeSuite(TestWatchOverflow),
+        unittest.makeSuite(TestWatchTree),
+        unittest.makeSuite(TestLayout),
+        unittest.makeSuite(TestRenderStrips),
+        unittest.makeSuite(TestImageSize),
+        unittest.makeSuite(TestRender),
+        unittest.makeSuite(TestMemoryBudgets),
+        unittest.makeSuite(TestDirFds),
+        unittest.makeSuite(TestPrefetch),
+        unittest.makeSuite(TestThroughput),
+        unittest.makeSuite(TestModelThroughput)]
     alltests = unittest.TestSuite(suite)
 
     runner = unittest.TextTestRunner()
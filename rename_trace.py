@@ -0,0 +1,83 @@
+"""
+Name        rename_trace.py
+Author      David Edmondson
+
+Records spans in Chrome trace event format, viewable offline in
+chrome://tracing or Perfetto. Events are streamed to disk as they complete
+(JSON array format, which allows the closing bracket to be missing), so a
+multi-hour scan never holds its trace in memory and an interrupted trace can
+still be opened.
+"""
+
+import os, json, threading
+from timeit import default_timer
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span(object):
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, excType, *args):
+        if excType is not None:
+            self.args["error"] = excType.__name__
+        self.tracer._write(self.name, self.category, self.start,
+                           default_timer() - self.start, self.args)
+        return False
+
+class Tracer(object):
+    def __init__(self, fn):
+        self._file = open(fn, "w")
+        self._file.write("[\n")
+        self._lock = threading.Lock()
+        self._origin = default_timer()
+        self._pid = os.getpid()
+
+    def span(self, name, category, **args):
+        """Returns a context manager which records one complete event."""
+        return _Span(self, name, category, args)
+
+    def _write(self, name, category, start, duration, args):
+        event = {"name": name,
+                 "cat": category,
+                 "ph": "X",
+                 "ts": int((start - self._origin) * 1e6),
+                 "dur": int(duration * 1e6),
+                 "pid": self._pid,
+                 "tid": threading.current_thread().ident,
+                 "args": args}
+        line = json.dumps(event) + ",\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            # Trailing metadata event, so the array stays valid JSON
+            self._file.write(json.dumps(
+                {"name": "process_name", "ph": "M", "pid": self._pid,
+                 "args": {"name": "RefCollage"}}) + "\n]\n")
+            self._file.close()
+
+class NullTracer(object):
+    """Stands in for Tracer when tracing is off."""
+    def span(self, name, category, **args):
+        return _NULL_SPAN
+
+    def close(self):
+        pass
+
+NULL_TRACER = NullTracer()
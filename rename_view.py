@@ -17,11 +17,33 @@ class DialogOpenFolder(wx.DirDialog):
         wx.DirDialog.__init__(self, *args, **kwargs)
 
 class ListCtrlRename(wx.ListCtrl):
-    def __init__(self, parent=None, style=wx.LC_REPORT|wx.BORDER_SUNKEN,
+    """Virtual list: rows are read from the column lists as they are drawn,
+    so showing, filtering or appending any number of rows costs the same."""
+    def __init__(self, parent=None,
+                 style=wx.LC_REPORT|wx.LC_VIRTUAL|wx.BORDER_SUNKEN,
                  *args, **kwargs):
         wx.ListCtrl.__init__(self, parent=parent, style=style, *args, **kwargs)
         self.InsertColumn(0, u'Old Name')
         self.InsertColumn(1, u'New Name')
+        # Rows in display order
+        self._rows = ([], [])
+
+    def getColumns(self):
+        return self._rows[0][::-1], self._rows[1][::-1]
+
+    def setColumns(self, (oldList, newList)):
+        # Rows arrive sorted in reverse; show them in ascending order
+        self._rows = (oldList[::-1], newList[::-1])
+        self.SetItemCount(len(oldList))
+        self.Refresh()
+
+    def appendColumns(self, (oldList, newList)):
+        self._rows[0].extend(oldList)
+        self._rows[1].extend(newList)
+        self.SetItemCount(len(self._rows[0]))
+
+    def OnGetItemText(self, item, col):
+        return self._rows[col][item]
 
 class View(wx.Frame):
     def __init__(self, *args, **kwargs):
@@ -37,6 +59,9 @@ class View(wx.Frame):
         self._checkboxFlickr = wx.CheckBox(panel, label=u"Flickr Lookup")
         self._checkboxCapital = wx.CheckBox(panel, label=u"Capital")
         self._listRename = ListCtrlRename(panel)
+        self._textFilter = wx.SearchCtrl(panel)
+        self._textFilter.ShowCancelButton(True)
+        self._choiceFilter = wx.Choice(panel)
         self.buttonOpen = wx.Button(panel, label=u"Select Folder")
         self.buttonRename = wx.Button(panel, label=u"Rename Files")
         self._textPath = wx.TextCtrl(panel)
@@ -93,7 +118,16 @@ class View(wx.Frame):
         sizer.Add(self._checkboxCapital, pos=(3,0),
                   flag=wx.LEFT, border=5)
 
-        sizer.Add(self._listRename, pos=(4,0), span=(1,4), flag=wx.EXPAND)
+        boxFilter = wx.BoxSizer(orient=wx.HORIZONTAL)
+        labelFilter = wx.StaticText(panel, label=u"Filter")
+        boxFilter.Add(labelFilter, flag=wx.LEFT|wx.ALIGN_CENTER_VERTICAL,
+                      border=5)
+        boxFilter.Add(self._textFilter, proportion=1, flag=wx.EXPAND|wx.LEFT,
+                      border=5)
+        boxFilter.Add(self._choiceFilter, flag=wx.LEFT|wx.RIGHT, border=5)
+
+        sizer.Add(boxFilter, pos=(4,0), span=(1,4), flag=wx.EXPAND)
+        sizer.Add(self._listRename, pos=(5,0), span=(1,4), flag=wx.EXPAND)
 
         boxPath = wx.BoxSizer(orient=wx.HORIZONTAL)
         labelPath = wx.StaticText(panel, label=u"Current Path")
@@ -101,15 +135,15 @@ class View(wx.Frame):
         boxPath.Add(self._textPath, proportion=1, flag=wx.EXPAND|wx.LEFT,
                     border=5)
 
-        sizer.Add(boxPath, pos=(5,0), span=(1,2),
+        sizer.Add(boxPath, pos=(6,0), span=(1,2),
                   flag=wx.EXPAND|wx.LEFT|wx.BOTTOM, border=5)
-        sizer.Add(self.buttonOpen, pos=(5,2),
+        sizer.Add(self.buttonOpen, pos=(6,2),
                   flag=wx.LEFT|wx.BOTTOM, border=5)
-        sizer.Add(self.buttonRename, pos=(5,3),
+        sizer.Add(self.buttonRename, pos=(6,3),
                   flag=wx.LEFT|wx.BOTTOM|wx.RIGHT, border=5)
 
         sizer.AddGrowableCol(1)
-        sizer.AddGrowableRow(4)
+        sizer.AddGrowableRow(5)
 
         panel.SetSizer(sizer)
 
@@ -164,7 +198,8 @@ class View(wx.Frame):
         """Creates a new progress dialog box, or updates an existing one.
         Returns False only if user selects Cancel."""
         if self._progress:
-            if self._progress.Update(progress)[0]:
+            # An empty message leaves the current one
+            if self._progress.Update(progress, message)[0]:
                 return True
             return False
         else:
@@ -208,15 +243,33 @@ code structure test for a larger image-reference collage program."""
 
     def _getListRename(self):
         """Returns two lists - first column, second column"""
-        return self._listRename.GetColumn(0), self._listRename.GetColumn(1)
+        return self._listRename.getColumns()
 
     def _setListRename(self, (oldList, newList)):
         # TODO: Allow custom sorting
-        self._listRename.DeleteAllItems()
-        # Sort first by path, then file
-        for oldFn, newFn in zip(oldList, newList):
-            pos = self._listRename.InsertStringItem(0, oldFn)
-            self._listRename.SetStringItem(pos, 1, newFn)
+        self._listRename.setColumns((oldList, newList))
+
+    def appendRename(self, (oldList, newList)):
+        """Adds rows below those shown, while a scan is still running."""
+        self._listRename.appendColumns((oldList, newList))
+
+    def _getTextFilter(self):
+        return self._textFilter.GetValue()
+
+    def _setTextFilter(self, text):
+        self._textFilter.ChangeValue(text)
+
+    def _getChoiceFilter(self):
+        return self._choiceFilter.GetStringSelection()
+
+    def _setChoiceFilter(self, value):
+        self._choiceFilter.SetStringSelection(value)
+
+    def _getFilterOptions(self):
+        return self._choiceFilter.GetItems()
+
+    def _setFilterOptions(self, options):
+        self._choiceFilter.SetItems(options)
 
     def _getComboBoxDelimiter(self):
         return self._comboBoxDelimiter.GetValue()
@@ -255,6 +308,9 @@ code structure test for a larger image-reference collage program."""
     flickr = property(_getCheckboxFlickr, _setCheckboxFlickr)
     capital = property(_getCheckboxCapital, _setCheckboxCapital)
     path = property(_getTextPath, _setTextPath)
+    filterText = property(_getTextFilter, _setTextFilter)
+    filter = property(_getChoiceFilter, _setChoiceFilter)
+    filterOptions = property(_getFilterOptions, _setFilterOptions)
 
 if __name__ == "__main__":
     app = wx.App()
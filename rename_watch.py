@@ -0,0 +1,317 @@
+"""
+Name        rename_watch.py
+Author      David Edmondson
+
+Watch mode: keeps a folder tree normalized as images land in it, without
+rescanning. An in-memory index of the names in every directory is built once;
+after that only filesystem events are processed. Events are batched over a
+short window, then each new image gets the same treatment as in a full scan
+(Flickr lookup or conversion, then duplicate numbering) and is renamed on the
+spot.
+
+Events come from inotify on Linux. Elsewhere, a polling watcher compares
+directory listings every interval - this does relist the tree, so it is only a
+fallback.
+
+Usage:
+    watch = Watch(model, path)
+    watch.run()             # Blocks until watch.stop() from another thread
+"""
+
+import os, struct, select, time, threading, ctypes, ctypes.util
+
+from rename_prune import Pruner
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF)
+
+# Event kinds passed from watchers to Watch
+ADDED, REMOVED, OVERFLOW = "added", "removed", "overflow"
+
+class InotifyWatcher(object):
+    """Yields events for a tree using Linux inotify, through ctypes."""
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._addWatch = libc.inotify_add_watch
+        self._addWatch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+                                   ctypes.c_uint32)
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self._paths = {}
+
+    def add(self, path):
+        wd = self._addWatch(self._fd, path, WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "cannot watch " + path)
+        self._paths[wd] = path
+
+    def poll(self, timeout):
+        """Returns a list of (kind, root, name, isDir) events, waiting up to
+        timeout seconds for the first one."""
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self._fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append((OVERFLOW, None, None, False))
+                continue
+            root = self._paths.get(wd)
+            if mask & IN_IGNORED or mask & IN_DELETE_SELF:
+                self._paths.pop(wd, None)
+                continue
+            if root is None:
+                continue
+            isDir = bool(mask & IN_ISDIR)
+            if mask & (IN_MOVED_TO | IN_CLOSE_WRITE):
+                events.append((ADDED, root, name, isDir))
+            elif mask & IN_CREATE and isDir:
+                events.append((ADDED, root, name, isDir))
+            elif mask & (IN_MOVED_FROM | IN_DELETE):
+                events.append((REMOVED, root, name, isDir))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher(object):
+    """Fallback watcher which diffs directory listings every interval."""
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._listings = {}
+        self._lastPoll = time.time()
+
+    def add(self, path):
+        try:
+            self._listings[path] = self._list(path)
+        except OSError:
+            pass
+
+    def _list(self, path):
+        return dict((name, os.path.isdir(os.path.join(path, name)))
+                    for name in os.listdir(path))
+
+    def poll(self, timeout):
+        wait = self._lastPoll + self.interval - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self._lastPoll = time.time()
+
+        events = []
+        for path, old in self._listings.items():
+            try:
+                new = self._list(path)
+            except OSError:
+                del self._listings[path]
+                continue
+            self._listings[path] = new
+            for name in set(new) - set(old):
+                events.append((ADDED, path, name, new[name]))
+            for name in set(old) - set(new):
+                events.append((REMOVED, path, name, old[name]))
+        return events
+
+    def close(self):
+        pass
+
+def createWatcher():
+    """Returns an inotify watcher where available, or a polling watcher."""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher()
+
+class _NameIndex(object):
+    """Names of every file in each watched directory. Works as a plan for
+    Model._checkDuplicates, so new names avoid both other renames and files
+    already on disk."""
+    def __init__(self):
+        self.dirs = {}
+
+    def values(self):
+        return self
+
+    def __contains__(self, path):
+        root, name = os.path.split(path)
+        return name in self.dirs.get(root, ())
+
+class Watch(object):
+    def __init__(self, model, path, window=0.2, watcher=None):
+        self.model = model
+        self.path = path
+        self.window = window
+        self.watcher = watcher or createWatcher()
+        self.renamed = 0
+
+        self._index = _NameIndex()
+        self._pruner = self._createPruner()
+        self._stop = threading.Event()
+        # Full paths this watch renamed files to, so their events are skipped
+        self._own = set()
+        self._addTree(path)
+
+    def _createPruner(self):
+        """Prunes the whole watched tree, keeping the patterns of each
+        directory so anything added later is pruned the same way."""
+        return Pruner(self.model._prune, self.path, self.model.logger,
+                      keep=True)
+
+    def _addTree(self, path):
+        """Indexes and watches a directory and everything below it. Returns
+        (root, name) for every file found."""
+        found = []
+        stack = [path]
+        while stack:
+            root = stack.pop()
+            # Watch before listing, so nothing arriving in between is missed
+            try:
+                self.watcher.add(root)
+            except OSError as e:
+                if root == self.path:
+                    raise
+                # Removed again before it could be watched
+                self.model.logger.warning(
+                    "watch could not add {}: {}".format(root, e))
+                continue
+            listing = self.model._listDirectory(root, self._pruner)
+            if listing is None:
+                continue
+            dirs, files = listing
+            self._index.dirs[root] = set(files)
+            found.extend((root, fn) for fn in files)
+            for d in reversed(dirs):
+                if not os.path.islink(os.path.join(root, d)):
+                    stack.append(os.path.join(root, d))
+        return found
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """Processes events until stop() is called."""
+        try:
+            while not self._stop.is_set():
+                events = self.watcher.poll(0.25)
+                if not events:
+                    continue
+                # Batch everything arriving within the window
+                deadline = time.time() + self.window
+                while True:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        break
+                    events.extend(self.watcher.poll(left))
+                self.processEvents(events)
+        finally:
+            self.watcher.close()
+
+    def processEvents(self, events):
+        """Updates the index from a batch of events, then renames any new
+        images. Returns the number of files renamed."""
+        added = []
+        if any(event[0] == OVERFLOW for event in events):
+            # Anything new since the last batch needs normalizing, whether or
+            # not its event was lost
+            before = dict((root, set(names))
+                          for root, names in self._index.dirs.iteritems())
+        for kind, root, name, isDir in events:
+            if kind == OVERFLOW:
+                # Events were lost - the only safe option is a fresh index
+                self.model.logger.warning(
+                    "watch event queue overflowed, reindexing")
+                self._index = _NameIndex()
+                self._pruner = self._createPruner()
+                queued = set(added)
+                added.extend(found for found in self._addTree(self.path)
+                             if found[1] not in before.get(found[0], ()) and
+                             found not in queued)
+                continue
+            path = os.path.join(root, name)
+            if kind == REMOVED:
+                self._index.dirs.get(root, set()).discard(name)
+                if isDir:
+                    self._index.dirs.pop(path, None)
+            elif path in self._own:
+                self._own.discard(path)
+            elif not self._kept(root, name, isDir):
+                continue
+            elif isDir:
+                self._index.dirs.setdefault(root, set()).add(name)
+                if path not in self._index.dirs:
+                    added.extend(self._addTree(path))
+            else:
+                self._index.dirs.setdefault(root, set()).add(name)
+                added.append((root, name))
+
+        renamed = 0
+        for root, name in added:
+            if self._renameNew(root, name):
+                renamed += 1
+        if renamed and self.model._flickr:
+            self.model._saveMemoFlickr()
+        self.renamed += renamed
+        return renamed
+
+    def _kept(self, root, name, isDir):
+        """Returns True unless name, added to root, is pruned."""
+        names = [name]
+        if isDir:
+            self._pruner.pruneAdded(root, names, [])
+        else:
+            self._pruner.pruneAdded(root, [], names)
+        return bool(names)
+
+    def _renameNew(self, root, fn):
+        """Normalizes one newly arrived file. Returns True if renamed."""
+        model = self.model
+        if not model._isImage(fn) or not os.path.isfile(os.path.join(root, fn)):
+            return False
+        try:
+            newFn, _ = model._resolveName(fn)
+        except EnvironmentError as e:
+            model.logger.warning(
+                "watch could not resolve {}: {}".format(fn, e))
+            return False
+        if newFn == fn:
+            return False
+
+        names = self._index.dirs.setdefault(root, set())
+        # The file's own name must not count as a collision with itself
+        names.discard(fn)
+        nameWithPath = os.path.join(root, newFn)
+        dupeName = model._checkDuplicates(nameWithPath, self._index)
+        if dupeName:
+            nameWithPath = dupeName
+            newFn = os.path.basename(dupeName)
+        try:
+            os.rename(os.path.join(root, fn), nameWithPath)
+        except OSError as e:
+            names.add(fn)
+            model.logger.warning(
+                "watch could not rename {}: {}".format(fn, e))
+            return False
+        names.add(newFn)
+        self._own.add(nameWithPath)
+        return True
@@ -0,0 +1,106 @@
+"""
+Name        rename_tests_async.py
+Author      David Edmondson
+
+Tests the streaming, event-driven Model API against the local Flickr stand-in:
+results match the synchronous Model, come out in order with progress, and
+failing lookups fall back to conversion.
+"""
+
+import unittest, os, tempfile, shutil
+from rename_async import AsyncModel
+from rename_plan import FLAG_FLICKR
+from test.rename_tests_flickr import FlickrStubTests
+
+class AsyncTests(FlickrStubTests):
+    def setUp(self):
+        FlickrStubTests.setUp(self)
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "sub_dir"))
+        for fn in ("6795654383_a7d7351d30_z.jpg", "Apartment_Roof at-night.jpg",
+                   "2816803094_a7d7351d30_o.jpg", "2816803022_a7d7351d30_o.jpg",
+                   "9216803042_a7d7351d30_o.jpg", "plain_name.jpg", "notes.txt",
+                   os.path.join("sub_dir", "6795654383_a7d7351d30_b.jpg"),
+                   os.path.join("sub_dir", "6795654383_a7d7351d30_c.jpg")):
+            open(os.path.join(self.root, fn), "w+b").close()
+
+    def tearDown(self):
+        FlickrStubTests.tearDown(self)
+        shutil.rmtree(self.root)
+
+class TestAsyncModel(AsyncTests, unittest.TestCase):
+    faults = {"latency": 0.02, "jitter": 0.05}
+
+    def testResolveInOrder(self):
+        fns = ["2816803094_a7d7351d30_o.jpg", "plain_name.jpg",
+               "6795654383_a7d7351d30_z.jpg", "9216803042_a7d7351d30_o.jpg"]
+        self.assertEqual(list(AsyncModel(self.m, concurrency=4).resolve(fns)),
+                         [(fns[0], "Stairs.jpg", FLAG_FLICKR),
+                          (fns[1], "plain name.jpg", 0),
+                          (fns[2], "Apartment Roof at night.jpg", FLAG_FLICKR),
+                          (fns[3], "9216803042 a7d7351d30 o.jpg", 0)])
+
+    def testSameAsModel(self):
+        """Test that the streamed renames and resulting rename list equal a
+        synchronous scan, including duplicate numbering."""
+        self.m.createRenameList(self.root)
+        expected = list(self.m.getRenameList().iteritems())
+        self.assertEqual(len(expected), 8)
+
+        self.m.memoFlickr = {}
+        streamed = []
+        progress = []
+        for old, new, _ in AsyncModel(self.m, concurrency=3).createRenameList(
+                self.root):
+            streamed.append((old, new))
+            progress.append(self.m.progress)
+        self.assertEqual(streamed, expected)
+        self.assertEqual(progress, sorted(progress))
+        self.assertGreater(progress[0], 0)
+        self.assertLess(progress[-1], 100)
+        self.assertEqual(list(self.m.getRenameList().iteritems()), expected)
+        self.assertEqual(self.m.progress, 100)
+
+    def testRenameFiles(self):
+        stream = AsyncModel(self.m)
+        list(stream.createRenameList(self.root))
+        renamed = list(stream.renameFiles())
+        self.assertEqual(len(renamed), 8)
+        self.assertTrue(all(os.path.isfile(new) for _, new in renamed))
+
+    def testInterrupt(self):
+        self.m.interrupt = True
+        self.assertEqual(list(AsyncModel(self.m).createRenameList(self.root)),
+                         [])
+        self.assertEqual(len(self.m.getRenameList()), 0)
+        self.assertFalse(self.m.interrupt)
+
+    def testWalkFailed(self):
+        """Test that a walk failing part way re-raises its error, and leaves
+        no partial list."""
+        walk = self.m._walk
+        def failingWalk(path):
+            for item in walk(path):
+                yield item
+                raise OSError(5, "Input/output error")
+        self.m._walk = failingWalk
+        self.m.logger.disabled = True
+        renames = AsyncModel(self.m).createRenameList(self.root)
+        self.assertRaises(OSError, list, renames)
+        self.assertEqual(len(self.m.getRenameList()), 0)
+        self.assertNotEqual(self.m.progress, 100)
+
+class TestAsyncModelDown(AsyncTests, unittest.TestCase):
+    faults = {"errorRate": 1.0}
+
+    def testFallback(self):
+        """Test that a scan against a failing host completes, with converted
+        names and the failed IDs queued."""
+        renames = list(AsyncModel(self.m).createRenameList(self.root))
+        self.assertEqual(len(renames), 8)
+        self.assertIn(os.path.join(self.root, "6795654383 a7d7351d30 z.jpg"),
+                      [new for _, new, _ in renames])
+        self.assertIn("6795654383", self.m._retryFlickr)
+
+if __name__ == '__main__':
+    unittest.main()
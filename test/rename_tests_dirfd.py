@@ -0,0 +1,110 @@
+"""
+Name        rename_tests_dirfd.py
+Author      David Edmondson
+
+Tests directory-relative listing and renaming against plain path operations,
+with directory fds and with the full-path fallback.
+"""
+
+import unittest, os, tempfile, shutil
+from test.rename_tests_fixtures import makeModel
+from rename_dirfd import DirFds, listDirectory, isDirAt, openDir
+import rename_dirfd
+
+class TestDirFds(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.deep = os.path.join(self.tempDir, *["level_{}".format(i)
+                                                 for i in xrange(12)])
+        os.makedirs(self.deep)
+        os.makedirs(os.path.join(self.tempDir, "sub_dir"))
+        for fn in ("a_b.jpg", "caf\xc3\xa9_noir.jpg", "notes.txt",
+                   os.path.join("sub_dir", "c_d.png"),
+                   os.path.join(self.deep, "e_f.jpg")):
+            open(os.path.join(self.tempDir, fn), "wb").close()
+        if hasattr(os, "symlink"):
+            os.symlink(os.path.join(self.tempDir, "sub_dir"),
+                       os.path.join(self.tempDir, "linked_dir"))
+            os.symlink(os.path.join(self.tempDir, "missing"),
+                       os.path.join(self.tempDir, "broken_link"))
+        self.supported = rename_dirfd.DIR_FD_SUPPORTED
+
+    def tearDown(self):
+        rename_dirfd.DIR_FD_SUPPORTED = self.supported
+        shutil.rmtree(self.tempDir)
+
+    def _expected(self, root):
+        names = os.listdir(root)
+        return (sorted(n for n in names
+                       if os.path.isdir(os.path.join(root, n))),
+                sorted(n for n in names
+                       if not os.path.isdir(os.path.join(root, n))))
+
+    def _checkListing(self):
+        for root in (self.tempDir, self.deep, unicode(self.deep)):
+            dirs, files = listDirectory(root)
+            self.assertEqual((sorted(dirs), sorted(files)),
+                             self._expected(root))
+        self.assertRaises(OSError, listDirectory,
+                          os.path.join(self.tempDir, "missing"))
+
+    def testListing(self):
+        self._checkListing()
+
+    def testListingFallback(self):
+        rename_dirfd.DIR_FD_SUPPORTED = False
+        self.assertIsNone(openDir(self.tempDir))
+        self._checkListing()
+
+    def testIsDirAt(self):
+        dirFd = openDir(self.tempDir)
+        try:
+            for name in os.listdir(self.tempDir) + ["missing"]:
+                self.assertEqual(isDirAt(dirFd, self.tempDir, name),
+                                 os.path.isdir(os.path.join(self.tempDir,
+                                                            name)), name)
+        finally:
+            if dirFd is not None:
+                os.close(dirFd)
+
+    def testBoundedRenames(self):
+        """Test that renames across more directories than the limit all
+        happen, with no more than the limit held open."""
+        roots = [self.tempDir, os.path.join(self.tempDir, "sub_dir"),
+                 self.deep, os.path.dirname(self.deep)]
+        for root in roots:
+            open(os.path.join(root, "x_y.jpg"), "wb").close()
+        with DirFds(limit=2) as dirFds:
+            for root in roots + roots:
+                oldName = "x_y.jpg" if os.path.exists(
+                    os.path.join(root, "x_y.jpg")) else "x y.jpg"
+                newName = "x y.jpg" if oldName == "x_y.jpg" else "x_y.jpg"
+                dirFds.rename(root, oldName, newName)
+                self.assertLessEqual(len(dirFds), 2)
+            if self.supported:
+                self.assertEqual(dirFds.opened, 8)
+            self.assertRaises(OSError, dirFds.rename, self.tempDir,
+                              "missing.jpg", "other.jpg")
+        self.assertEqual(len(dirFds), 0)
+        for root in roots:
+            self.assertTrue(os.path.exists(os.path.join(root, "x_y.jpg")))
+
+    def testModelRenames(self):
+        """Test that a scan and rename of a deep tree match the plan, with and
+        without directory fds."""
+        for supported in (self.supported, False):
+            rename_dirfd.DIR_FD_SUPPORTED = supported
+            m = makeModel(self)
+            m.changeSettings({"capital": False, "flickr": False,
+                              "delimiter": " "})
+            m.createRenameList(self.tempDir)
+            renames = dict(m.getRenameList().iteritems())
+            self.assertIn(os.path.join(self.deep, "e_f.jpg"), renames)
+            self.assertEqual(m.renameFiles(), len(renames))
+            for oldFn, newFn in renames.iteritems():
+                self.assertFalse(os.path.exists(oldFn))
+                self.assertTrue(os.path.exists(newFn))
+                os.rename(newFn, oldFn)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+"""
+Name        rename_tests_fixtures.py
+Author      David Edmondson
+
+Shared test fixtures. makeModel gives each test its own Model, with a private
+data root (settings, memos, logs) which is removed after the test, and Flickr
+requests replayed from recorded fixtures - so tests never touch the user's
+own files or the network, and can run in parallel.
+
+To re-record the Flickr fixture against the live site:
+    Model(transport=RecordingTransport(FLICKR_FIXTURE))
+"""
+
+import os, tempfile, shutil
+from rename_model import Model
+from rename_http import ReplayTransport
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+FLICKR_FIXTURE = os.path.join(FIXTURES, "flickr.jsonl")
+
+def makeDataRoot(testCase):
+    """Returns a new data root, removed when testCase finishes."""
+    dataRoot = tempfile.mkdtemp()
+    testCase.addCleanup(shutil.rmtree, dataRoot, True)
+    return dataRoot
+
+def makeModel(testCase, modelClass=Model, dataRoot=None, transport=None,
+              **kwargs):
+    """Returns a Model for testCase, with its own data root unless one is
+    given, and Flickr replayed from FLICKR_FIXTURE unless a transport is
+    given."""
+    if dataRoot is None:
+        dataRoot = makeDataRoot(testCase)
+    if transport is None:
+        transport = ReplayTransport(FLICKR_FIXTURE)
+    model = modelClass(dataRoot=dataRoot, transport=transport, **kwargs)
+    # Runs before the data root is removed
+    testCase.addCleanup(model.close)
+    return model
@@ -0,0 +1,197 @@
+"""
+Name        rename_tests_flickr.py
+Author      David Edmondson
+
+Tests Flickr lookups offline, against the local stand-in server from
+bench.flickr_stub: redirects, private and missing photos, title retrieval,
+and behaviour under injected faults - including the retry queue and circuit
+breaker which keep a failing lookup from stopping a scan.
+"""
+
+import unittest, os, tempfile, shutil, logging
+from rename_model import Model
+from rename_retry import RetryQueue, CircuitBreaker
+from rename_http import HttpTransport
+from bench.flickr_stub import FlickrStub, OWNER
+from test.rename_tests_fixtures import makeModel
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FlickrStubTests(object):
+    """Mixin which runs a stub for each test. Subclasses set faults."""
+    faults = {}
+
+    def setUp(self):
+        self.m = makeModel(self, transport=HttpTransport())
+        self.m.changeSettings({"capital": False, "flickr": True,
+                               "delimiter": " "})
+        self.m.FLICKR_RETRY_DELAY = 0
+        self.stub = FlickrStub({"6795654383": "Apartment Roof, at night",
+                                "2816803094": "Stairs"},
+                               private=("2816803022",), **self.faults)
+        self.m.FLICKR_SITE = self.m.FLICKR_PAGE_SITE = self.stub.start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+class TestFlickrStub(FlickrStubTests, unittest.TestCase):
+    def testGetRedirect(self):
+        """Test redirects for public, private and missing photos."""
+        self.assertEqual(
+            self.m._getRedirect(self.m.FLICKR_SITE, "/photo.gne?id=2816803094"),
+            "/photos/{}/2816803094".format(OWNER))
+        self.assertIn(
+            "signin",
+            self.m._getRedirect(self.m.FLICKR_SITE, "/photo.gne?id=2816803022"))
+        self.assertEqual(
+            self.m._getRedirect(self.m.FLICKR_SITE, "/photo.gne?id=9216803042"),
+            None)
+
+    def testGetNameFlickr(self):
+        """Test that titles are retrieved, cleaned and memoized, and that
+        private and missing photos fall back to conversion."""
+        self.assertEqual(
+            self.m._getNameFlickr("6795654383_a7d7351d30_z.jpg", "6795654383"),
+            "Apartment Roof at night.jpg")
+        self.assertEqual(self.m.memoFlickr["6795654383"],
+                         "Apartment Roof at night.jpg")
+        self.assertEqual(
+            self.m._getNameFlickr("2816803022_a7d7351d30_z.JPG", "2816803022"),
+            "2816803022 a7d7351d30 z.jpg")
+        self.assertEqual(
+            self.m._getNameFlickr("9216803042_a7d7351d30_z.png", "9216803042"),
+            "9216803042 a7d7351d30 z.png")
+
+        # The second lookup is answered from the memo
+        self.m._getNameFlickr("6795654383_a7d7351d30_z.jpg", "6795654383")
+        self.assertEqual(self.stub.served["page"], 1)
+
+class TestFlickrStubTruncated(FlickrStubTests, unittest.TestCase):
+    faults = {"truncateRate": 1.0}
+
+    def testRetriesThenFails(self):
+        """Test that a page which never contains a full title is retried,
+        then raises."""
+        self.assertRaises(IOError, lambda: self.m._getNameFlickr(
+            "6795654383_a7d7351d30_z.jpg", "6795654383"))
+        self.assertEqual(self.stub.served["truncated"], 4)
+        self.assertNotIn("6795654383", self.m.memoFlickr)
+
+class TestFlickrStubRateLimited(FlickrStubTests, unittest.TestCase):
+    faults = {"rateLimitRate": 1.0, "latency": 0.01}
+
+    def testRateLimited(self):
+        """Test that a rate-limited lookup falls back to conversion, and is
+        queued rather than retried straight away."""
+        fn = "6795654383_a7d7351d30_z.jpg"
+        self.assertRaises(IOError,
+                          lambda: self.m._getNameFlickr(fn, "6795654383"))
+        self.assertEqual(self.m._resolveName(fn),
+                         ("6795654383 a7d7351d30 z.jpg", 0))
+        self.assertIn("6795654383", self.m._retryFlickr)
+        self.assertEqual(self.stub.served["rateLimited"], 2)
+
+        self.m._resolveName(fn)
+        self.assertEqual(self.stub.served["rateLimited"], 2)
+
+        # The queue survives a restart
+        self.m._saveMemoFlickr()
+        self.assertIn("6795654383",
+                      makeModel(self, dataRoot=self.m.dataRoot)._retryFlickr)
+
+class TestFlickrStubDown(FlickrStubTests, unittest.TestCase):
+    faults = {"errorRate": 1.0}
+
+    def setUp(self):
+        FlickrStubTests.setUp(self)
+        self.root = tempfile.mkdtemp()
+        for i in xrange(20):
+            open(os.path.join(self.root, "{}_a7d7351d30_o.jpg".format(
+                6795654300 + i)), "w+b").close()
+
+    def tearDown(self):
+        FlickrStubTests.tearDown(self)
+        shutil.rmtree(self.root)
+
+    def testScanCompletes(self):
+        """Test that a scan finishes with converted names when every lookup
+        fails, and stops contacting the host after the failure threshold."""
+        self.m.createRenameList(self.root)
+        self.assertEqual(len(self.m.getRenameList()), 20)
+        self.assertEqual(self.stub.served["error"],
+                         Model.FLICKR_FAILURE_THRESHOLD)
+        self.assertEqual(len(self.m._retryFlickr), 20)
+
+        # Nothing is due yet, so retrying makes no requests
+        self.assertEqual(self.m.retryFlickrLookups(), (0, 0))
+        self.assertEqual(self.stub.served["error"],
+                         Model.FLICKR_FAILURE_THRESHOLD)
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tempDir, "retry.cfg")
+        self.logger = logging.Logger("test")
+        self.logger.addHandler(logging.NullHandler())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testRetryQueue(self):
+        """Test that entries become due after a backoff which grows with each
+        failure, and that the queue is saved and loaded."""
+        clock = FakeClock()
+        queue = RetryQueue(self.fn, clock, self.logger)
+        queue.add("6795654383", "6795654383_a7d7351d30_z.jpg", "timed out")
+        self.assertEqual(queue._entries["6795654383"]["attempts"], 1)
+        clock.now += RetryQueue.BASE_DELAY
+        self.assertEqual(queue.due(),
+                         [("6795654383", "6795654383_a7d7351d30_z.jpg")])
+
+        for _ in xrange(10):
+            queue.add("6795654383", "6795654383_a7d7351d30_z.jpg", "timed out")
+        self.assertLessEqual(queue._entries["6795654383"]["due"] - clock.now,
+                             RetryQueue.MAX_DELAY)
+        self.assertEqual(queue._entries["6795654383"]["attempts"], 11)
+
+        queue.save()
+        self.assertIn("6795654383", RetryQueue(self.fn, clock, self.logger))
+        queue.discard("6795654383")
+        self.assertEqual(queue.due(), [])
+
+    def testInvalidFile(self):
+        f = open(self.fn, "w")
+        f.write("[1, 2")
+        f.close()
+        self.assertEqual(len(RetryQueue(self.fn, logger=self.logger)), 0)
+
+    def testCircuitBreaker(self):
+        """Test that the breaker opens at the threshold, lets one trial
+        through after the cooldown, and reopens if that fails."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(threshold=2, cooldown=30, clock=clock,
+                                 logger=self.logger)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+        clock.now += 30
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        clock.now += 30
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+if __name__ == '__main__':
+    unittest.main()
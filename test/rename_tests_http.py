@@ -0,0 +1,59 @@
+"""
+Name        rename_tests_http.py
+Author      David Edmondson
+
+Tests HTTP transports: lookups recorded against the local Flickr stand-in
+replay the same, with no server running.
+"""
+
+import unittest, os, tempfile, shutil
+from rename_http import HttpTransport, RecordingTransport, ReplayTransport
+from rename_plan import FLAG_FLICKR
+from bench.flickr_stub import FlickrStub
+from test.rename_tests_fixtures import makeModel
+
+class TestTransports(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.fixture = os.path.join(self.tempDir, "flickr.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _lookup(self, transport, site):
+        m = makeModel(self, transport=transport)
+        m.changeSettings({"capital": False, "flickr": True, "delimiter": " "})
+        m.FLICKR_SITE = m.FLICKR_PAGE_SITE = site
+        return [m._resolveName(fn) for fn in
+                ("6795654383_a7d7351d30_z.jpg", "2816803022_a7d7351d30_o.jpg",
+                 "9216803042_a7d7351d30_o.jpg")]
+
+    def testRecordAndReplay(self):
+        stub = FlickrStub({"6795654383": "Apartment Roof, at night"},
+                          private=("2816803022",))
+        site = stub.start()
+        try:
+            recorded = self._lookup(
+                RecordingTransport(self.fixture, HttpTransport()), site)
+        finally:
+            stub.stop()
+        self.assertEqual(recorded[0],
+                         ("Apartment Roof at night.jpg", FLAG_FLICKR))
+
+        replay = ReplayTransport(self.fixture)
+        self.assertEqual(self._lookup(replay, site), recorded)
+        self.assertEqual(len(replay.requests), 4)
+
+    def testMissingRequest(self):
+        """Test that a request missing from the fixture fails like an
+        unreachable server: converted locally, and queued for a retry."""
+        open(self.fixture, "w").close()
+        m = makeModel(self, transport=ReplayTransport(self.fixture))
+        self.assertRaises(IOError, lambda: m.transport.request(
+            "HEAD", "flickr.com", "/photo.gne?id=1"))
+        self.assertEqual(self._lookup(ReplayTransport(self.fixture),
+                                      "flickr.com")[0],
+                         ("6795654383 a7d7351d30 z.jpg", 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Name        rename_tests_index.py
+Author      David Edmondson
+
+Tests the rename preview search index against a plain scan of every row.
+"""
+
+import unittest, os
+from rename_plan import RenamePlan, FLAG_FLICKR, FLAG_DUPLICATE
+from rename_index import RenameIndex
+
+class TestRenameIndex(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.join(os.sep, "refs")
+        self.plan = RenamePlan()
+        for i in xrange(300):
+            root = os.path.join(self.root, "set_{}".format(i % 7))
+            if i % 5 == 0:
+                root = self.root
+            self.plan.add(root, "IMG_{:04d}_Castle.JPG".format(i),
+                          "castle {} tower.jpg".format(i), i % 4)
+        self.index = RenameIndex(self.plan, self.root)
+
+    def _scan(self, query, flags=0):
+        old, new = self.index.rows()
+        return [i for i in xrange(len(old))
+                if (query.lower() in old[i].lower() or
+                    query.lower() in new[i].lower()) and
+                self.index.flags[i] & flags == flags]
+
+    def testRows(self):
+        old, new = self.index.rows()
+        self.assertEqual(len(self.index), 300)
+        self.assertEqual(old, sorted(old, key=str.lower, reverse=True))
+        self.assertIn(os.path.join("set_1", "IMG_0001_Castle.JPG"), old)
+        self.assertIn("IMG_0000_Castle.JPG", old)
+        self.assertEqual(self.index.rows([0]), ([old[0]], [new[0]]))
+
+    def testSearch(self):
+        """Test that searches match a scan of every row, for fresh, narrowed
+        and widened queries, with and without flags."""
+        for query in ("", "castle", "0", "01", "012", "img_0012", "SET_3",
+                      "3 tower", "t_3" + os.sep, "g\tc", "missing", u"castle",
+                      u"\xe9"):
+            for flags in (0, FLAG_FLICKR, FLAG_DUPLICATE,
+                          FLAG_FLICKR | FLAG_DUPLICATE):
+                self.assertEqual(self.index.search(query, flags),
+                                 self._scan(query, flags), (query, flags))
+
+    def testNarrowing(self):
+        """Test that a longer query only rechecks the last matches, and a
+        different one searches again."""
+        self.index.search("img_01")
+
+        def find(query, flags):
+            raise AssertionError("searched every row for " + query)
+        self.index._find = find
+        self.assertEqual(self.index.search("img_012"), self._scan("img_012"))
+        self.assertRaises(AssertionError, lambda: self.index.search("img_2"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+"""
+Name        rename_tests_layout.py
+Author      David Edmondson
+
+Tests collage layout packing, incremental updates, image header sizes, render
+strip planning and, where PIL is installed, rendering.
+"""
+
+import unittest, os, tempfile, shutil, struct, random, time
+from collage_layout import Layout, getImageSize
+from collage_render import render, _planStrips, Image
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(42)
+        self.images = [
+            ("img{}.jpg".format(i), rand.randint(200, 3000),
+             rand.randint(200, 3000))
+            for i in xrange(500)]
+
+    def _fullLayout(self, images):
+        layout = Layout(1200, rowHeight=150, spacing=4)
+        layout.add(images)
+        return layout
+
+    def testRowsFillWidth(self):
+        """Test that every finished row spans the full collage width."""
+        layout = self._fullLayout(self.images)
+        rows = {}
+        for key, x, y, w, h in layout.getPositions():
+            rows.setdefault(y, []).append((x, w))
+        lastY = max(rows)
+        for y, row in rows.items():
+            if y == lastY:
+                continue
+            right = max(x + w for x, w in row)
+            self.assertTrue(abs(right - 1200) <= 1)
+
+    def testIncrementalAdd(self):
+        """Test that adding images in batches matches a full layout."""
+        layout = Layout(1200, rowHeight=150, spacing=4)
+        for i in xrange(0, len(self.images), 37):
+            layout.add(self.images[i:i + 37])
+        self.assertEqual(layout.getPositions(),
+                         self._fullLayout(self.images).getPositions())
+
+    def testIncrementalRemove(self):
+        """Test that removing images matches a full layout without them."""
+        layout = self._fullLayout(self.images)
+        removed = set(["img3.jpg", "img250.jpg", "img251.jpg", "img499.jpg"])
+        layout.remove(removed)
+        remaining = [img for img in self.images if img[0] not in removed]
+        self.assertEqual(layout.getPositions(),
+                         self._fullLayout(remaining).getPositions())
+        self.assertEqual(layout.getSize(),
+                         self._fullLayout(remaining).getSize())
+
+        layout.remove(key for key, _, _ in remaining)
+        self.assertEqual(layout.getPositions(), [])
+        self.assertEqual(layout.getSize(), (1200, 0))
+
+    def testLargeLayout(self):
+        """Test that 10k references lay out in under a second."""
+        images = [("img{}".format(i), w, h)
+                  for i, (_, w, h) in enumerate(self.images * 20)]
+        start = time.time()
+        layout = self._fullLayout(images)
+        layout.getPositions()
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(len(layout), 10000)
+
+    def testInvalidImages(self):
+        layout = Layout(1200)
+        layout.add([("a.jpg", 10, 10)])
+        self.assertRaises(KeyError, lambda: layout.add([("a.jpg", 10, 10)]))
+        self.assertRaises(ValueError, lambda: layout.add([("b.jpg", 0, 10)]))
+        self.assertRaises(KeyError, lambda: layout.remove(["c.jpg"]))
+
+    def testRejectedUnchanged(self):
+        """Test that a rejected add or remove leaves the layout as it was."""
+        layout = self._fullLayout(self.images[:100])
+        positions = layout.getPositions()
+        for bad in ([("new.jpg", 10, 10), ("img5.jpg", 10, 10)],
+                    [("new.jpg", 10, 10), ("new.jpg", 10, 10)],
+                    [("new.jpg", 10, 10), ("bad.jpg", 10, 0)]):
+            self.assertRaises((KeyError, ValueError), layout.add, bad)
+        self.assertRaises(KeyError, layout.remove, ["img7.jpg", "c.jpg"])
+        self.assertEqual(layout.getPositions(), positions)
+        self.assertEqual(len(layout), 100)
+        self.assertNotIn("new.jpg", layout)
+
+        layout.remove(["img7.jpg", "img7.jpg"])
+        self.assertEqual(len(layout), 99)
+
+class TestRenderStrips(unittest.TestCase):
+    def testStripsUseWholeRows(self):
+        """Test that strips cover the collage exactly, each image appears in
+        one strip, and strips stay under the height limit."""
+        layout = Layout(1200, rowHeight=150, spacing=4)
+        layout.add([("img{}".format(i), 400 + i % 7 * 100, 300)
+                    for i in xrange(200)])
+        positions = layout.getPositions()
+        width, height = layout.getSize()
+        strips = _planStrips(positions, height, 500)
+
+        self.assertEqual(strips[0][0], 0)
+        self.assertEqual(strips[-1][1], height)
+        seen = []
+        for (top, bottom, items), nextStrip in zip(strips, strips[1:] + [None]):
+            if nextStrip:
+                self.assertEqual(bottom, nextStrip[0])
+            for key, x, y, w, h in items:
+                self.assertTrue(top <= y and y + h <= bottom)
+            self.assertLessEqual(bottom - top, 500)
+            seen.extend(item[0] for item in items)
+        self.assertEqual(sorted(seen), sorted(p[0] for p in positions))
+
+@unittest.skipIf(Image is None, "PIL is not installed")
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.colours = {"red": (255, 0, 0), "blue": (0, 0, 255),
+                        "green": (0, 160, 0)}
+        self.sources = {}
+        for key, fileFormat in (("red", "JPEG"), ("blue", "PNG"),
+                                ("green", "GIF")):
+            fn = os.path.join(self.tempDir, key + "." + fileFormat.lower())
+            Image.new("RGB", (400, 300), self.colours[key]).save(fn,
+                                                                 fileFormat)
+            self.sources[key] = fn
+        # Two rows, so two strips
+        layout = Layout(120, rowHeight=60, spacing=4)
+        layout.add([(key, 400, 300) for key in sorted(self.sources)])
+        self.positions = layout.getPositions()
+        self.size = layout.getSize()
+        self.fn = os.path.join(self.tempDir, "collage.ppm")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _render(self, sources):
+        return render(self.positions, sources, self.fn, self.size,
+                      stripHeight=40, workers=2)
+
+    def testRender(self):
+        """Test that every image is drawn at its position, whatever its
+        format, and only the finished file is left."""
+        self.assertGreater(self._render(self.sources), 1)
+        collage = Image.open(self.fn)
+        self.assertEqual(collage.size, self.size)
+        for key, x, y, w, h in self.positions:
+            pixel = collage.getpixel((x + w // 2, y + h // 2))
+            for channel, expected in zip(pixel, self.colours[key]):
+                self.assertAlmostEqual(channel, expected, delta=8)
+        self.assertFalse(os.path.exists(self.fn + ".part"))
+
+    def testFailedRender(self):
+        """Test that a failed render leaves the earlier output untouched,
+        and no partial file."""
+        self._render(self.sources)
+        with open(self.fn, "rb") as f:
+            before = f.read()
+        sources = dict(self.sources,
+                       blue=os.path.join(self.tempDir, "missing.png"))
+        self.assertRaises(EnvironmentError, self._render, sources)
+        with open(self.fn, "rb") as f:
+            self.assertEqual(f.read(), before)
+        self.assertFalse(os.path.exists(self.fn + ".part"))
+
+class TestImageSize(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.headers = {
+            "a.png": "\x89PNG\r\n\x1a\n" + "\x00\x00\x00\x0dIHDR" +
+                     struct.pack(">II", 640, 480),
+            "a.gif": "GIF89a" + struct.pack("<HH", 320, 200),
+            "a.bmp": "BM" + "\x00" * 16 + struct.pack("<ii", 100, -50),
+            "a.jpg": "\xff\xd8" + "\xff\xe0" + struct.pack(">H", 4) + "JF" +
+                     "\xff\xc0" + struct.pack(">HBHH", 11, 8, 768, 1024),
+            "a.tif": "II*\x00" + struct.pack("<I", 8) + struct.pack("<H", 2) +
+                     struct.pack("<HHIHxx", 256, 3, 1, 30) +
+                     struct.pack("<HHII", 257, 4, 1, 40),
+            "a.txt": "plain text"}
+        for fn, data in self.headers.items():
+            f = open(os.path.join(self.root, fn), "wb")
+            f.write(data)
+            f.close()
+
+    def tearDown(self):
+        for fn in self.headers:
+            os.remove(os.path.join(self.root, fn))
+        os.rmdir(self.root)
+
+    def testHeaderSizes(self):
+        expected = {"a.png": (640, 480),
+                    "a.gif": (320, 200),
+                    "a.bmp": (100, 50),
+                    "a.jpg": (1024, 768),
+                    "a.tif": (30, 40),
+                    "a.txt": None}
+        for fn, size in expected.items():
+            result = getImageSize(os.path.join(self.root, fn))
+            self.assertEqual(result and tuple(result), size)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Name        rename_tests_memory.py
+Author      David Edmondson
+
+Tests that the stages which hold a whole tree in memory stay within their
+budgets in bytes per file (bench.bench_memory.BUDGETS). A failure reports the
+biggest allocation sites, or object types where tracemalloc is unavailable.
+"""
+
+import unittest, os, tempfile, shutil
+from rename_http import ReplayTransport
+from bench.synthetic import SyntheticTree
+from bench.bench_memory import (canMeasure, checkBudget, measurePeak,
+                                measureStages, makeModel)
+from test.rename_tests_fixtures import FLICKR_FIXTURE
+
+class TestMemoryBudgets(unittest.TestCase):
+    FILES = 10000
+
+    @classmethod
+    def setUpClass(cls):
+        if not canMeasure():
+            raise unittest.SkipTest("needs tracemalloc, or fork and /proc")
+        cls.tempDir = tempfile.mkdtemp()
+        try:
+            tree = SyntheticTree(cls.FILES, seed=0)
+            root = os.path.join(cls.tempDir, "tree")
+            os.makedirs(root)
+            tree.build(root)
+            model, presenter = makeModel(os.path.join(cls.tempDir, "data"),
+                                         tree, ReplayTransport(FLICKR_FIXTURE))
+            cls.measured = dict(measureStages(model, presenter, root))
+        except:
+            shutil.rmtree(cls.tempDir)
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempDir)
+
+    def _checkStage(self, stage):
+        report = checkBudget(stage, self.FILES, self.measured[stage])
+        self.assertIsNone(report, report)
+
+    def testCreateRenameList(self):
+        self._checkStage("createRenameList")
+
+    def testUpdateRenameList(self):
+        self._checkStage("_updateRenameList")
+
+    def testViewFeed(self):
+        self._checkStage("viewFeed")
+
+    def testReport(self):
+        """Test that going over budget reports the biggest sites."""
+        measured = measurePeak(lambda: ["x" * 100 for i in xrange(10000)])
+        self.assertGreater(measured["peak"], 0)
+        report = checkBudget("viewFeed", 10, measured, {"viewFeed": 1})
+        self.assertIn("viewFeed used", report)
+        self.assertEqual(len(report.splitlines()), len(measured["sites"]) + 1)
+        self.assertTrue(measured["sites"])
+
+if __name__ == '__main__':
+    unittest.main()
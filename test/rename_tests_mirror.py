@@ -0,0 +1,122 @@
+"""
+Name        rename_tests_mirror.py
+Author      David Edmondson
+
+Tests mirror output: the target holds every file under its planned name, the
+source is untouched, pruned directories are left out, and each placement
+method works or falls back.
+"""
+
+import unittest, os, errno, tempfile, shutil
+from test.rename_tests_fixtures import makeModel
+from rename_mirror import Mirror
+import rename_mirror
+
+class TestMirror(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.tempDir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tempDir, "master")
+        self.target = os.path.join(self.tempDir, "normalized")
+        os.makedirs(os.path.join(self.source, "sub_dir"))
+        for fn in ("a_b.jpg", "a-b.jpg", "notes.txt", "plain.png",
+                   os.path.join("sub_dir", "c__d.gif")):
+            f = open(os.path.join(self.source, fn), "wb")
+            f.write(fn * 100)
+            f.close()
+        self.m.createRenameList(self.source)
+        self.before = self._listTree(self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _listTree(self, root):
+        return sorted(os.path.relpath(os.path.join(r, fn), root)
+                      for r, _, files in os.walk(root) for fn in files)
+
+    def _checkMirror(self):
+        self.assertEqual(self._listTree(self.source), self.before)
+        self.assertEqual(self._listTree(self.target),
+                         ["a b (1).jpg", "a b.jpg", "notes.txt", "plain.png",
+                          os.path.join("sub_dir", "c d.gif")])
+        f = open(os.path.join(self.target, "sub_dir", "c d.gif"), "rb")
+        self.assertEqual(f.read(), os.path.join("sub_dir", "c__d.gif") * 100)
+        f.close()
+
+    def testHardlink(self):
+        counts = self.m.mirrorFiles(self.target, mode="hardlink")
+        self._checkMirror()
+        self.assertEqual(counts["hardlink"], 5)
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.source, "a_b.jpg"),
+            os.path.join(self.target, "a b.jpg")))
+
+    def testCopy(self):
+        counts = self.m.mirrorFiles(self.target, mode="copy")
+        self._checkMirror()
+        self.assertEqual(counts["copy"], 5)
+        self.assertFalse(os.path.samefile(
+            os.path.join(self.source, "a_b.jpg"),
+            os.path.join(self.target, "a b.jpg")))
+
+    def _mirrorFailing(self, error):
+        """Mirrors with reflinks and hard links failing with error. Returns
+        the counts and the targets tried before copying."""
+        calls = []
+        def failing(src, dst):
+            calls.append(dst)
+            raise OSError(error, os.strerror(error))
+        original = rename_mirror._METHODS
+        rename_mirror._METHODS = (("reflink", failing), ("hardlink", failing),
+                                  ("copy", rename_mirror.copyFile))
+        try:
+            counts = self.m.mirrorFiles(self.target)
+        finally:
+            rename_mirror._METHODS = original
+        self._checkMirror()
+        return counts, calls
+
+    def testAutoFallback(self):
+        """Test that auto mode falls back when reflinks and hard links are
+        unsupported, and only tries each of them once per device pair."""
+        counts, calls = self._mirrorFailing(errno.EXDEV)
+        self.assertEqual(counts["copy"], 5)
+        self.assertEqual(len(calls), 2)
+
+    def testFileFailure(self):
+        """Test that a failure for one file does not rule out a method for
+        the rest."""
+        counts, calls = self._mirrorFailing(errno.EACCES)
+        self.assertEqual(counts["copy"], 5)
+        self.assertEqual(len(calls), 10)
+
+    def testPruned(self):
+        """Test that pruned directories are not mirrored, and only files
+        placed under a new name count as renamed."""
+        os.makedirs(os.path.join(self.source, "cache"))
+        open(os.path.join(self.source, "cache", "x_y.jpg"), "wb").close()
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " ",
+                               "prune": {"excludeDirs": ["cache"]}})
+        self.m.createRenameList(self.source)
+        self.before = self._listTree(self.source)
+        self.m.stats.enabled = True
+        self.m.mirrorFiles(self.target)
+        self._checkMirror()
+        self.assertEqual(self.m.getStats()["counters"]["filesRenamed"], 3)
+
+        self.m.stats.reset()
+        self.m.mirrorFiles(self.target)
+        self.assertEqual(self.m.getStats()["counters"]["filesRenamed"], 0)
+
+    def testExistingTargets(self):
+        self.m.mirrorFiles(self.target)
+        counts = self.m.mirrorFiles(self.target)
+        self.assertEqual(counts["skipped"], 5)
+        self.assertRaises(ValueError, lambda: Mirror(self.source, self.target,
+                                                     "symlink"))
+
+if __name__ == '__main__':
+    unittest.main()
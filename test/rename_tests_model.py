@@ -6,15 +6,17 @@ Tests Model-specific methods for basic functionality. Uses images created in
 a platform-independent temporary directory.
 """
 
-import unittest, os, tempfile, json
+import unittest, os, tempfile, json, pstats, shutil
 from rename_model import Model
+from rename_prune import PRUNE_DEFAULT
+from test.rename_tests_fixtures import makeModel
 
 class TestRequiringTemporaryFiles(unittest.TestCase):
     def setUp(self):
         self.maxDiff = None
 
         # Instantiate model
-        self.m = Model()
+        self.m = makeModel(self)
 
         # Create temporary directory and files
         self.tempImages = [
@@ -60,7 +62,7 @@ class TestRequiringTemporaryFiles(unittest.TestCase):
 
         self.m.createRenameList(self.root)
         resultList = self.m.getRenameList()
-        self.assertDictEqual(testSpaceFlickr, resultList)
+        self.assertDictEqual(testSpaceFlickr, dict(resultList))
 
     def testRenameList_UnderscoreCapitalFlickr(self):
         """Test that the correct files are found and renamed with underscore
@@ -78,7 +80,7 @@ class TestRequiringTemporaryFiles(unittest.TestCase):
 
         self.m.createRenameList(self.root)
         resultList = self.m.getRenameList()
-        self.assertDictEqual(testUnderscoreCapitalFlickr, resultList)
+        self.assertDictEqual(testUnderscoreCapitalFlickr, dict(resultList))
 
     def testRenameList_DotCapital(self):
         """Test that the correct files are found and renamed with period
@@ -96,7 +98,80 @@ class TestRequiringTemporaryFiles(unittest.TestCase):
 
         self.m.createRenameList(self.root)
         resultList = self.m.getRenameList()
-        self.assertDictEqual(testUnderscoreCapitalFlickr, resultList)
+        self.assertDictEqual(testUnderscoreCapitalFlickr, dict(resultList))
+
+    def testStats(self):
+        """Test that stage timers and counters are collected when enabled,
+        and left at zero when disabled."""
+        self._changeSettings(capital=False, flickr=False, delimiter=" ")
+
+        self.m.createRenameList(self.root)
+        stats = self.m.getStats()
+        self.assertFalse(stats["enabled"])
+        self.assertEqual(sum(stats["counters"].values()), 0)
+
+        self.m.stats.enabled = True
+        self.m.createRenameList(self.root)
+        stats = self.m.getStats()
+        self.assertEqual(stats["counters"]["filesSeen"], 10)
+        self.assertEqual(stats["counters"]["imagesMatched"], 8)
+        self.assertEqual(stats["counters"]["httpRequests"], 0)
+        self.assertGreater(stats["stages"]["walk"], 0)
+        self.assertGreater(stats["stages"]["convert"], 0)
+
+    def testPublishRenames(self):
+        """Test that renames are published in batches during a scan, only
+        when asked for, and match the finished rename list."""
+        self._changeSettings(capital=False, flickr=False, delimiter=" ")
+        self.m.createRenameList(self.root)
+        self.assertEqual(self.m.takeRenames(), [])
+
+        batches = []
+        publish = self.m._publish
+        self.m._publish = lambda batch: (batches.append(len(batch)),
+                                         publish(batch))
+        self.m.publishRenames = True
+        renameBatch, Model.RENAME_BATCH = Model.RENAME_BATCH, 3
+        try:
+            self.m.createRenameList(self.root)
+        finally:
+            self.m.publishRenames = False
+            Model.RENAME_BATCH = renameBatch
+        renames = self.m.takeRenames()
+        self.assertEqual([(os.path.join(root, old), os.path.join(root, new))
+                          for root, old, new, _ in renames],
+                         list(self.m.getRenameList().iteritems()))
+        self.assertEqual(batches, [3, 3, 1])
+        self.assertEqual(self.m.takeRenames(), [])
+
+    def testTraceAndProfile(self):
+        """Test that tracing writes a loadable Chrome trace with spans for
+        listing and scanning each directory, and that profiling saves a
+        cProfile dump."""
+        self._changeSettings(capital=False, flickr=False, delimiter=" ")
+        for fn in (self.m.FILE_TRACE, self.m.FILE_PROFILE):
+            if os.path.isfile(fn):
+                os.remove(fn)
+
+        self.m.trace = True
+        self.m.profile = True
+        self.m.createRenameList(self.root)
+
+        f = open(self.m.FILE_TRACE, "r")
+        events = json.load(f)
+        f.close()
+        directories = [e for e in events if e.get("cat") == "directory"]
+        self.assertEqual(len(directories), 1)
+        self.assertEqual(directories[0]["name"], self.root)
+        self.assertEqual(directories[0]["args"]["files"], 10)
+        # Listed once to count the files, and once to scan them
+        listings = [e for e in events if e.get("cat") == "list"]
+        self.assertEqual([e["name"] for e in listings], [self.root] * 2)
+        self.assertLessEqual(listings[-1]["ts"] + listings[-1]["dur"],
+                             directories[0]["ts"])
+
+        stats = pstats.Stats(self.m.FILE_PROFILE)
+        self.assertTrue(stats.total_calls > 0)
 
     def testRunRenameFiles(self):
         pass
@@ -104,7 +179,7 @@ class TestRequiringTemporaryFiles(unittest.TestCase):
 class TestNotRequiringTemporaryFiles(unittest.TestCase):
     def setUp(self):
         # Instantiate model, force all settings to default
-        self.m = Model()
+        self.m = makeModel(self)
 
     def _changeSettings(self, capital, flickr, delimiter, lastPath=""):
         settings = {"capital": capital,
@@ -131,7 +206,10 @@ class TestNotRequiringTemporaryFiles(unittest.TestCase):
         expectSettings = {"flickr":True,
                           "capital":True,
                           "delimiter":" ",
-                          "lastPath":""}
+                          "lastPath":"",
+                          "recentPaths":[],
+                          "rules":[],
+                          "prune":PRUNE_DEFAULT}
 
         f = open(self.m.FILE_SETTINGS, "w+")
         json.dump(expectSettings, f)
@@ -145,7 +223,7 @@ class TestNotRequiringTemporaryFiles(unittest.TestCase):
         """Test that a settings file is created with correct defaults."""
         os.remove(self.m.FILE_SETTINGS)
 
-        self.m = Model()
+        self.m = makeModel(self, dataRoot=self.m.dataRoot)
         settings = self.m.getSettings()
         self.assertDictEqual(self.m.SETTING_DEFAULT, settings)
 
@@ -160,9 +238,26 @@ class TestNotRequiringTemporaryFiles(unittest.TestCase):
         json.dump(invalidSettings, f)
         f.close()
 
-        self.m = Model()
+        self.m = makeModel(self, dataRoot=self.m.dataRoot)
         self.assertDictEqual(self.m.getSettings(), expectedSettings)
 
+    def testErrorLogPerModel(self):
+        """Test that each Model logs to the error.log in its own data root,
+        and releases it on close."""
+        other = makeModel(self)
+        self.m.logger.warning("first model")
+        other.logger.warning("second model")
+        self.m.close()
+        other.close()
+        with open(self.m.FILE_LOG_ERROR) as f:
+            first = f.read()
+        with open(other.FILE_LOG_ERROR) as f:
+            second = f.read()
+        self.assertIn("WARNING:first model\n", first)
+        self.assertNotIn("second model", first)
+        self.assertIn("WARNING:second model\n", second)
+        self.assertNotIn("first model", second)
+        self.assertIsNone(other._logHandler.stream)
 
     def testCheckDuplicates(self):
         """Test that duplicate checking functions."""
@@ -219,6 +314,40 @@ class TestNotRequiringTemporaryFiles(unittest.TestCase):
         self.assertEqual(self.m._convertName("TOO    muCH     spAce.tga"),
                     "TOO_muCH_spAce.tga")
 
+    def testRules(self):
+        """Test that rules run after the built-in conversion, are saved with
+        the settings, and never leave an empty name."""
+        settings = {"capital": True, "flickr": False, "delimiter": "_",
+                    "rules": [{"rule": "stripPrefix", "prefix": "img_",
+                               "ignoreCase": True},
+                              {"rule": "replace", "pattern": "_V\\d+$"},
+                              {"rule": "clip", "words": 3}]}
+        try:
+            self.m.changeSettings(settings)
+            self.assertEqual(
+                self.m._convertName("IMG-0042 castle at dusk v3.JPG"),
+                "0042_Castle_At.jpg")
+            self.assertEqual(self.m._convertName("img.png"), "Img.png")
+            self.assertEqual(makeModel(self, dataRoot=self.m.dataRoot)
+                             .getSettings()["rules"],
+                             self.m.getSettings()["rules"])
+
+            # Rules are kept when other settings change
+            self._changeSettings(capital=False, flickr=False, delimiter=" ")
+            self.assertEqual(self.m._convertName("img dark_tower v2.png"),
+                             "img dark tower.png")
+
+            settings["rules"] = [{"rule": "replace", "pattern": ".+"}]
+            self.m.changeSettings(settings)
+            self.assertEqual(self.m._convertName("a_b.jpg"), "A_B.jpg")
+
+            settings["rules"] = [{"rule": "clip", "length": 0}]
+            self.assertRaises(ValueError,
+                              lambda: self.m.changeSettings(settings))
+        finally:
+            self.m.changeSettings({"capital": False, "flickr": False,
+                                   "delimiter": " ", "rules": []})
+
     def testGetNameFlickr(self):
         """Test that Flickr name retrieval works correctly."""
         self._changeSettings(capital=True, flickr=True, delimiter=" ")
@@ -250,5 +379,67 @@ class TestNotRequiringTemporaryFiles(unittest.TestCase):
         for fn in listTypeError:
             self.assertRaises(AttributeError, lambda: self.m._isImage(fn))
 
+class TestMemoFlickr(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": True,
+                               "delimiter": " "})
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _write(self, fn, text):
+        fn = os.path.join(self.tempDir, fn)
+        f = open(fn, "wb")
+        f.write(text)
+        f.close()
+        return fn
+
+    def testImportCsv(self):
+        """Test that valid rows are imported, in batches, and invalid ones
+        skipped."""
+        fn = self._write("memo.csv",
+                         "title,photo\n"
+                         "Sunset: over the bay!,9100000001\n"
+                         "Caf\xc3\xa9 Interior,9100000002\n"
+                         "No id,\n"
+                         "Bad id,91x0000003\n"
+                         ",9100000004\n")
+        self.assertEqual(self.m.importMemoFlickr(
+            fn, idField="photo", batchSize=1), (2, 3))
+        self.assertEqual(self.m.memoFlickr["9100000001"],
+                         "Sunset over the bay.jpg")
+        self.assertEqual(self.m.memoFlickr["9100000002"], "Caf Interior.jpg")
+        self.assertNotIn("9100000004", self.m.memoFlickr)
+
+        # Imported titles are used without any network access, and keep the
+        # extension of the file being renamed
+        self.assertEqual(
+            self.m._getNameFlickr("9100000001_a7d7351d30_o.PNG",
+                                  "9100000001"),
+            "Sunset over the bay.png")
+
+    def testExportAndImportJsonLines(self):
+        """Test that an exported memo imports back unchanged."""
+        self.m.memoFlickr = {"9100000001": "Roof.png",
+                             "9100000002": u"Stairs.jpg"}
+        fn = os.path.join(self.tempDir, "memo.jsonl")
+        self.assertEqual(self.m.exportMemoFlickr(fn, fileFormat="jsonl"), 2)
+        self.m.memoFlickr = {}
+        self.assertEqual(self.m.importMemoFlickr(fn, fileFormat="jsonl"),
+                         (2, 0))
+        self.assertEqual(self.m.memoFlickr, {"9100000001": "Roof.jpg",
+                                             "9100000002": "Stairs.jpg"})
+
+        csvFn = os.path.join(self.tempDir, "memo.csv")
+        self.m.exportMemoFlickr(csvFn)
+        self.assertEqual(open(csvFn).read().splitlines(),
+                         ["id,title", "9100000001,Roof", "9100000002,Stairs"])
+
+    def testUnknownFormat(self):
+        self.assertRaises(ValueError, lambda: self.m.importMemoFlickr(
+            "memo.xml", fileFormat="xml"))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
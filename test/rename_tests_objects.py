@@ -19,9 +19,15 @@ class View(object):
             "options":[]}
         self._checkboxFlickr = False
         self._checkboxCapital = False
+        self._textFilter = u""
+        self._choiceFilter = {
+            "selected":'',
+            "options":[]}
         self._listRename = [
             [],
             []]
+        self.progressMessages = []
+        self.buttonRenameEnabled = False
 
     def start(self):
         pass
@@ -45,6 +51,8 @@ class View(object):
         return True
 
     def showProgress(self, progress, title = "", message = "", abort=False):
+        if message:
+            self.progressMessages.append(message)
         return True
 
     def stopProgress(self):
@@ -58,7 +66,7 @@ class View(object):
 
     # Properties for getting / setting - necessary for translation to wx
     def enableButtonRename(self, state):
-        pass
+        self.buttonRenameEnabled = state
 
     # Properties to keep wxPython syntax restricted to the View.
     def _getListRename(self):
@@ -68,6 +76,10 @@ class View(object):
         self._listRename[0] = list1
         self._listRename[1] = list2
 
+    def appendRename(self, (list1, list2)):
+        self._listRename[0].extend(list1)
+        self._listRename[1].extend(list2)
+
     def _getComboBoxDelimiter(self):
         return self._comboBoxDelimiter["selected"]
 
@@ -92,11 +104,32 @@ class View(object):
     def _setCheckboxCapital(self, value):
         self._checkboxCapital = value
 
+    def _getTextFilter(self):
+        return self._textFilter
+
+    def _setTextFilter(self, text):
+        self._textFilter = text
+
+    def _getChoiceFilter(self):
+        return self._choiceFilter["selected"]
+
+    def _setChoiceFilter(self, value):
+        self._choiceFilter["selected"] = value
+
+    def _getFilterOptions(self):
+        return self._choiceFilter["options"]
+
+    def _setFilterOptions(self, options):
+        self._choiceFilter["options"] = options
+
     rename = property(_getListRename, _setListRename)
     delimiter = property(_getComboBoxDelimiter, _setComboBoxDelimiter)
     delimiterOptions = property(_getDelimiterOptions, _setDelimiterOptions)
     flickr = property(_getCheckboxFlickr, _setCheckboxFlickr)
     capital = property(_getCheckboxCapital, _setCheckboxCapital)
+    filterText = property(_getTextFilter, _setTextFilter)
+    filter = property(_getChoiceFilter, _setChoiceFilter)
+    filterOptions = property(_getFilterOptions, _setFilterOptions)
 
 class Interactor(object):
     def install(self, presenter, view):
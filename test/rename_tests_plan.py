@@ -0,0 +1,241 @@
+"""
+Name        rename_tests_plan.py
+Author      David Edmondson
+
+Tests the compact rename plan: dict compatibility, duplicate lookups, memory
+use compared to a dict of absolute paths, and plan file export and apply.
+"""
+
+import unittest, os, sys, json, tempfile, shutil
+from test.rename_tests_fixtures import makeModel
+from rename_plan import RenamePlan, FLAG_FLICKR, FLAG_DUPLICATE
+from rename_plan import exportPlan, planSize
+from rename_scheduler import Scheduler
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def _deepSize(obj, seen=None):
+    """Retained size of an object graph, counting shared objects once. Used
+    where tracemalloc is unavailable (Python 2)."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += _deepSize(k, seen) + _deepSize(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += _deepSize(item, seen)
+    elif hasattr(obj, "__dict__"):
+        size += _deepSize(obj.__dict__, seen)
+    return size
+
+def _measure(build):
+    """Returns (result, bytes) for a callable that builds a structure."""
+    if tracemalloc:
+        tracemalloc.start()
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return result, size
+    result = build()
+    return result, _deepSize(result)
+
+class TestRenamePlan(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.join(os.sep, "library", "references", "2012")
+        self.entries = []
+        for d in xrange(50):
+            root = os.path.join(self.root, "artist {}".format(d), "studies")
+            for i in xrange(400):
+                self.entries.append((root,
+                                     "figure_study-{}_FINAL.JPG".format(i),
+                                     "figure study {} FINAL.jpg".format(i)))
+
+    def _plan(self):
+        plan = RenamePlan()
+        for root, old, new in self.entries:
+            plan.add(root, old, new)
+        return plan
+
+    def testDictCompatibility(self):
+        """Test that the plan reads exactly like a dict of absolute paths."""
+        plan = self._plan()
+        expected = dict((os.path.join(root, old), os.path.join(root, new))
+                        for root, old, new in self.entries)
+        self.assertEqual(len(plan), len(expected))
+        self.assertDictEqual(dict(plan), expected)
+        self.assertEqual(dict(plan.iteritems()), expected)
+        key = os.path.join(self.root, "artist 3", "studies",
+                           "figure_study-7_FINAL.JPG")
+        self.assertIn(key, plan)
+        self.assertEqual(plan[key], expected[key])
+        self.assertNotIn(key + "x", plan)
+        self.assertRaises(KeyError, lambda: plan[key + "x"])
+
+    def testNewNameLookup(self):
+        """Test duplicate lookups in the current, earlier and revisited
+        directories."""
+        plan = RenamePlan()
+        plan.add(os.path.join("a", "b"), "x_1.jpg", "x 1.jpg")
+        plan.add(os.path.join("a", "c"), "y_1.jpg", "y 1.jpg", FLAG_FLICKR)
+        values = plan.values()
+        self.assertIn(os.path.join("a", "b", "x 1.jpg"), values)
+        self.assertIn(os.path.join("a", "c", "y 1.jpg"), values)
+        self.assertNotIn(os.path.join("a", "c", "x 1.jpg"), values)
+
+        plan.add(os.path.join("a", "b") + os.sep, "x-1.jpg", "x 1 (1).jpg",
+                 FLAG_DUPLICATE)
+        self.assertIn(os.path.join("a", "b", "x 1 (1).jpg"), values)
+        self.assertEqual(len(plan.getDirs()), 2)
+        self.assertEqual([flags for _, _, _, flags in plan.entries()],
+                         [0, FLAG_FLICKR, FLAG_DUPLICATE])
+
+    def testMemory(self):
+        """Test that the plan takes at most half the memory of a dict of
+        absolute paths."""
+        entries = self.entries
+        asDict, dictSize = _measure(lambda: dict(
+            (os.path.join(root, old), os.path.join(root, new))
+            for root, old, new in entries))
+        plan, planSize = _measure(self._plan)
+        self.assertEqual(len(plan), len(asDict))
+        self.assertLess(planSize, dictSize * 0.5)
+
+class TestPlanFile(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.tempDir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tempDir, "refs")
+        os.makedirs(os.path.join(self.root, "sub_dir"))
+        for fn in ("a_b.jpg", "a-b.jpg", "c__d.png",
+                   os.path.join("sub_dir", "e_f.gif")):
+            f = open(os.path.join(self.root, fn), "wb")
+            f.write(fn)
+            f.close()
+        self.planFile = os.path.join(self.tempDir, "plan.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _listTree(self, root):
+        return sorted(os.path.relpath(os.path.join(r, fn), root)
+                      for r, _, files in os.walk(root) for fn in files)
+
+    def testExportAndApply(self):
+        """Test that applying an exported plan gives the same result as
+        renaming directly."""
+        self.m.createRenameList(self.root)
+        self.assertEqual(self.m.exportRenameList(self.planFile), 4)
+
+        copy = os.path.join(self.tempDir, "direct")
+        shutil.copytree(self.root, copy)
+        self.m.createRenameList(copy)
+        self.m.renameFiles()
+
+        self.assertEqual(self.m.applyRenameFile(self.planFile), (4, 0))
+        self.assertEqual(self._listTree(self.root), self._listTree(copy))
+
+    def testApplyElsewhere(self):
+        """Test that a plan can be applied to the same tree at another path,
+        and that changed or missing files are skipped."""
+        self.m.createRenameList(self.root)
+        self.m.exportRenameList(self.planFile)
+
+        moved = os.path.join(self.tempDir, "mounted")
+        os.rename(self.root, moved)
+        os.remove(os.path.join(moved, "a-b.jpg"))
+        f = open(os.path.join(moved, "c__d.png"), "ab")
+        f.write("changed")
+        f.close()
+
+        self.assertEqual(self.m.applyRenameFile(self.planFile, root=moved),
+                         (2, 2))
+        self.assertEqual(self._listTree(moved),
+                         ["a b.jpg", "c__d.png",
+                          os.path.join("sub_dir", "e f.gif")])
+
+    @unittest.skipUnless(hasattr(os, "link"), "needs hard links")
+    def testApplyCaseOnly(self):
+        """Test that a case-only rename is applied when the filesystem
+        finds the source under its new name, but a different file there is
+        still kept."""
+        for fn in ("Photo.JPG", "Other.JPG", "other.jpg"):
+            open(os.path.join(self.root, fn), "wb").close()
+        # What a case-insensitive filesystem shows: both names, one file
+        os.link(os.path.join(self.root, "Photo.JPG"),
+                os.path.join(self.root, "photo.jpg"))
+        self.m._lastPath = self.root
+        self.m._renameList = plan = RenamePlan()
+        plan.add(self.root, "Photo.JPG", "photo.jpg")
+        plan.add(self.root, "Other.JPG", "other.jpg")
+        self.m.exportRenameList(self.planFile)
+        self.assertEqual(self.m.applyRenameFile(self.planFile, self.root),
+                         (1, 1))
+
+    def testMultiRoot(self):
+        """Test that a plan from a multi-root scan is applied to every root,
+        in place and mounted elsewhere."""
+        other = os.path.join(self.tempDir, "other")
+        os.mkdir(other)
+        open(os.path.join(other, "g_h.jpg"), "wb").close()
+        Scheduler(self.m).createRenameList([self.root, other])
+        self.assertEqual(self.m.exportRenameList(self.planFile), 5)
+        self.assertEqual(planSize(self.planFile), 5)
+
+        moved = os.path.join(self.tempDir, "mounted")
+        os.mkdir(moved)
+        for name in ("refs", "other"):
+            os.rename(os.path.join(self.tempDir, name),
+                      os.path.join(moved, name))
+        self.assertEqual(self.m.applyRenameFile(self.planFile, root=moved),
+                         (5, 0))
+        self.assertEqual(self._listTree(os.path.join(moved, "other")),
+                         ["g h.jpg"])
+
+    def testEmptyRoot(self):
+        """Test that a plan exports with no scanned folder, recording the
+        folder holding its directories."""
+        plan = RenamePlan()
+        plan.add(self.root, "a_b.jpg", "a b.jpg")
+        plan.add(os.path.join(self.root, "sub_dir"), "e_f.gif", "e f.gif")
+        self.assertEqual(exportPlan(plan, self.planFile, ""), 2)
+        self.assertEqual(self.m.applyRenameFile(self.planFile), (2, 0))
+        self.assertIn("a b.jpg", os.listdir(self.root))
+
+    def testOutsideRoot(self):
+        """Test that plans with directories outside their root are
+        rejected, and directory lines are found however they are written."""
+        outside = os.path.join(self.tempDir, "outside")
+        os.mkdir(outside)
+        open(os.path.join(outside, "x_y.jpg"), "wb").close()
+        for planDir in (os.path.join(os.pardir, "outside"), outside):
+            f = open(self.planFile, "w")
+            f.write('{"format": "refcollage-plan", "version": 1, '
+                    '"root": %s}\n' % json.dumps(self.root))
+            f.write('{ "dir": %s}\n' % json.dumps(planDir))
+            f.write('{"old": "x_y.jpg", "new": "x y.jpg", "flags": 0, '
+                    '"size": 0, "mtime": 0}\n')
+            f.close()
+            self.assertEqual(planSize(self.planFile), 1)
+            self.assertRaises(ValueError, self.m.applyRenameFile,
+                              self.planFile)
+        self.assertEqual(os.listdir(outside), ["x_y.jpg"])
+
+    def testInvalidFile(self):
+        f = open(self.planFile, "w")
+        f.write('{"format": "something else"}\n')
+        f.close()
+        self.assertRaises(ValueError,
+                          lambda: self.m.applyRenameFile(self.planFile))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Name        rename_tests_prefetch.py
+Author      David Edmondson
+
+Tests idle-time Flickr prefetch for recently opened folders: titles end up in
+the memo before the folder is opened, missing photos are only looked up once,
+and prefetch waits for foreground work and stops when asked.
+"""
+
+import unittest, os, time, tempfile, shutil
+from test.rename_tests_fixtures import makeModel, FLICKR_FIXTURE
+from rename_http import ReplayTransport
+from rename_prefetch import Prefetcher
+from rename_retry import CircuitBreaker
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.startDelay = Prefetcher.START_DELAY
+        self.interval = Prefetcher.INTERVAL
+        Prefetcher.START_DELAY = 0.0
+        Prefetcher.INTERVAL = 0.0
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": True,
+                               "delimiter": " "})
+        self.tempDir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tempDir, "refs")
+        self.other = os.path.join(self.tempDir, "other")
+        for fn in (os.path.join(self.root, "6795654383_a7d7351d30_z.jpg"),
+                   os.path.join(self.root, "sub", "6888049103_9f1b0d6e2c.jpg"),
+                   os.path.join(self.root, "9216803042_a7d7351d30_o.jpg"),
+                   os.path.join(self.root, "plain_name.jpg"),
+                   os.path.join(self.other, "178933701_b2e1c0c3f4_b.jpg")):
+            if not os.path.isdir(os.path.dirname(fn)):
+                os.makedirs(os.path.dirname(fn))
+            open(fn, "wb").close()
+
+    def tearDown(self):
+        self.m.stopPrefetch()
+        Prefetcher.START_DELAY = self.startDelay
+        Prefetcher.INTERVAL = self.interval
+        shutil.rmtree(self.tempDir)
+
+    def _open(self, *paths):
+        for path in paths:
+            self.m._rememberPath(path)
+        self.m._saveSettings()
+
+    def testPrefetch(self):
+        """Test that titles under recent folders are memoized and saved, so
+        opening the folder needs no page fetches."""
+        self._open(self.other, self.root)
+        prefetcher = self.m.startPrefetch()
+        self.assertEqual(prefetcher.roots, [self.root, self.other])
+        self.assertTrue(prefetcher.done.wait(10))
+        self.assertEqual((prefetcher.found, prefetcher.lookedUp,
+                          prefetcher.failed), (4, 4, 0))
+        for flickrId in ("6795654383", "6888049103", "178933701"):
+            self.assertIn(flickrId, self.m.memoFlickr)
+        reloaded = makeModel(self, dataRoot=self.m.dataRoot)
+        self.assertIn("178933701", reloaded.memoFlickr)
+
+        self.m.transport = ReplayTransport(FLICKR_FIXTURE)
+        self.m.createRenameList(self.root)
+        self.assertNotIn("GET", [r[0] for r in self.m.transport.requests])
+        self.assertIn(os.path.join(self.root, "6795654383_a7d7351d30_z.jpg"),
+                      self.m.getRenameList())
+
+    def testOwnCounters(self):
+        """Test that prefetch walks and lookups are counted apart from the
+        Model's foreground stats and throughput."""
+        self.m.stats.enabled = True
+        self._open(self.root)
+        prefetcher = self.m.startPrefetch()
+        self.assertTrue(prefetcher.done.wait(10))
+        self.assertEqual(prefetcher.throughput.counts["lookups"], 3)
+        self.assertGreater(prefetcher.stats.counters["httpRequests"], 0)
+        self.assertEqual(self.m.throughput.counts["lookups"], 0)
+        self.assertEqual(self.m.getStats()["counters"]["httpRequests"], 0)
+        self.assertEqual(self.m.getStats()["stages"]["walk"], 0)
+
+    def testWaitsForForeground(self):
+        self._open(self.root)
+        with self.m.busy():
+            prefetcher = self.m.startPrefetch()
+            time.sleep(0.2)
+            self.assertEqual(prefetcher.lookedUp, 0)
+        self.assertTrue(prefetcher.done.wait(10))
+        self.assertEqual(prefetcher.lookedUp, 3)
+
+    def testUnavailable(self):
+        """Test that photos found missing are not looked up again in the
+        same session, by later prefetches or after a scan."""
+        self._open(self.root)
+        self.assertTrue(self.m.startPrefetch().done.wait(10))
+        self.assertIn("9216803042", self.m._flickrUnavailable)
+        prefetcher = self.m.startPrefetch()
+        self.assertTrue(prefetcher.done.wait(10))
+        self.assertEqual((prefetcher.found, prefetcher.lookedUp), (0, 0))
+
+        reloaded = makeModel(self, dataRoot=self.m.dataRoot)
+        reloaded.createRenameList(self.root)
+        self.assertIn("9216803042", reloaded._flickrUnavailable)
+        prefetcher = reloaded.startPrefetch()
+        self.assertTrue(prefetcher.done.wait(10))
+        self.assertEqual(prefetcher.found, 0)
+
+    def testStop(self):
+        self._open(self.root)
+        with self.m.busy():
+            prefetcher = self.m.startPrefetch()
+            self.m.stopPrefetch(timeout=1.0)
+        self.assertTrue(prefetcher.done.is_set())
+        self.assertEqual(prefetcher.lookedUp, 0)
+
+    def testBreakerOpen(self):
+        self._open(self.root)
+        self.m._flickrBreaker.state = CircuitBreaker.OPEN
+        prefetcher = self.m.startPrefetch()
+        self.assertTrue(prefetcher.done.wait(10))
+        self.assertEqual(prefetcher.lookedUp, 0)
+
+    def testRecentPaths(self):
+        """Test that recent folders are kept most recent first, without
+        repeats or missing folders, and saved with the settings."""
+        self.m.RECENT_PATHS = 3
+        missing = os.path.join(self.tempDir, "missing")
+        self._open(missing, self.root, self.other, self.root)
+        settings = makeModel(self, dataRoot=self.m.dataRoot).getSettings()
+        self.assertEqual(settings["lastPath"], self.root)
+        self.assertEqual(settings["recentPaths"],
+                         [self.root, self.other, missing])
+        self.assertEqual(self.m.startPrefetch().roots,
+                         [self.root, self.other])
+
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.assertIsNone(self.m.startPrefetch())
+
+if __name__ == '__main__':
+    unittest.main()
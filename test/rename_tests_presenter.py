@@ -6,17 +6,19 @@ Tests Presenter interaction with Model, using mock objects for Interactor
 and View. Uses images created in a platform-independent temporary directory.
 """
 import unittest, os, tempfile
-from rename_model import Model
-from rename_presenter import Presenter
+from test.rename_tests_fixtures import makeModel
+from rename_prune import PRUNE_DEFAULT
+from rename_presenter import Presenter, _formatDuration
 from test.rename_tests_objects import Interactor, View
 
 class TestPresenterRequiringTemporaryFiles(unittest.TestCase):
     def setUp(self):
         """Creates a set of files in a temporary directory for testing."""
-        self.model = Model()
+        self.model = makeModel(self)
         self.view = View()
         self.interactor = Interactor()
-        self.presenter = Presenter(self.model, self.interactor, self.view)
+        self.presenter = Presenter(self.model, self.interactor, self.view,
+                                   prefetch=False)
 
         self.maxDiff = None
 
@@ -74,6 +76,110 @@ class TestPresenterRequiringTemporaryFiles(unittest.TestCase):
             self.assertIn(k, oldFn)
             self.assertIn(v, newFn)
 
+    def testFilter(self):
+        """Test that the filter text and kind narrow the shown renames, and
+        clearing them shows every rename again."""
+        self.model.changeSettings({"delimiter":" ", "flickr":False,
+                                   "capital":False})
+        self.model._lastPath = self.root
+        self.presenter.openPath()
+        self.assertEqual(self.view.filterOptions,
+                         ["All", "Flickr", "Collisions"])
+        self.assertEqual(len(self.view.rename[0]), 7)
+
+        self.view.filterText = u"A7D7351D30"
+        self.presenter.filterChanged()
+        self.assertEqual(self.view.rename,
+                         (["6795654383_a7d7351d30_z.jpg",
+                           "32165342_a7d7351d30_o.jpg"],
+                          ["6795654383 a7d7351d30 z.jpg",
+                           "32165342 a7d7351d30 o.jpg"]))
+
+        self.view.filter = "Collisions"
+        self.presenter.filterChanged()
+        self.assertEqual(self.view.rename, ([], []))
+
+        self.view.filterText = u""
+        self.view.filter = "All"
+        self.presenter.filterChanged()
+        self.assertEqual(len(self.view.rename[0]), 7)
+
+    def testProgressivePreview(self):
+        """Test that renames are appended to the view while scanning, then
+        replaced by the sorted list, with renaming disabled meanwhile."""
+        appended = []
+        appendRename = self.view.appendRename
+        showProgress = self.view.showProgress
+        buttonStates = []
+
+        def recordAppend(columns):
+            appended.extend(columns[0])
+            appendRename(columns)
+
+        def recordProgress(*args, **kwargs):
+            buttonStates.append(self.view.buttonRenameEnabled)
+            return showProgress(*args, **kwargs)
+        self.view.appendRename = recordAppend
+        self.view.showProgress = recordProgress
+        self.view.enableButtonRename(True)
+        self.model.changeSettings({"delimiter":" ", "flickr":False,
+                                   "capital":False})
+        self.model._lastPath = self.root
+        self.presenter.openPath()
+
+        oldFn, newFn = self.view.rename
+        self.assertEqual(sorted(appended), sorted(oldFn))
+        self.assertEqual(oldFn, sorted(oldFn, key=str.lower, reverse=True))
+        self.assertFalse(self.model.publishRenames)
+        # Renaming is only possible once the list is complete
+        self.assertEqual(set(buttonStates), set([False]))
+        self.assertTrue(self.view.buttonRenameEnabled)
+
+    def testReentrantOpen(self):
+        """Test that opening a folder or changing settings while a scan's
+        progress is showing does not start another scan."""
+        scans = []
+        createRenameList = self.model.createRenameList
+        def recordScan(path):
+            scans.append(path)
+            return createRenameList(path)
+        self.model.createRenameList = recordScan
+
+        showProgress = self.view.showProgress
+        def reenter(*args, **kwargs):
+            self.presenter.openPath()
+            self.view.capital = True
+            self.presenter.settingsChanged()
+            return showProgress(*args, **kwargs)
+        self.view.showProgress = reenter
+        self.model.changeSettings({"delimiter":" ", "flickr":False,
+                                   "capital":False})
+        self.model._lastPath = self.root
+        self.presenter.openPath()
+
+        self.assertEqual(scans, [self.root])
+        self.assertFalse(self.model.getSettings()["capital"])
+        self.assertFalse(self.view.capital)
+        self.assertEqual(len(self.view.rename[0]), 7)
+
+    def testProgressMessage(self):
+        """Test that the progress dialog shows throughput and time left."""
+        self.model.changeSettings({"delimiter":" ", "flickr":False,
+                                   "capital":False})
+        self.model._lastPath = self.root
+        self.presenter.openPath()
+        self.assertIn(u"files/s", self.view.progressMessages[0])
+        self.assertNotIn(u"lookups/s", self.view.progressMessages[0])
+
+        self.model.throughput.reset(files=100, lookups=4)
+        self.model.throughput.add("files", 50)
+        self.model.throughput.add("lookups", 1)
+        message = self.presenter._progressMessage()
+        self.assertIn(u"Flickr lookups/s", message)
+        self.assertIn(u" left", message)
+        self.assertEqual([_formatDuration(s) for s in (0.4, 59, 185, 7830)],
+                         [u"0s", u"59s", u"3m 05s", u"2h 10m"])
+
     def testFlickrWithoutCache(self):
         self.model.memoFlickr = {}
         settings = {
@@ -135,10 +241,11 @@ class TestPresenterRequiringTemporaryFiles(unittest.TestCase):
 
 class TestPresenterNotRequiringTemporaryFiles(unittest.TestCase):
     def setUp(self):
-        self.model = Model()
+        self.model = makeModel(self)
         self.view = View()
         self.interactor = Interactor()
-        self.presenter = Presenter(self.model, self.interactor, self.view)
+        self.presenter = Presenter(self.model, self.interactor, self.view,
+                                   prefetch=False)
 
         self.maxDiff = None
 
@@ -173,7 +280,10 @@ class TestPresenterNotRequiringTemporaryFiles(unittest.TestCase):
         expectSettings = {"capital":True,
                           "flickr":True,
                           "delimiter":"_",
-                          "lastPath":""}
+                          "lastPath":"",
+                          "recentPaths":[],
+                          "rules":[],
+                          "prune":PRUNE_DEFAULT}
         self.presenter.settingsChanged()
         self.assertDictEqual(self.model.getSettings(), expectSettings)
 
@@ -183,7 +293,10 @@ class TestPresenterNotRequiringTemporaryFiles(unittest.TestCase):
         expectSettings = {"capital":False,
                           "flickr":False,
                           "delimiter":" ",
-                          "lastPath":""}
+                          "lastPath":"",
+                          "recentPaths":[],
+                          "rules":[],
+                          "prune":PRUNE_DEFAULT}
         self.presenter.settingsChanged()
         self.assertDictEqual(self.model.getSettings(), expectSettings)
 
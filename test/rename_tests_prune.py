@@ -0,0 +1,102 @@
+"""
+Name        rename_tests_prune.py
+Author      David Edmondson
+
+Tests scan pruning: ignore globs, excluded directories, depth limits, hidden
+names and .refignore files, for serial and sharded scans.
+"""
+
+import unittest, os, tempfile, shutil
+from test.rename_tests_fixtures import makeModel
+from rename_prune import PRUNE_DEFAULT, validatePrune
+
+class TestPrune(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.m.stats.enabled = True
+        self.tempDir = tempfile.mkdtemp()
+        for fn in ("a_b.jpg", "a_thumb.jpg", ".hidden_file.jpg",
+                   os.path.join("cache_1", "c_d.jpg"),
+                   os.path.join(".git", "e_f.png"),
+                   os.path.join("shots", "g_h.jpg"),
+                   os.path.join("shots", "renders", "i_j.jpg"),
+                   os.path.join("shots", "deep", "deeper", "k_l.jpg"),
+                   os.path.join("shots", "deep", "m_n.tif")):
+            path = os.path.join(self.tempDir, fn)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w+b").close()
+        self.listed = []
+        listDirectory = self.m._listDirectory
+
+        def recordListing(root, pruner=None):
+            self.listed.append(os.path.relpath(root, self.tempDir))
+            return listDirectory(root, pruner)
+        self.m._listDirectory = recordListing
+
+    def tearDown(self):
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " ", "prune": PRUNE_DEFAULT})
+        shutil.rmtree(self.tempDir)
+
+    def _scan(self, prune, threads=1):
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " ", "prune": prune})
+        self.m.scanThreads = threads
+        self.listed = []
+        self.m.createRenameList(self.tempDir)
+        return sorted(os.path.relpath(old, self.tempDir)
+                      for old in self.m.getRenameList())
+
+    def testDefault(self):
+        self.assertEqual(len(self._scan({})), 9)
+
+    def testPrune(self):
+        """Test that each rule prunes its files, and excluded directories are
+        never listed, serially or sharded."""
+        prune = {"ignore": ["*_thumb.*", "shots/deep/*.tif"],
+                 "excludeDirs": ["cache*", "shots/renders"],
+                 "maxDepth": 2,
+                 "skipHidden": True}
+        expected = ["a_b.jpg", os.path.join("shots", "g_h.jpg")]
+        for threads in (1, 4):
+            self.assertEqual(self._scan(prune, threads), expected)
+            self.assertEqual(sorted(set(self.listed)),
+                             [".", "shots", os.path.join("shots", "deep")])
+            self.assertEqual(self.m.getStats()["counters"]["dirsPruned"], 4)
+
+        self.assertEqual(self._scan({"maxDepth": 0}),
+                         [".hidden_file.jpg", "a_b.jpg", "a_thumb.jpg"])
+
+    def testRefignore(self):
+        """Test that .refignore patterns apply from their directory down."""
+        f = open(os.path.join(self.tempDir, "shots", ".refignore"), "w+")
+        f.write("# Rendered output\nrenders/\n\ndeep/*.tif\n*_h.jpg\n")
+        f.close()
+        expected = [".hidden_file.jpg", "a_b.jpg", "a_thumb.jpg",
+                    os.path.join("cache_1", "c_d.jpg"),
+                    os.path.join(".git", "e_f.png"),
+                    os.path.join("shots", "deep", "deeper", "k_l.jpg")]
+        self.assertEqual(self._scan({"refignore": True}), sorted(expected))
+        self.assertNotIn(os.path.join("shots", "renders"), self.listed)
+        self.assertEqual(len(self._scan({"refignore": False})), 9)
+
+    def testSettings(self):
+        """Test that prune settings are validated, normalized and saved."""
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " ",
+                               "prune": {"excludeDirs": [".git"]}})
+        expected = dict(PRUNE_DEFAULT, excludeDirs=[".git"])
+        self.assertEqual(self.m.getSettings()["prune"], expected)
+        self.assertEqual(makeModel(self, dataRoot=self.m.dataRoot)
+                         .getSettings()["prune"], expected)
+
+        for prune in ([], {"depth": 1}, {"ignore": "*.png"},
+                      {"ignore": [""]}, {"maxDepth": -1},
+                      {"maxDepth": True}, {"skipHidden": "yes"}):
+            self.assertRaises(ValueError, lambda: validatePrune(prune))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+Name        rename_tests_rate.py
+Author      David Edmondson
+
+Tests rolling throughput and the estimate of time left, with a fake clock,
+and the counts the Model records while scanning and renaming, directly, in
+streams and from plan files.
+"""
+
+import unittest, os, tempfile, shutil
+from test.rename_tests_fixtures import makeModel
+from rename_rate import Throughput
+from rename_async import AsyncModel
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestThroughput(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.throughput = Throughput(clock=self.clock)
+
+    def _run(self, seconds, **perSecond):
+        """Advances the clock a second at a time, reading after each."""
+        for _ in xrange(seconds):
+            self.clock.now += 1
+            for stage, n in perSecond.iteritems():
+                self.throughput.add(stage, n)
+            self.throughput.rates()
+
+    def testRollingRates(self):
+        """Test that rates follow the last WINDOW seconds, not the average
+        since the start."""
+        self._run(10, files=100)
+        self._run(10, files=10)
+        rates = self.throughput.rates()
+        self.assertAlmostEqual(rates["files"], 10.0)
+        self.assertEqual(rates["lookups"], 0.0)
+        self.assertLessEqual(len(self.throughput._samples), 7)
+
+    def testEta(self):
+        """Test that the estimate takes the slowest stage, falling back to
+        its rate since the start while it is idle."""
+        self.throughput.reset(files=1000, lookups=20)
+        self.assertIsNone(self.throughput.snapshot()["eta"])
+
+        self._run(10, files=50, lookups=1)
+        snapshot = self.throughput.snapshot()
+        self.assertEqual(snapshot["counts"], {"files": 500, "lookups": 10,
+                                              "renames": 0})
+        # 500 files at 50/s, but 10 lookups at 1/s
+        self.assertAlmostEqual(snapshot["eta"], 10.0)
+
+        # Local files only: lookups idle, at 10 in 20s since the start
+        self._run(10, files=40)
+        self.assertAlmostEqual(self.throughput.snapshot()["eta"], 20.0)
+
+        self._run(10, files=10, lookups=1)
+        self.assertEqual(self.throughput.snapshot()["eta"], 0.0)
+
+    def testExpect(self):
+        self.throughput.reset()
+        self.throughput.expect("files", 30)
+        self.throughput.expect("files", 30)
+        self._run(2, files=10)
+        snapshot = self.throughput.snapshot()
+        self.assertEqual(snapshot["expected"]["files"], 60)
+        self.assertAlmostEqual(snapshot["eta"], 4.0)
+
+    def testKeys(self):
+        """Test that keyed work counts once, done and expected."""
+        self.throughput.reset()
+        self.throughput.expect("lookups", keys=["1", "2"])
+        self.throughput.expect("lookups", keys=["2", "3"])
+        for key in ("1", "1", "2", "3", "3"):
+            self.throughput.add("lookups", key=key)
+        self.throughput.expect("files", 2)
+        self.throughput.expect("files", -1)
+        snapshot = self.throughput.snapshot()
+        self.assertEqual(snapshot["expected"]["lookups"], 3)
+        self.assertEqual(snapshot["counts"]["lookups"], 3)
+        self.assertEqual(snapshot["expected"]["files"], 1)
+
+        self.throughput.reset()
+        self.throughput.add("lookups", key="1")
+        self.assertEqual(self.throughput.snapshot()["counts"]["lookups"], 1)
+
+class TestModelThroughput(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": True,
+                               "delimiter": " "})
+        self.m.stats.enabled = True
+        self.tempDir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tempDir, "sub"))
+        # Three sizes of one photo are one lookup
+        for fn in ("6795654383_a7d7351d30_z.jpg",
+                   "6795654383_a7d7351d30_o.jpg",
+                   "6795654383_a7d7351d30_b.jpg",
+                   "9216803042_a7d7351d30_o.jpg",
+                   os.path.join("sub", "6888049103_0e43f63926_o.jpg"),
+                   os.path.join("sub", "a_b.png"), "notes.txt"):
+            open(os.path.join(self.tempDir, fn), "wb").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _checkScan(self, scan=None):
+        (scan or self.m.createRenameList)(self.tempDir)
+        throughput = self.m.getThroughput()
+        self.assertEqual(throughput["counts"]["files"],
+                         self.m.getStats()["counters"]["filesSeen"])
+        self.assertEqual(throughput["counts"]["files"], 7)
+        self.assertEqual(throughput["expected"]["files"], 7)
+        self.assertEqual(throughput["counts"]["lookups"], 3)
+        self.assertEqual(throughput["expected"]["lookups"], 3)
+        self.assertEqual(throughput["eta"], 0.0)
+
+    def testScan(self):
+        self._checkScan()
+        # Memoized names are not lookups
+        self.m.createRenameList(self.tempDir)
+        throughput = self.m.getThroughput()
+        self.assertEqual(throughput["counts"]["lookups"], 1)
+        self.assertEqual(throughput["expected"]["lookups"], 1)
+
+    def testShardedScan(self):
+        self.m.scanThreads = 3
+        self._checkScan()
+
+    def testAsyncScan(self):
+        stream = AsyncModel(self.m)
+        self._checkScan(lambda path: list(stream.createRenameList(path)))
+
+    def testApplyPlan(self):
+        """Test that applying a plan file counts renames, and stops expecting
+        those skipped."""
+        self.m.createRenameList(self.tempDir)
+        fn = os.path.join(self.tempDir, "plan.jsonl")
+        planned = self.m.exportRenameList(fn)
+        os.remove(os.path.join(self.tempDir, "sub", "a_b.png"))
+        renamed, skipped = self.m.applyRenameFile(fn)
+        self.assertEqual((renamed + skipped, skipped), (planned, 1))
+        throughput = self.m.getThroughput()
+        self.assertEqual(throughput["counts"]["renames"], renamed)
+        self.assertEqual(throughput["expected"]["renames"], renamed)
+        self.assertEqual(throughput["eta"], 0.0)
+
+    def testRename(self):
+        self.m.createRenameList(self.tempDir)
+        renamed = self.m.renameFiles()
+        throughput = self.m.getThroughput()
+        self.assertEqual(throughput["counts"]["renames"], renamed)
+        self.assertEqual(throughput["expected"]["renames"], renamed)
+        self.assertEqual(throughput["counts"]["files"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
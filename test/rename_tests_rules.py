@@ -0,0 +1,85 @@
+"""
+Name        rename_tests_rules.py
+Author      David Edmondson
+
+Tests rule validation and compilation: fused rules give the same result as
+applying each rule in turn, compiled transforms are cached, and rules never
+produce path separators.
+"""
+
+import unittest, os
+from rename_rules import validateRules, compileRules, _compile
+
+NAMES = ("IMG Img castle at dusk V3", "img ref sheet", "Dark Tower",
+         "IMGIMG double prefix", "a b c d e f g h", "")
+
+class TestRules(unittest.TestCase):
+    def _checkSequential(self, rules):
+        """Checks the fused transform against applying each rule in turn,
+        exactly as the unfused pipeline does."""
+        transform = compileRules(rules)
+        sequential = _compile(validateRules(rules), " ", fuse=False)
+        for name in NAMES:
+            self.assertEqual(transform(name), sequential(name), name)
+        return transform
+
+    def testFusedMatchesSequential(self):
+        transform = self._checkSequential(
+            [{"rule": "stripPrefix", "prefix": "img "},
+             {"rule": "stripPrefix", "prefix": "IMG ", "ignoreCase": True},
+             {"rule": "upper"},
+             {"rule": "title"},
+             {"rule": "replace", "pattern": " V\\d+$"},
+             {"rule": "replace", "pattern": "Ref", "with": "Reference"},
+             {"rule": "clip", "words": 5},
+             {"rule": "clip", "length": 12, "words": 6}])
+        self.assertEqual(transform("IMG Img castle at dusk V3"),
+                         "Img Castle A")
+        self.assertEqual(transform("img ref sheet"), "Reference Sh")
+
+    def testPrefixWithoutSpace(self):
+        """Test prefixes without a trailing space, where the space left
+        behind matters to the next rule."""
+        transform = self._checkSequential(
+            [{"rule": "stripPrefix", "prefix": "IMG", "ignoreCase": True},
+             {"rule": "stripPrefix", "prefix": "Img"},
+             {"rule": "clip", "words": 2}])
+        self.assertEqual(transform("IMG Img castle at dusk V3"), "Img")
+        self.assertEqual(transform("IMGIMG double prefix"), "IMG double")
+
+    def testNoPathSeparators(self):
+        """Test that rules never turn a rename into a move."""
+        transform = compileRules([{"rule": "replace", "pattern": "(at)",
+                                   "with": "\\1"}])
+        self.assertEqual(transform("castle at dusk"), "castle at dusk")
+        for sep in set(["/", os.sep]):
+            transform = compileRules([{"rule": "replace",
+                                       "pattern": "^(\\w+) ",
+                                       "with": "\\1 "}])
+            self.assertEqual(transform("a" + sep + "b c"), "a b c")
+
+    def testCache(self):
+        rules = [{"rule": "lower"}]
+        self.assertIs(compileRules(rules), compileRules([{"rule": "lower"}]))
+        self.assertIsNot(compileRules(rules), compileRules(rules, "_"))
+        self.assertIsNone(compileRules([]))
+
+    def testValidation(self):
+        self.assertEqual(validateRules([{"rule": "replace", "pattern": "x"}]),
+                         [{"rule": "replace", "pattern": "x", "with": ""}])
+        for rules in ({"rule": "lower"}, [{"rule": "reverse"}], ["lower"],
+                      [{"rule": "replace", "pattern": "("}],
+                      [{"rule": "replace", "pattern": "x", "with": 1}],
+                      [{"rule": "replace", "pattern": "(x)", "with": "\\3"}],
+                      [{"rule": "replace", "pattern": "(?P<n>x)",
+                        "with": "\\g<x>"}],
+                      [{"rule": "replace", "pattern": "x", "with": "a\\"}],
+                      [{"rule": "replace", "pattern": "x", "with": "a/b"}],
+                      [{"rule": "stripPrefix"}],
+                      [{"rule": "clip"}],
+                      [{"rule": "clip", "words": True}],
+                      [{"rule": "clip", "length": -1}]):
+            self.assertRaises(ValueError, lambda: validateRules(rules))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+Name        rename_tests_scheduler.py
+Author      David Edmondson
+
+Tests multi-root and sharded scanning: combined results match single-root
+scans, nested roots are only scanned once, per-device concurrency limits hold,
+and sharded scans produce the same rename list as serial scans.
+"""
+
+import unittest, os, tempfile, shutil, threading, time
+from rename_model import Model
+from test.rename_tests_fixtures import makeModel
+from rename_scheduler import Scheduler
+from bench.synthetic import SyntheticTree
+
+class CountingModel(Model):
+    """Model which records the largest number of concurrent root scans."""
+    def __init__(self, **kwargs):
+        Model.__init__(self, **kwargs)
+        self.active = 0
+        self.maxActive = 0
+        self._activeLock = threading.Lock()
+
+    def _scanRoot(self, path, plan):
+        with self._activeLock:
+            self.active += 1
+            self.maxActive = max(self.maxActive, self.active)
+        time.sleep(0.05)
+        try:
+            return Model._scanRoot(self, path, plan)
+        finally:
+            with self._activeLock:
+                self.active -= 1
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self, CountingModel)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.tempDir = tempfile.mkdtemp()
+        self.roots = []
+        for r in xrange(4):
+            root = os.path.join(self.tempDir, "library{}".format(r))
+            os.makedirs(os.path.join(root, "sub_folder"))
+            for fn in ("a_b.jpg", "a-b.jpg", "c.png", "notes.txt"):
+                open(os.path.join(root, fn), "w+b").close()
+                open(os.path.join(root, "sub_folder", fn), "w+b").close()
+            self.roots.append(root)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testCombinedResults(self):
+        """Test that the combined list equals the union of single scans,
+        including duplicate numbering, and that nested roots are skipped."""
+        expected = {}
+        for root in self.roots:
+            self.m.createRenameList(root)
+            expected.update(dict(self.m.getRenameList()))
+
+        nested = os.path.join(self.roots[0], "sub_folder")
+        scheduler = Scheduler(self.m, perDevice=2)
+        self.assertTrue(scheduler.createRenameList(self.roots + [nested]))
+        self.assertDictEqual(dict(self.m.getRenameList()), expected)
+        self.assertEqual(len(self.m.getRenameList()), 16)
+        self.assertEqual(self.m.progress, 100)
+
+    def testPerDeviceLimit(self):
+        """Test that scans on one device never exceed the concurrency
+        limit."""
+        # All temporary roots are on the same device
+        self.assertEqual(len(Scheduler(self.m).groupByDevice(self.roots)), 1)
+
+        Scheduler(self.m, perDevice=1).createRenameList(self.roots)
+        self.assertEqual(self.m.maxActive, 1)
+
+        self.m.maxActive = 0
+        Scheduler(self.m, perDevice=2).createRenameList(self.roots)
+        self.assertEqual(self.m.maxActive, 2)
+
+    def testSlowDeviceCount(self):
+        """Test that a device still counting does not hold up scans on
+        another device."""
+        scanned = threading.Event()
+        countFiles, scanRoot = self.m._countFiles, self.m._scanRoot
+        def slowCount(root):
+            if root == self.roots[0]:
+                scanned.wait(5)
+            return countFiles(root)
+        def scan(root, plan):
+            scanRoot(root, plan)
+            if root == self.roots[1]:
+                scanned.set()
+        self.m._countFiles, self.m._scanRoot = slowCount, scan
+
+        # Pretend the first two roots are on different devices
+        scheduler = Scheduler(self.m)
+        scheduler.groupByDevice = lambda roots: {1: [self.roots[0]],
+                                                 2: [self.roots[1]]}
+        started = time.time()
+        self.assertTrue(scheduler.createRenameList(self.roots[:2]))
+        self.assertLess(time.time() - started, 4)
+        self.assertEqual(len(self.m.getRenameList()), 8)
+        self.assertEqual(self.m.progress, 100)
+
+    def testInterrupt(self):
+        """Test that an interrupted multi-root scan leaves no partial list."""
+        self.m.interrupt = True
+        self.assertFalse(Scheduler(self.m).createRenameList(self.roots))
+        self.assertEqual(len(self.m.getRenameList()), 0)
+        self.assertFalse(self.m.interrupt)
+
+    def testShardedRoots(self):
+        """Test that sharded scans under the scheduler count each file
+        once, in progress, stats and throughput."""
+        self.m.scanThreads = 3
+        self.m.stats.enabled = True
+        self.assertTrue(Scheduler(self.m, perDevice=2)
+                        .createRenameList(self.roots))
+        self.assertEqual(len(self.m.getRenameList()), 16)
+        self.assertEqual((self.m._walkDone, self.m._walkLen), (32, 32))
+        self.assertEqual(self.m.getStats()["counters"]["filesSeen"], 32)
+        throughput = self.m.getThroughput()
+        self.assertEqual(throughput["counts"]["files"], 32)
+        self.assertEqual(throughput["expected"]["files"], 32)
+
+class TestShardedScan(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": True, "flickr": False,
+                               "delimiter": "_"})
+        self.root = tempfile.mkdtemp()
+        SyntheticTree(3000, depth=3, fanout=4, flickrRatio=0,
+                      collisionRate=0.2, seed=7).build(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testSameAsSerial(self):
+        """Test that a sharded scan gives the same renames, in the same order
+        and with the same duplicate numbering, as a serial scan."""
+        self.m.createRenameList(self.root)
+        serial = list(self.m.getRenameList().iteritems())
+        self.assertTrue(any("(1)" in new for _, new in serial))
+
+        self.m.scanThreads = 8
+        self.m.createRenameList(self.root)
+        self.assertEqual(list(self.m.getRenameList().iteritems()), serial)
+        self.assertEqual(self.m.progress, 100)
+        self.assertEqual(self.m._walkDone, self.m._walkLen)
+
+    def testInterrupt(self):
+        self.m.scanThreads = 4
+        self.m.interrupt = True
+        self.m.createRenameList(self.root)
+        self.assertEqual(len(self.m.getRenameList()), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Name        rename_tests_service.py
+Author      David Edmondson
+
+Tests service mode through its HTTP API: scan, plan and apply jobs, queueing,
+cancellation and invalid requests.
+"""
+
+import unittest, os, tempfile, shutil, threading, httplib, json
+from rename_model import Model
+from test.rename_tests_fixtures import makeModel
+from rename_service import Service, ServiceClient, readToken, TOKEN_HEADER
+
+class GatedModel(Model):
+    """Model whose scans wait until the gate is opened."""
+    def __init__(self, **kwargs):
+        Model.__init__(self, **kwargs)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def _scanRoot(self, path, plan):
+        while not self.gate.wait(0.05):
+            if self.interrupt:
+                return False
+        return Model._scanRoot(self, path, plan)
+
+    def applyRenameFile(self, fn, root=None):
+        self.gate.wait()
+        return Model.applyRenameFile(self, fn, root)
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self, GatedModel)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.service = Service(self.m)
+        self.address = self.service.start()
+        self.client = ServiceClient(self.address, readToken(self.m))
+
+        self.tempDir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tempDir, "refs")
+        os.makedirs(self.root)
+        for fn in ("a_b.jpg", "a-b.jpg", "c.png"):
+            open(os.path.join(self.root, fn), "w+b").close()
+
+    def tearDown(self):
+        self.m.gate.set()
+        self.service.stop()
+        shutil.rmtree(self.tempDir)
+
+    def testScan(self):
+        job = self.client.wait(self.client.submit(
+            {"type": "scan", "path": self.root,
+             "settings": {"capital": True}}))
+        self.assertEqual(job["state"], "done")
+        self.assertEqual(job["result"]["total"], 3)
+        self.assertEqual(sorted(new for _, new in job["result"]["renames"]),
+                         [os.path.join(self.root, fn)
+                          for fn in ("A B (1).jpg", "A B.jpg", "C.png")])
+        # Job settings do not outlive the job
+        self.assertFalse(self.m.getSettings()["capital"])
+        self.assertFalse(makeModel(self, dataRoot=self.m.dataRoot)
+                         .getSettings()["capital"])
+        self.assertEqual(self.client.status()["renameList"], 3)
+
+    def testPlanAndApply(self):
+        planFile = os.path.join(self.tempDir, "plan.jsonl")
+        self.client.submit({"type": "plan", "path": self.root,
+                            "planFile": planFile})
+        applyId = self.client.submit({"type": "apply", "planFile": planFile})
+        job = self.client.wait(applyId)
+        self.assertEqual(job["result"], {"renamed": 2, "skipped": 0})
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         ["a b (1).jpg", "a b.jpg", "c.png"])
+
+    def testQueueAndCancel(self):
+        """Test that jobs run one at a time, and that both queued and
+        running jobs can be cancelled."""
+        self.m.gate.clear()
+        first = self.client.submit({"type": "scan", "path": self.root})
+        second = self.client.submit({"type": "scan", "path": self.root})
+        self.assertEqual(self.client.status()["queued"], 1)
+        self.assertEqual(self.client.job(second)["state"], "queued")
+
+        self.assertEqual(self.client.cancel(second)["state"], "cancelled")
+        self.client.cancel(first)
+        self.assertEqual(self.client.wait(first)["state"], "cancelled")
+        self.assertEqual([job["state"] for job in self.client.jobs()],
+                         ["cancelled", "cancelled"])
+        self.assertFalse(self.m.interrupt)
+
+    def testCancelThenRun(self):
+        """Test that cancelling a running apply lets it finish, and that no
+        cancel leaks into the next job."""
+        planFile = os.path.join(self.tempDir, "plan.jsonl")
+        self.client.wait(self.client.submit(
+            {"type": "plan", "path": self.root, "planFile": planFile}))
+        self.m.gate.clear()
+        applyId = self.client.submit({"type": "apply", "planFile": planFile})
+        while self.client.job(applyId)["state"] != "running":
+            pass
+        self.assertEqual(self.client.cancel(applyId)["state"], "running")
+        self.m.gate.set()
+        job = self.client.wait(applyId)
+        self.assertEqual((job["state"], job["result"]),
+                         ("done", {"renamed": 2, "skipped": 0}))
+
+        self.m.gate.clear()
+        scanId = self.client.submit({"type": "scan", "path": self.root})
+        while self.client.job(scanId)["state"] != "running":
+            pass
+        self.client.cancel(scanId)
+        self.assertEqual(self.client.wait(scanId)["state"], "cancelled")
+        self.m.gate.set()
+        job = self.client.wait(self.client.submit(
+            {"type": "plan", "path": self.root, "planFile": planFile,
+             "settings": {"capital": True}}))
+        self.assertEqual((job["state"], job["result"]["renames"]),
+                         ("done", 3))
+
+    def testCancelPlan(self):
+        """Test that a cancelled plan job leaves an existing plan file as
+        it was."""
+        planFile = os.path.join(self.tempDir, "plan.jsonl")
+        self.client.wait(self.client.submit(
+            {"type": "plan", "path": self.root, "planFile": planFile}))
+        with open(planFile) as f:
+            before = f.read()
+        self.m.gate.clear()
+        planId = self.client.submit(
+            {"type": "plan", "path": self.root, "planFile": planFile})
+        while self.client.job(planId)["state"] != "running":
+            pass
+        self.client.cancel(planId)
+        job = self.client.wait(planId)
+        self.assertEqual(job["state"], "cancelled")
+        self.assertNotIn("result", job)
+        with open(planFile) as f:
+            self.assertEqual(f.read(), before)
+
+    def _post(self, body, headers):
+        conn = httplib.HTTPConnection(self.address, timeout=10)
+        try:
+            conn.request("POST", "/jobs", body, headers)
+            return conn.getresponse().status
+        finally:
+            conn.close()
+
+    def testRefusedRequests(self):
+        """Test that requests without the token, from web pages, or not
+        sent as JSON are refused, and queue nothing."""
+        body = json.dumps({"type": "scan", "path": self.root})
+        token = readToken(self.m)
+        self.assertEqual(self._post(body, {"Content-Type":
+                                           "application/json"}), 401)
+        self.assertEqual(self._post(body, {"Content-Type": "application/json",
+                                           TOKEN_HEADER: "wrong"}), 401)
+        self.assertEqual(self._post(body, {"Content-Type": "text/plain",
+                                           TOKEN_HEADER: token}), 415)
+        self.assertEqual(self._post(body, {"Content-Type": "application/json",
+                                           TOKEN_HEADER: token,
+                                           "Origin": "http://example.com"}),
+                         403)
+        self.assertEqual(self.client.jobs(), [])
+        self.assertEqual(self._post(body, {"Content-Type": "application/json",
+                                           TOKEN_HEADER: token}), 202)
+        self.assertEqual(readToken(makeModel(self, dataRoot=self.m.dataRoot)),
+                         token)
+
+    def testInvalidJobs(self):
+        self.assertRaises(ValueError,
+                          lambda: self.client.submit({"type": "format"}))
+        self.assertRaises(ValueError,
+                          lambda: self.client.submit({"type": "plan",
+                                                      "path": self.root}))
+        self.assertRaises(ValueError, lambda: self.client.job("99"))
+
+if __name__ == '__main__':
+    unittest.main()
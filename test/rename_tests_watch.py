@@ -0,0 +1,191 @@
+"""
+Name        rename_tests_watch.py
+Author      David Edmondson
+
+Tests watch mode: new images are normalized as they land, against an index of
+existing names, using both the inotify and polling watchers, and after
+events are lost.
+"""
+
+import unittest, os, errno, tempfile, shutil, threading, time
+from test.rename_tests_fixtures import makeModel
+from rename_watch import Watch, InotifyWatcher, PollingWatcher
+from rename_watch import ADDED, OVERFLOW
+
+class WatchTests(object):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, "inbox"))
+        open(os.path.join(self.root, "inbox", "tree bark.jpg"), "w+b").close()
+
+        self.watch = Watch(self.m, self.root, window=0.05,
+                           watcher=self.createWatcher())
+        self.thread = threading.Thread(target=self.watch.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.watch.stop()
+        self.thread.join()
+        shutil.rmtree(self.root)
+
+    def _drop(self, *parts):
+        open(os.path.join(self.root, *parts), "w+b").close()
+
+    def _waitFor(self, names, directory="inbox", timeout=1.0):
+        """Waits for a directory to contain exactly names. Returns the time
+        taken."""
+        start = time.time()
+        path = os.path.join(self.root, directory)
+        while time.time() - start < timeout:
+            if sorted(os.listdir(path)) == sorted(names):
+                return time.time() - start
+            time.sleep(0.01)
+        self.assertEqual(sorted(os.listdir(path)), sorted(names))
+
+    def testNewFiles(self):
+        """Test that dropped images are renamed within a second, colliding
+        with existing files is avoided, and other files are left alone."""
+        self._drop("inbox", "tree_bark.JPG")
+        self._drop("inbox", "rock--face.png")
+        self._drop("inbox", "notes.txt")
+        self._waitFor(["tree bark.jpg", "tree bark (1).jpg", "rock face.png",
+                       "notes.txt"])
+
+        # Renamed files stay as they are
+        time.sleep(0.2)
+        self._waitFor(["tree bark.jpg", "tree bark (1).jpg", "rock face.png",
+                       "notes.txt"])
+        self.assertEqual(self.watch.renamed, 2)
+
+    def testNewDirectory(self):
+        """Test that images in new directories are picked up."""
+        os.mkdir(os.path.join(self.root, "inbox", "new_folder"))
+        time.sleep(0.1)
+        self._drop("inbox", "new_folder", "sky_box.tga")
+        self._waitFor(["sky box.tga"], os.path.join("inbox", "new_folder"))
+
+class TestWatchPolling(WatchTests, unittest.TestCase):
+    def createWatcher(self):
+        return PollingWatcher(interval=0.05)
+
+class TestWatchInotify(WatchTests, unittest.TestCase):
+    def createWatcher(self):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError, TypeError):
+            self.skipTest("inotify not available")
+
+class NullWatcher(object):
+    """Watcher which never reports events, for feeding events directly."""
+    def add(self, path):
+        pass
+
+    def poll(self, timeout):
+        return []
+
+    def close(self):
+        pass
+
+class TestWatchOverflow(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " "})
+        self.root = tempfile.mkdtemp()
+        self.inbox = os.path.join(self.root, "inbox")
+        os.mkdir(self.inbox)
+        open(os.path.join(self.inbox, "tree bark.jpg"), "w+b").close()
+        self.watch = Watch(self.m, self.root, watcher=NullWatcher())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testOverflow(self):
+        """Test that after an overflow, files whose events arrived earlier in
+        the batch and files whose events were lost are all renamed once."""
+        for fn in ("rock_face.jpg", "sky_box.jpg", "tree_bark.png"):
+            open(os.path.join(self.inbox, fn), "w+b").close()
+        events = [(ADDED, self.inbox, "rock_face.jpg", False),
+                  (OVERFLOW, None, None, False)]
+        self.assertEqual(self.watch.processEvents(events), 3)
+        self.assertEqual(sorted(os.listdir(self.inbox)),
+                         ["rock face.jpg", "sky box.jpg", "tree bark.jpg",
+                          "tree bark.png"])
+
+class RecordingWatcher(NullWatcher):
+    """Watcher which records watches, failing like inotify for missing
+    directories."""
+    def __init__(self, calls):
+        self.calls = calls
+
+    def add(self, path):
+        if not os.path.isdir(path):
+            raise OSError(errno.ENOENT, "cannot watch " + path)
+        self.calls.append(("add", path))
+
+class TestWatchTree(unittest.TestCase):
+    def setUp(self):
+        self.m = makeModel(self)
+        self.m.changeSettings({"capital": False, "flickr": False,
+                               "delimiter": " ",
+                               "prune": {"refignore": True}})
+        self.root = tempfile.mkdtemp()
+        self.inbox = os.path.join(self.root, "inbox")
+        os.mkdir(self.inbox)
+        f = open(os.path.join(self.root, ".refignore"), "w+")
+        f.write("*_raw.*\nskip*/\n")
+        f.close()
+
+        self.calls = []
+        listDirectory = self.m._listDirectory
+        def recordList(root, pruner=None):
+            self.calls.append(("list", root))
+            return listDirectory(root, pruner)
+        self.m._listDirectory = recordList
+        self.watch = Watch(self.m, self.root,
+                           watcher=RecordingWatcher(self.calls))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testWatchBeforeList(self):
+        """Test that each directory is watched before it is listed."""
+        self.assertEqual(self.calls, [("add", self.root), ("list", self.root),
+                                      ("add", self.inbox),
+                                      ("list", self.inbox)])
+
+    def testNewDirectoryPruned(self):
+        """Test that new directories are pruned by .refignore files above
+        them."""
+        new = os.path.join(self.inbox, "new")
+        os.makedirs(os.path.join(new, "skip_me"))
+        os.mkdir(os.path.join(self.inbox, "skipped"))
+        for fn in ("sky_box.jpg", "tree_raw.jpg",
+                   os.path.join("skip_me", "rock_face.jpg")):
+            open(os.path.join(new, fn), "w+b").close()
+        open(os.path.join(self.inbox, "moss_raw.jpg"), "w+b").close()
+        events = [(ADDED, self.inbox, "new", True),
+                  (ADDED, self.inbox, "skipped", True),
+                  (ADDED, self.inbox, "moss_raw.jpg", False)]
+        self.assertEqual(self.watch.processEvents(events), 1)
+        self.assertEqual(sorted(os.listdir(new)),
+                         ["skip_me", "sky box.jpg", "tree_raw.jpg"])
+        self.assertNotIn(os.path.join(self.inbox, "skipped"),
+                         self.watch._index.dirs)
+
+    def testVanishedDirectory(self):
+        """Test that a directory removed before it could be watched is
+        skipped."""
+        os.mkdir(os.path.join(self.inbox, "gone"))
+        os.mkdir(os.path.join(self.inbox, "kept"))
+        open(os.path.join(self.inbox, "kept", "sky_box.jpg"), "w+b").close()
+        os.rmdir(os.path.join(self.inbox, "gone"))
+        events = [(ADDED, self.inbox, "gone", True),
+                  (ADDED, self.inbox, "kept", True)]
+        self.assertEqual(self.watch.processEvents(events), 1)
+
+if __name__ == '__main__':
+    unittest.main()